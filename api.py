@@ -0,0 +1,227 @@
+"""
+Programmatic API.
+
+Functions here report per-item failures in their results instead of exiting,
+so that a long-running caller keeps its browsers and caches warm after a bad
+item. Invalid arguments still raise (ValueError, TypeError). The CLI is a thin
+wrapper around this module.
+"""
+
+import logging
+import os
+import tempfile
+import time
+
+from typing import Iterable, Iterator, Optional
+
+import diskspace
+import downloader
+import extractor
+import governor
+import inventory
+import retry
+import segcache
+import workqueue
+from config import Settings
+from governor import DEFAULT_INITIAL_CONNECTIONS
+from inventory import InventoryItem
+from jobdb import Job, JobState, output_filename_for
+from mpdparse import MPD_PARSERS
+from stream import CONTAINERS, container_extension
+from streamindex import parse_selector
+
+logger = logging.getLogger(__name__)
+
+
+class JobResult:
+    def __init__(
+        self,
+        source: str,
+        output_path: Optional[str] = None,
+        manifest_url: Optional[str] = None,
+        license_url: Optional[str] = None,
+        error: Optional[str] = None,
+        exception: Optional[BaseException] = None,
+        elapsed: Optional[float] = None,
+    ):
+        # Page URL or manifest given by the caller
+        self.source: str = source
+
+        self.output_path: Optional[str] = output_path
+        self.manifest_url: Optional[str] = manifest_url
+        self.license_url: Optional[str] = license_url
+
+        # "ExceptionType: message" of the failure; the exception itself is only
+        # available when it was raised in this process (not for resumed jobs)
+        self.error: Optional[str] = error
+        self.exception: Optional[BaseException] = exception
+
+        self.elapsed: Optional[float] = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @staticmethod
+    def from_job(job: Job) -> "JobResult":
+        elapsed = None
+        if job.started_at is not None and job.muxed_at is not None:
+            elapsed = job.muxed_at - job.started_at
+
+        return JobResult(
+            job.url,
+            job.output_path if job.state == JobState.MUXED else None,
+            job.manifest_url,
+            job.license_url,
+            job.error if job.state == JobState.FAILED else None,
+            elapsed=elapsed,
+        )
+
+
+def configure(settings: Settings):
+    """Set up the process-wide retry policy, disk tracker, cache and governor."""
+    if settings.container is not None and settings.container not in CONTAINERS:
+        raise ValueError(f"Unsupported container: {settings.container}")
+
+    if settings.mpd_parser not in MPD_PARSERS:
+        raise ValueError(f"Unsupported MPD parser: {settings.mpd_parser}")
+
+    # Fail before the batch starts rather than on every job
+    for selector in (settings.video_stream, settings.audio_stream):
+        if selector is not None:
+            parse_selector(selector)
+
+    retry.configure(**settings.retry)
+    diskspace.configure(margin=settings.disk_margin)
+    segcache.configure(settings.cache_dir, settings.cache_size, settings)
+
+    governor.configure(
+        max_connections=settings.max_connections,
+        initial_connections=min(DEFAULT_INITIAL_CONNECTIONS, settings.max_connections),
+        max_jobs=settings.jobs,
+        bandwidth_cap=settings.bandwidth_cap,
+    )
+
+
+def resolve(url: str, settings: Optional[Settings] = None) -> tuple[str, str]:
+    """Manifest and license URLs of a page; raises errors.ExtractionError on failure."""
+    return extractor.resolve_manifest_and_license(url, settings=settings)
+
+
+def download(
+    url: Optional[str] = None,
+    manifest: Optional[str] = None,
+    license_url: Optional[str] = None,
+    output: Optional[str] = None,
+    audio_stream: Optional[str] = None,
+    video_stream: Optional[str] = None,
+    subtitles: bool = False,
+    settings: Optional[Settings] = None,
+) -> JobResult:
+    """
+    Download one page URL, or one manifest with its license URL. Without an
+    `output`, the file is named after the URL, as in batches. Each call works
+    in its own directory under `settings.scratch_dir`, so concurrent calls do
+    not share intermediate files.
+    """
+    if url is None and manifest is None:
+        raise ValueError("Either url or manifest must be given")
+
+    if url is None and license_url is None:
+        raise ValueError("A manifest can only be downloaded with its license URL")
+
+    if settings is None:
+        settings = Settings()
+
+    if output is None:
+        output = output_filename_for(url or manifest, container_extension(settings.container))
+
+    result = JobResult(url or manifest, manifest_url=manifest, license_url=license_url)
+    start = time.monotonic()
+
+    try:
+        os.makedirs(settings.scratch_dir, exist_ok=True)
+
+        with (
+            retry.POLICY.job(),
+            tempfile.TemporaryDirectory(prefix="api-", dir=settings.scratch_dir) as workdir,
+        ):
+            if url is not None:
+                result.manifest_url, result.license_url = resolve(url, settings)
+
+            result.output_path = downloader.download_by_manifest_and_license_url(
+                result.manifest_url,
+                result.license_url,
+                subtitles,
+                audio_stream,
+                video_stream,
+                output,
+                settings,
+                workdir,
+            )
+    except Exception as e:
+        logger.error(f"Failed to download {result.source}: {e}")
+        result.error = f"{type(e).__name__}: {e}"
+        result.exception = e
+
+    result.elapsed = time.monotonic() - start
+    return result
+
+
+def download_batch(
+    filepath: str,
+    subtitles: bool = False,
+    follow: bool = False,
+    settings: Optional[Settings] = None,
+) -> list[JobResult]:
+    """Download every URL of `filepath` (see `downloader.download_by_file`)."""
+    jobs = downloader.download_by_file(filepath, subtitles, follow, settings)
+    return [JobResult.from_job(job) for job in jobs]
+
+
+def enqueue(urls: Iterable[str], settings: Settings) -> int:
+    """Add `urls` to the shared queue of `settings.queue`; returns how many were new."""
+    if settings.queue is None:
+        raise ValueError("No queue configured")
+
+    def valid(urls):
+        for url in urls:
+            if downloader.is_opto_url(url):
+                yield url
+            else:
+                logger.warning(f"Skipping invalid URL: {url}")
+
+    queue = workqueue.open_queue(settings.queue, settings)
+
+    try:
+        return queue.put(valid(urls))
+    finally:
+        queue.close()
+
+
+def run_worker(
+    subtitles: bool = False,
+    drain: bool = False,
+    settings: Optional[Settings] = None,
+) -> list[JobResult]:
+    """Download URLs from the shared queue of `settings.queue` (see `workqueue.run_worker`)."""
+    if settings is None or settings.queue is None:
+        raise ValueError("No queue configured")
+
+    queue = workqueue.open_queue(settings.queue, settings)
+
+    try:
+        jobs = workqueue.run_worker(queue, subtitles, drain, settings)
+    finally:
+        queue.close()
+
+    return [JobResult.from_job(job) for job in jobs]
+
+
+def list_streams(
+    urls: Iterable[str] = (),
+    manifests: Iterable[str] = (),
+    settings: Optional[Settings] = None,
+) -> Iterator[InventoryItem]:
+    """Streams of each page URL and manifest; failed items carry an `error`."""
+    return inventory.inspect_sources(urls, manifests, settings)
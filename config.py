@@ -0,0 +1,371 @@
+"""
+Layered settings.
+
+The settings a node may need to tune (concurrency, timeouts, cache sizes,
+scratch paths, tool locations...) are resolved from, in increasing order of
+precedence: the defaults in `defaults.py`, a TOML or JSON config file,
+`OPTO_DL_*` environment variables and command line flags. The resulting
+`Settings` object is passed explicitly to the library functions.
+"""
+
+import json
+import logging
+import os
+import re
+
+from typing import Any, Callable, Mapping, Optional
+
+from defaults import (
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_CONFIG_PATHS,
+    DEFAULT_DISK_MARGIN,
+    DEFAULT_JOB_DB_FILENAME,
+    DEFAULT_LEASE_TIME,
+    DEFAULT_MAX_CONNECTIONS,
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_QUEUE_ATTEMPTS,
+    DEFAULT_SCHEDULE_WINDOW,
+    DEFAULT_SCRATCH_DIR,
+    DEFAULT_SUBTITLE_FORMAT,
+    DEFAULT_TIMEOUT,
+)
+from logs import LOG_FORMATS
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+logger = logging.getLogger(__name__)
+
+ENV_PREFIX = "OPTO_DL_"
+
+
+def parse_size(size) -> int:
+    """Parse a size such as 500K, 20M or 1.5G into bytes."""
+    if size is None:
+        raise ValueError("size cannot be None")
+
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", size, re.IGNORECASE)
+
+    if match is None:
+        raise ValueError(f"Invalid size: {size}")
+
+    multiplier = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}[
+        match.group(2).upper()
+    ]
+
+    return int(float(match.group(1)) * multiplier)
+
+
+def parse_seconds(value) -> float:
+    """Parse a duration such as 90, 45m, 2h or 1h30m into seconds."""
+    if value is None:
+        raise ValueError("value cannot be None")
+
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    match = re.fullmatch(
+        r"\s*(?:(\d+(?:\.\d+)?)h)?\s*(?:(\d+(?:\.\d+)?)m)?\s*(?:(\d+(?:\.\d+)?)s?)?\s*",
+        value,
+        re.IGNORECASE,
+    )
+
+    if match is None or not any(match.groups()):
+        raise ValueError(f"Invalid duration: {value}")
+
+    hours, minutes, seconds = (float(g) if g else 0.0 for g in match.groups())
+    return (hours * 60 + minutes) * 60 + seconds
+
+
+def parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+
+    if str(value).strip().lower() in ("1", "true", "yes", "on"):
+        return True
+
+    if str(value).strip().lower() in ("0", "false", "no", "off"):
+        return False
+
+    raise ValueError(f"Invalid boolean: {value}")
+
+
+class Settings:
+    def __init__(
+        self,
+        timeout: int = DEFAULT_TIMEOUT,
+        jobs: int = 1,
+        inspect_jobs: int = DEFAULT_MAX_WORKERS,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        host_jobs: Optional[int] = None,
+        schedule_window: int = DEFAULT_SCHEDULE_WINDOW,
+        bandwidth_cap: Optional[int] = None,
+        disk_margin: int = DEFAULT_DISK_MARGIN,
+        cache_dir: Optional[str] = None,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        scratch_dir: str = DEFAULT_SCRATCH_DIR,
+        job_db: str = DEFAULT_JOB_DB_FILENAME,
+        queue: Optional[str] = None,
+        lease_time: int = DEFAULT_LEASE_TIME,
+        queue_attempts: int = DEFAULT_QUEUE_ATTEMPTS,
+        subtitle_format: str = DEFAULT_SUBTITLE_FORMAT,
+        container: Optional[str] = None,
+        mpd_parser: str = "lxml",
+        live_duration: Optional[float] = None,
+        live_from_start: bool = False,
+        video_stream: Optional[str] = None,
+        audio_stream: Optional[str] = None,
+        headless: bool = True,
+        lean_browser: bool = True,
+        ffmpeg: str = "ffmpeg",
+        mp4decrypt: str = "mp4decrypt",
+        yt_dlp: str = "yt-dlp",
+        log_format: str = "text",
+        quiet: bool = False,
+        progress: Optional[bool] = None,
+        retry: Optional[dict] = None,
+    ):
+        if timeout <= 0:
+            raise ValueError("timeout must be positive")
+
+        if jobs < 1 or inspect_jobs < 1:
+            raise ValueError("jobs must be at least 1")
+
+        if (host_jobs is not None and host_jobs < 1) or schedule_window < 1:
+            raise ValueError("host_jobs and schedule_window must be at least 1")
+
+        if lease_time <= 0 or queue_attempts < 1:
+            raise ValueError("lease_time must be positive and queue_attempts at least 1")
+
+        if live_duration is not None and live_duration <= 0:
+            raise ValueError("live_duration must be positive")
+
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f"log_format must be one of {', '.join(LOG_FORMATS)}")
+
+        # Seconds for HTTP requests, and for the player to request the manifest
+        self.timeout: int = timeout
+
+        # Concurrent downloads (--file) and concurrent inspections (--list-streams)
+        self.jobs: int = jobs
+        self.inspect_jobs: int = inspect_jobs
+
+        self.max_connections: int = max_connections
+
+        # Batch scheduling (see scheduler): concurrent jobs per manifest host,
+        # None for no limit but `jobs`, and jobs read ahead of the workers
+        self.host_jobs: Optional[int] = host_jobs
+        self.schedule_window: int = schedule_window
+        self.bandwidth_cap: Optional[int] = bandwidth_cap
+
+        self.disk_margin: int = disk_margin
+        self.cache_dir: Optional[str] = cache_dir
+        self.cache_size: int = cache_size
+
+        # Per-job work directories and the batch job database
+        self.scratch_dir: str = scratch_dir
+        self.job_db: str = job_db
+
+        # Shared queue of the distributed worker mode (see workqueue.open_queue),
+        # seconds a claimed URL stays leased without a heartbeat, and attempts
+        # (failures or expired leases) before a URL is marked failed
+        self.queue: Optional[str] = queue
+        self.lease_time: int = lease_time
+        self.queue_attempts: int = queue_attempts
+
+        self.subtitle_format: str = subtitle_format
+
+        # Output container (see stream.CONTAINERS), None to follow the output name
+        self.container: Optional[str] = container
+
+        # MPD parser (see mpdparse.MPD_PARSERS): the streaming lxml one, or mpegdash
+        self.mpd_parser: str = mpd_parser
+
+        # Live manifests: seconds of media to record (None until the event
+        # ends), and whether to start at the beginning of the time-shift
+        # window instead of the live edge
+        self.live_duration: Optional[float] = live_duration
+        self.live_from_start: bool = live_from_start
+
+        # Stream selectors applied to every job (see streamindex), e.g. video:height<=720
+        self.video_stream: Optional[str] = video_stream
+        self.audio_stream: Optional[str] = audio_stream
+
+        self.headless: bool = headless
+        self.lean_browser: bool = lean_browser
+
+        # External tools, names on the PATH or absolute paths
+        self.ffmpeg: str = ffmpeg
+        self.mp4decrypt: str = mp4decrypt
+        self.yt_dlp: str = yt_dlp
+
+        # Logging of the CLI; quiet only logs warnings and errors. The batch
+        # dashboard is shown when stderr is a terminal unless progress is set
+        self.log_format: str = log_format
+        self.quiet: bool = quiet
+        self.progress: Optional[bool] = progress
+
+        # Keyword arguments of retry.RetryPolicy
+        self.retry: dict = retry if retry is not None else {}
+
+    def merged(self, overrides: Mapping[str, Any]) -> "Settings":
+        """A copy with `overrides` applied; the retry settings are merged key by key."""
+        fields = dict(vars(self))
+
+        for name, value in overrides.items():
+            if name == "retry":
+                fields["retry"] = {**self.retry, **value}
+            else:
+                fields[name] = value
+
+        return Settings(**fields)
+
+
+# How each setting is parsed from the environment and from config files
+FIELD_PARSERS: dict[str, Callable[[Any], Any]] = {
+    "timeout": int,
+    "jobs": int,
+    "inspect_jobs": int,
+    "max_connections": int,
+    "host_jobs": int,
+    "schedule_window": int,
+    "bandwidth_cap": parse_size,
+    "disk_margin": parse_size,
+    "cache_dir": str,
+    "cache_size": parse_size,
+    "scratch_dir": str,
+    "job_db": str,
+    "queue": str,
+    "lease_time": int,
+    "queue_attempts": int,
+    "subtitle_format": str,
+    "container": str,
+    "mpd_parser": str,
+    "live_duration": parse_seconds,
+    "live_from_start": parse_bool,
+    "video_stream": str,
+    "audio_stream": str,
+    "headless": parse_bool,
+    "lean_browser": parse_bool,
+    "ffmpeg": str,
+    "mp4decrypt": str,
+    "yt_dlp": str,
+    "log_format": str,
+    "quiet": parse_bool,
+    "progress": parse_bool,
+}
+
+
+def parse_fields(values: Mapping[str, Any], source: str) -> dict:
+    fields = {}
+
+    for name, value in values.items():
+        if name == "retry":
+            if not isinstance(value, dict):
+                raise ValueError(f"retry must be a table in {source}")
+
+            fields["retry"] = value
+            continue
+
+        if name not in FIELD_PARSERS:
+            raise ValueError(f"Unknown setting {name} in {source}")
+
+        try:
+            fields[name] = FIELD_PARSERS[name](value)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid value for {name} in {source}: {e}") from e
+
+    return fields
+
+
+def load_file(path: str) -> dict:
+    """Read a TOML or JSON file, e.g. opto-dl.toml or the --retry-config file."""
+    if path is None:
+        raise ValueError("path cannot be None")
+
+    if path.lower().endswith(".toml"):
+        if tomllib is None:
+            raise ValueError("TOML configuration files need Python 3.11 or newer")
+
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def from_environ(environ: Mapping[str, str]) -> dict:
+    """
+    Settings from the OPTO_DL_* variables; OPTO_DL_RETRY holds a JSON object.
+    Unknown variables are ignored, as they may be meant for other tools.
+    """
+    values = {}
+
+    for name, value in environ.items():
+        if not name.startswith(ENV_PREFIX) or name == f"{ENV_PREFIX}CONFIG":
+            continue
+
+        field = name[len(ENV_PREFIX) :].lower()
+
+        if field == "retry":
+            try:
+                value = json.loads(value)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON in {name}: {e}") from e
+        elif field not in FIELD_PARSERS:
+            logger.warning(f"Ignoring unknown setting {name} in the environment")
+            continue
+
+        values[field] = value
+
+    return parse_fields(values, "the environment")
+
+
+def find_config_file(environ: Mapping[str, str]) -> Optional[str]:
+    path = environ.get(f"{ENV_PREFIX}CONFIG")
+    if path:
+        return path
+
+    for candidate in DEFAULT_CONFIG_PATHS:
+        candidate = os.path.expanduser(candidate)
+        if os.path.isfile(candidate):
+            return candidate
+
+    return None
+
+
+def load_settings(
+    config_path: Optional[str] = None,
+    overrides: Optional[Mapping[str, Any]] = None,
+    environ: Optional[Mapping[str, str]] = None,
+) -> Settings:
+    """
+    Resolve the settings from the defaults, the config file (`config_path`,
+    $OPTO_DL_CONFIG or the first of DEFAULT_CONFIG_PATHS that exists), the
+    environment and `overrides`, whose None values are ignored.
+    """
+    if environ is None:
+        environ = os.environ
+
+    settings = Settings()
+
+    if config_path is None:
+        config_path = find_config_file(environ)
+
+    if config_path is not None:
+        logger.info(f"Reading settings from {config_path}")
+        settings = settings.merged(parse_fields(load_file(config_path), config_path))
+
+    settings = settings.merged(from_environ(environ))
+
+    if overrides:
+        settings = settings.merged(
+            {name: value for name, value in overrides.items() if value is not None}
+        )
+
+    return settings
@@ -0,0 +1,97 @@
+"""
+Live dashboard of a batch download (`-f`), drawn with rich on stderr.
+
+It shows the stage, bytes and rate of every running job, the aggregate
+throughput, the batch ETA and the resource most jobs are waiting on, so that
+a long run can be seen at a glance to be browser-, bandwidth- or disk-bound.
+Log records are printed above it (see `logs.setup_logging`).
+"""
+
+import sys
+
+import progress
+
+from diskspace import format_size
+from progress import DOWNLOADING, format_duration, format_rate
+
+try:
+    from rich.console import Console, Group
+    from rich.live import Live
+    from rich.table import Table
+    from rich.text import Text
+except ImportError:
+    sys.stderr.write("Error: rich module not found. Install it with: pip install rich\n")
+    sys.exit(1)
+
+REFRESH_PER_SECOND: float = 2
+
+# Running jobs listed individually; the others are only counted
+MAX_ROWS: int = 20
+
+
+class Dashboard:
+    def __init__(self, console: Console = None):
+        self.console: Console = console if console is not None else Console(stderr=True)
+        self._live = Live(
+            console=self.console,
+            refresh_per_second=REFRESH_PER_SECOND,
+            get_renderable=self.render,
+            transient=False,
+        )
+
+    def __enter__(self):
+        self._live.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._live.stop()
+
+    def render(self):
+        # The tracker is replaced at the start of each batch
+        tracker = progress.TRACKER
+        tracker.sample()
+
+        summary = tracker.summary()
+        total = summary["total"]
+        more = "" if summary["input_closed"] else "+"
+
+        header = Text.assemble(
+            ("Batch ", "bold"),
+            f"{summary['done']}/{total if total is not None else '?'}{more} done",
+            (f", {summary['failed']} failed", "red" if summary["failed"] else ""),
+            f", {summary['skipped']} skipped, {summary['active']} running  ",
+            (format_rate(tracker.rate), "bold cyan"),
+            f"  {format_size(tracker.bytes)}  ETA ",
+            (format_duration(summary["eta"]), "bold"),
+        )
+
+        stages = Text("  ".join(f"{stage}: {n}" for stage, n in summary["stages"].items()))
+        if summary["bottleneck"] is not None:
+            stages.append(f"  bound by {summary['bottleneck']}", style="bold yellow")
+
+        table = Table(show_header=True, header_style="bold", expand=True)
+        table.add_column("Job", overflow="ellipsis", no_wrap=True, ratio=1)
+        table.add_column("Stage")
+        table.add_column("Downloaded", justify="right")
+        table.add_column("Rate", justify="right")
+        table.add_column("ETA", justify="right")
+
+        active = tracker.active_jobs()
+
+        for job in active[:MAX_ROWS]:
+            size = format_size(job.bytes)
+            if job.expected_bytes:
+                size += f" / {format_size(job.expected_bytes)}"
+
+            table.add_row(
+                job.url,
+                job.stage,
+                size,
+                format_rate(job.rate) if job.stage == DOWNLOADING else "--",
+                format_duration(job.eta),
+            )
+
+        if len(active) > MAX_ROWS:
+            table.add_row(f"... and {len(active) - MAX_ROWS} more", "", "", "", "")
+
+        return Group(header, stages, table)
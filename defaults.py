@@ -5,3 +5,14 @@ DEFAULT_DECRYPTED_AUDIO_FILENAME: str = "OK_audio.m4a"
 DEFAULT_ENCRYPTED_VIDEO_FILENAME: str = "manifest [manifest].mp4"
 DEFAULT_DECRYPTED_VIDEO_FILENAME: str = "OK_video.mp4"
 DEFAULT_MERGED_VIDEO_FILENAME: str = "Ficheiro_Final.mp4"
+DEFAULT_JOB_DB_FILENAME: str = "opto-dl.sqlite3"
+DEFAULT_SCRATCH_DIR: str = ".opto-dl"
+DEFAULT_SUBTITLE_FILENAME_PREFIX: str = "OK_subtitle"
+DEFAULT_SUBTITLE_FORMAT: str = "vtt"
+DEFAULT_MAX_CONNECTIONS: int = 16
+DEFAULT_DISK_MARGIN: int = 1024**3
+DEFAULT_CACHE_SIZE: int = 10 * 1024**3
+DEFAULT_CONFIG_PATHS: tuple[str, ...] = ("opto-dl.toml", "~/.config/opto-dl/config.toml")
+DEFAULT_LEASE_TIME: int = 60
+DEFAULT_QUEUE_ATTEMPTS: int = 3
+DEFAULT_SCHEDULE_WINDOW: int = 10000
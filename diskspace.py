@@ -0,0 +1,145 @@
+"""
+Disk-space-aware admission for the download stage.
+
+Before a job starts downloading it reserves its estimated peak scratch usage
+(see `stream.estimate_job_size`). A reservation is only granted while the
+free space, minus what the other running jobs still have to write, stays
+above a safety margin; otherwise the job waits for them to finish instead of
+failing halfway through a merge.
+"""
+
+import logging
+import os
+import shutil
+import threading
+
+from contextlib import contextmanager
+from typing import Optional
+
+from defaults import DEFAULT_DISK_MARGIN
+from errors import OptoDLError
+from utils import directory_size
+
+logger = logging.getLogger(__name__)
+
+# How often a waiting job re-checks the free space, in seconds
+POLL_INTERVAL: float = 5.0
+
+
+class InsufficientDiskSpaceError(OptoDLError, OSError):
+    pass
+
+
+def format_size(nbytes: Optional[int]) -> str:
+    if nbytes is None:
+        return "--"
+
+    size = float(nbytes)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+    return f"{size:.1f} TiB"
+
+
+class Reservation:
+    def __init__(self, pool: "DiskSpace"):
+        self._pool: DiskSpace = pool
+        self.path: Optional[str] = None
+        self.device: Optional[int] = None
+        self.nbytes: int = 0
+
+    def outstanding(self) -> int:
+        """Part of the reservation that has not been written to disk yet."""
+        if self.path is None or not os.path.isdir(self.path):
+            return self.nbytes
+
+        return max(0, self.nbytes - directory_size(self.path))
+
+    def acquire(self, path: str, nbytes: int):
+        self._pool.acquire(self, path, nbytes)
+
+    def release(self):
+        self._pool.release(self)
+
+
+class DiskSpace:
+    def __init__(self, margin: int = DEFAULT_DISK_MARGIN):
+        if margin < 0:
+            raise ValueError("margin cannot be negative")
+
+        self.margin: int = margin
+        self._reservations: list[Reservation] = []
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def reservation(self):
+        """
+        Scope of a job's disk usage. The job calls `acquire` once it knows
+        its size; the reservation is released when the scope ends.
+        """
+        r = Reservation(self)
+
+        try:
+            yield r
+        finally:
+            r.release()
+
+    def available(self, path: str) -> int:
+        """Free space on the device of `path` that is not promised to running jobs."""
+        device = os.stat(path).st_dev
+        reserved = sum(r.outstanding() for r in self._reservations if r.device == device)
+
+        return shutil.disk_usage(path).free - reserved - self.margin
+
+    def acquire(self, reservation: Reservation, path: str, nbytes: int):
+        if path is None:
+            raise ValueError("path cannot be None")
+
+        os.makedirs(path, exist_ok=True)
+
+        # Files already in `path`, e.g. the tracks of a resumed job, are written
+        needed = max(0, nbytes - directory_size(path))
+
+        with self._cond:
+            while self.available(path) < needed:
+                others = [r for r in self._reservations if r is not reservation]
+
+                if not others:
+                    raise InsufficientDiskSpaceError(
+                        f"Need {format_size(needed)} in {path}, only "
+                        f"{format_size(max(0, self.available(path)))} available "
+                        f"(keeping a {format_size(self.margin)} margin)"
+                    )
+
+                logger.info(
+                    f"Waiting for disk space: need {format_size(needed)}, "
+                    f"{len(others)} job(s) still writing"
+                )
+                self._cond.wait(POLL_INTERVAL)
+
+            reservation.path = path
+            reservation.device = os.stat(path).st_dev
+            reservation.nbytes = nbytes
+
+            if reservation not in self._reservations:
+                self._reservations.append(reservation)
+
+        logger.info(f"Reserved {format_size(nbytes)} in {path}")
+
+    def release(self, reservation: Reservation):
+        with self._cond:
+            if reservation in self._reservations:
+                self._reservations.remove(reservation)
+                self._cond.notify_all()
+
+
+DISK_SPACE = DiskSpace()
+
+
+def configure(**kwargs) -> DiskSpace:
+    """Replace the process-wide disk space tracker."""
+    global DISK_SPACE
+    DISK_SPACE = DiskSpace(**kwargs)
+    return DISK_SPACE
@@ -1,99 +1,285 @@
+import functools
+import itertools
 import logging
-import pprint
 import subprocess
 import shutil
-import sys
 import os
-from typing import Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional
+from urllib.parse import urljoin
 
+import diskspace
 import extractor
+import governor
+import live
+import mpdparse
+import progress
+import retry
+import segcache
 import stream
-from defaults import DEFAULT_MAX_WORKERS
+from config import Settings
+from defaults import (
+    DEFAULT_DECRYPTED_AUDIO_FILENAME,
+    DEFAULT_DECRYPTED_VIDEO_FILENAME,
+    DEFAULT_ENCRYPTED_AUDIO_FILENAME,
+    DEFAULT_ENCRYPTED_VIDEO_FILENAME,
+    DEFAULT_SUBTITLE_FILENAME_PREFIX,
+)
+from diskspace import Reservation, format_size
+from errors import DownloadError, ExtractionError, JobCancelledError, ManifestError
+from errors import MissingDependencyError, StreamNotFoundError
+from intake import STDIN, Request, iter_lines, iter_requests, source_name
+from jobdb import Job, JobDB, JobState, output_filename_for
+from scheduler import Scheduler
+from segcache import SegmentCache
+from segments import initialization_url, media_segments
+from streamindex import StreamIndex
+from subtitles import SubtitleTrack, find_tracks, language_tag, track_path
+from subtitles import convert as convert_subtitles
 from stream import (
     get_pssh,
     fix_video,
     fix_audio,
     merge_streams,
     Stream,
-    get_stream_by_id,
     choose_best_video,
     StreamType,
     choose_best_audio,
+    estimate_job_size,
+    container_extension,
 )
-from utils import get_urls, cleanup, download_file
-
-try:
-    from mpegdash.parser import MPEGDASHParser
-except ImportError:
-    sys.stderr.write("Error: mpegdash module not found. Install it with: pip install mpegdash\n")
-    sys.exit(1)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] [%(module)s.%(funcName)s:%(lineno)d] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+from utils import cleanup, directory_size, download_file
 
 logger = logging.getLogger(__name__)
 
 
 def download_by_file(
-    filepath: str, multithreading: bool = False, workers: int = DEFAULT_MAX_WORKERS
-):
+    filepath: str,
+    to_download_subtitles: bool = False,
+    follow: bool = False,
+    settings: Optional[Settings] = None,
+) -> list[Job]:
+    """
+    Download every URL of `filepath`, `settings.jobs` at a time, and return
+    the jobs this run processed, finished or failed.
+    """
     if filepath is None:
-        raise ValueError("")
+        raise ValueError("filepath cannot be None")
+
+    if settings is None:
+        settings = Settings()
 
     if not isinstance(filepath, str):
-        logger.fatal(f"Invalid type for filepath: Expected str, got {type(filepath).__name__}")
+        raise TypeError(f"Invalid type for filepath: Expected str, got {type(filepath).__name__}")
+
+    if filepath != STDIN and not os.path.exists(filepath):
+        raise FileNotFoundError(f"File {filepath} does not exist")
+
+    logger.info(f"Downloading from {'stdin' if filepath == STDIN else filepath}")
+
+    # The total grows as the input is read, so work starts on the first URL
+    tracker = progress.configure()
+
+    incoming = iter_requests(iter_lines(filepath, follow), source_name(filepath))
+    scheduler = Scheduler(settings.host_jobs, settings.schedule_window)
+    counter = itertools.count(1)
+    errors = []
+
+    with JobDB(settings.job_db) as db:
+        # The window of the scheduler bounds how far ahead of the workers
+        # URLs are pulled from the input
+        def feed():
+            try:
+                for job, request in pending_jobs(db, incoming, settings):
+                    scheduler.put(job, request)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                tracker.close_input()
+                scheduler.close()
+
+        def work() -> list[Job]:
+            processed = []
+
+            while (entry := scheduler.get()) is not None:
+                logger.info(
+                    f"Downloading {entry.job.url} [#{next(counter)}, priority "
+                    f"{entry.request.priority}, source {entry.source}]"
+                )
 
-    if not os.path.exists(filepath):
-        logger.fatal(f"File {filepath} does not exist")
-        sys.exit(1)
+                try:
+                    admit = functools.partial(scheduler.admit, entry)
+                    processed.append(
+                        process_job(db, entry.job, to_download_subtitles, settings, admit=admit)
+                    )
+                finally:
+                    scheduler.done(entry)
 
-    with open(filepath, "r", encoding="utf-8") as f:
-        text = f.read()
+            return processed
 
-    logger.info(f"Downloading from {filepath}")
+        feeder = threading.Thread(target=feed, name="intake", daemon=True)
+        feeder.start()
 
-    urls: list[str] = get_urls(text)
-    logger.info(f'URLs found: {"\n".join(urls)}')
+        with ThreadPoolExecutor(max_workers=settings.jobs) as executor:
+            futures = [executor.submit(work) for _ in range(settings.jobs)]
 
-    if not multithreading:
-        counter = 1
-        for url in urls:
-            if not "opto.sic.pt" in url:
-                logger.warning(f"Skipping invalid URL: {url}")
-                continue
+        feeder.join()
 
-            logger.info(f"Downloading {url} [{counter}/{len(urls)}]")
-            download_by_url(url, f"file_{counter}.mp4")
-            counter += 1
-            cleanup()
-    else:
-        raise NotImplementedError("")
-        """
-        # TODO: Check that Url is valid
-        urls_with_counter = [(i + 1, url) for i, url in enumerate(urls)]
-
-        def download_task(counter: int, url: str):
-            logger.info(f"Downloading {url} [{counter}/{len(urls)}]")
-            download_by_url(url, f"file_{counter}.mp4")
-            return counter, url
-
-        with ThreadPoolExecutor(max_workers=min(len(urls), workers)) as executor:
-            futures = {
-                executor.submit(download_task, counter, url): (counter, url)
-                for counter, url in urls_with_counter
-            }
-
-            for future in as_completed(futures):
-                counter, url = futures[future]
-                try:
-                    future.result()
-                    logger.info(f"Completed download {counter}/{len(urls)}")
-                except Exception as e:
-                    logger.error(f"Failed to download {url}: {e}")
-        """
+        if errors:
+            raise errors[0]
+
+        return [job for future in futures for job in future.result()]
+
+
+def is_opto_url(url: str) -> bool:
+    return "opto.sic.pt" in url
+
+
+def pending_jobs(
+    db: JobDB, requests: Iterable[Request], settings: Optional[Settings] = None
+) -> Iterator[tuple[Job, Request]]:
+    if settings is None:
+        settings = Settings()
+
+    extension = container_extension(settings.container)
+
+    for request in requests:
+        url = request.url
+
+        if not is_opto_url(url):
+            logger.warning(f"Skipping invalid URL: {url}")
+            continue
+
+        job, _ = db.add(url, output_filename_for(url, extension))
+
+        if job.done:
+            logger.info(f"Skipping completed URL: {url} -> {job.output_path}")
+            progress.TRACKER.skip()
+            continue
+
+        progress.TRACKER.add(job.key, job.url, job_workdir(job, settings))
+
+        yield job, request
+
+
+def job_workdir(job: Job, settings: Settings) -> str:
+    return os.path.join(settings.scratch_dir, job.key)
+
+
+def process_job(
+    db: JobDB,
+    job: Job,
+    to_download_subtitles: bool = False,
+    settings: Optional[Settings] = None,
+    cancelled: Optional[threading.Event] = None,
+    admit: Optional[Callable[[str], None]] = None,
+) -> Job:
+    """
+    Run the pipeline for a single batch job, skipping every stage that a
+    previous run already completed and recording progress as it goes.
+    Failures are recorded on the returned job instead of being raised. Once
+    `cancelled` is set, the job stops before its next stage. `admit` is
+    called with the manifest URL once the page is resolved, and may block
+    until the job can download from its host.
+    """
+    if job is None:
+        raise ValueError("job cannot be None")
+
+    if settings is None:
+        settings = Settings()
+
+    workdir = job_workdir(job, settings)
+    os.makedirs(workdir, exist_ok=True)
+
+    db.start(job)
+    resume_stage = job.resume_stage()
+
+    if resume_stage != JobState.PENDING:
+        logger.info(f"Resuming {job.url} after stage {resume_stage}")
+
+    tracker = progress.TRACKER
+
+    def check_cancelled():
+        if cancelled is not None and cancelled.is_set():
+            raise JobCancelledError(f"Cancelled {job.url}")
+
+    try:
+        # The reservation only takes space once the job knows its size
+        with (
+            tracker.job(job.key),
+            retry.POLICY.job(),
+            diskspace.DISK_SPACE.reservation() as reservation,
+        ):
+            if resume_stage == JobState.PENDING:
+                tracker.stage(progress.RESOLVING)
+                manifest, license_url = extractor.resolve_manifest_and_license(
+                    job.url, settings=settings
+                )
+                db.advance(job, JobState.EXTRACTED, manifest_url=manifest, license_url=license_url)
+
+                if admit is not None:
+                    tracker.stage(progress.WAITING)
+                    admit(manifest)
+
+            if resume_stage == JobState.DOWNLOADED and not has_decrypted_streams(workdir):
+                logger.warning(f"Decrypted streams for {job.url} are missing, downloading again")
+                resume_stage = JobState.EXTRACTED
+
+            if resume_stage == JobState.DOWNLOADED:
+                # The tracks are on disk already, only the merged output is to be written
+                tracker.stage(progress.RESERVING)
+                reservation.acquire(workdir, directory_size(workdir) + merge_size(workdir))
+
+            if resume_stage in (JobState.PENDING, JobState.EXTRACTED):
+                check_cancelled()
+                cleanup(workdir)
+                download_and_decrypt(
+                    job.manifest_url,
+                    job.license_url,
+                    to_download_subtitles,
+                    workdir=workdir,
+                    reservation=reservation,
+                    settings=settings,
+                )
+
+                db.advance(job, JobState.DOWNLOADED)
+
+            # The tracks are files in the job directory, so this also works
+            # when resuming a job whose streams were downloaded by an earlier run
+            check_cancelled()
+            tracker.stage(progress.MUXING)
+            merge_streams(job.output_path, workdir, find_tracks(workdir), settings)
+            db.advance(job, JobState.MUXED)
+    except Exception as e:
+        logger.error(f"Failed to download {job.url}: {e}")
+        db.fail(job, f"{type(e).__name__}: {e}")
+        tracker.stage(progress.FAILED, job.key)
+        return job
+
+    tracker.stage(progress.DONE, job.key)
+
+    cleanup(workdir)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    logger.info(f"Finished {job.url} -> {job.output_path} in {job.muxed_at - job.started_at:.1f}s")
+    return job
+
+
+def merge_size(workdir: str) -> int:
+    """Size of the merged output of `workdir`: about that of the tracks it copies."""
+    return sum(
+        os.path.getsize(os.path.join(workdir, filename))
+        for filename in (DEFAULT_DECRYPTED_VIDEO_FILENAME, DEFAULT_DECRYPTED_AUDIO_FILENAME)
+    ) + sum(os.path.getsize(track.path) for track in find_tracks(workdir))
+
+
+def has_decrypted_streams(workdir: str) -> bool:
+    return all(
+        os.path.exists(os.path.join(workdir, filename))
+        for filename in (DEFAULT_DECRYPTED_VIDEO_FILENAME, DEFAULT_DECRYPTED_AUDIO_FILENAME)
+    )
 
 
 def download_by_url(
@@ -102,31 +288,35 @@ def download_by_url(
     output_filename: str = None,
     audio_stream_id: str = None,
     video_stream_id: str = None,
-):
+    settings: Optional[Settings] = None,
+) -> str:
+    """Download the video of a page and return the path of the merged file."""
     if url is None:
-        raise ValueError()
+        raise ValueError("url cannot be None")
 
     if not isinstance(url, str):
-        pass  # TODO: log actual type
+        raise TypeError(f"Invalid type for url: Expected str, got {type(url).__name__}")
 
     if output_filename is not None and not isinstance(output_filename, str):
-        logger.fatal(
+        raise TypeError(
             f"Invalid type for output_filename: Expected str, got {type(output_filename).__name__}"
         )
 
-    manifest, license_url = extractor.get_manifest_and_license(url)
+    with retry.POLICY.job():
+        manifest, license_url = extractor.resolve_manifest_and_license(url, settings=settings)
 
-    if manifest is None or license_url is None:
-        sys.exit(1)
+        if manifest is None or license_url is None:
+            raise ExtractionError(f"No manifest and license found for {url}", url)
 
-    download_by_manifest_and_license_url(
-        manifest,
-        license_url,
-        to_download_subtitles,
-        audio_stream_id,
-        video_stream_id,
-        output_filename,
-    )
+        return download_by_manifest_and_license_url(
+            manifest,
+            license_url,
+            to_download_subtitles,
+            audio_stream_id,
+            video_stream_id,
+            output_filename,
+            settings,
+        )
 
 
 def download_by_manifest_and_license_url(
@@ -136,52 +326,92 @@ def download_by_manifest_and_license_url(
     audio_stream_id: Optional[str] = None,
     video_stream_id: Optional[str] = None,
     output_filename: str = None,
-):
+    settings: Optional[Settings] = None,
+    workdir: str = ".",
+) -> str:
+    """
+    Download, decrypt and merge the streams of `manifest`, returning the
+    merged file. The intermediate files are written to `workdir`.
+    """
     if manifest is None:
-        raise ValueError("")
+        raise ValueError("manifest cannot be None")
 
     if not isinstance(manifest, str):
-        logger.fatal("")
-        sys.exit(1)
+        raise TypeError(f"Invalid type for manifest: Expected str, got {type(manifest).__name__}")
 
     if license_url is None:
-        raise ValueError()
+        raise ValueError("license_url cannot be None")
 
     if not isinstance(license_url, str):
-        logger.fatal("")
-        sys.exit(1)
+        raise TypeError(
+            f"Invalid type for license_url: Expected str, got {type(license_url).__name__}"
+        )
+
+    with retry.POLICY.job(), diskspace.DISK_SPACE.reservation() as reservation:
+        subtitle_tracks = download_and_decrypt(
+            manifest,
+            license_url,
+            to_download_subtitles,
+            audio_stream_id,
+            video_stream_id,
+            workdir=workdir,
+            reservation=reservation,
+            settings=settings,
+        )
+        return merge_streams(output_filename, workdir, subtitle_tracks, settings)
 
-    mpd = MPEGDASHParser.parse(manifest)
-    streams: list[Stream] = stream.get_streams(mpd)
+
+def download_and_decrypt(
+    manifest: str,
+    license_url: str,
+    to_download_subtitles: bool,
+    audio_stream_id: Optional[str] = None,
+    video_stream_id: Optional[str] = None,
+    workdir: str = ".",
+    reservation: Optional[Reservation] = None,
+    settings: Optional[Settings] = None,
+) -> list[SubtitleTrack]:
+    if settings is None:
+        settings = Settings()
+
+    catalog = mpdparse.parse_manifest(
+        retry.POLICY.call(
+            mpdparse.fetch_manifest,
+            manifest,
+            timeout=settings.timeout,
+            description="Manifest download",
+        ),
+        settings,
+    )
+    streams: list[Stream] = catalog.streams
 
     subtitle_streams: list[Stream] = [s for s in streams if s.stream_type == StreamType.SUBTITLES]
 
     if not subtitle_streams:
         logger.info("No subtiles found")
 
-    if to_download_subtitles:
-        for subtitle_stream in subtitle_streams:
-            download_subtitles(subtitle_stream)
+    # Explicit selections, or else the ones configured for every job
+    video_stream_id = video_stream_id or settings.video_stream
+    audio_stream_id = audio_stream_id or settings.audio_stream
+    index = StreamIndex(streams)
 
     if video_stream_id is not None:
-        logger.info("Video stream ID provided: {}".format(video_stream_id))
-        video_stream: Optional[Stream] = get_stream_by_id(video_stream_id, streams)
+        logger.info("Video stream selector provided: {}".format(video_stream_id))
+        video_stream: Optional[Stream] = index.select(video_stream_id, StreamType.VIDEO)
 
         if video_stream is None:
-            sys.stderr.write(f"No video stream {video_stream_id} found\n")
-            sys.exit(1)
+            raise StreamNotFoundError(video_stream_id, index.ids())
     else:
         video_stream: Stream = choose_best_video(streams)
 
     logger.info("Chosen video stream: {}".format(video_stream.id))
 
     if audio_stream_id is not None:
-        logger.info(f"Audio stream ID provided: {audio_stream_id}")
-        audio_stream: Optional[Stream] = get_stream_by_id(audio_stream_id, streams)
+        logger.info(f"Audio stream selector provided: {audio_stream_id}")
+        audio_stream: Optional[Stream] = index.select(audio_stream_id, StreamType.AUDIO)
 
         if audio_stream is None:
-            sys.stderr.write(f"No audio stream {video_stream_id} found\n")
-            sys.exit(1)
+            raise StreamNotFoundError(audio_stream_id, index.ids())
     else:
         audio_stream: Stream = choose_best_audio(streams)
 
@@ -193,16 +423,60 @@ def download_by_manifest_and_license_url(
     if video_stream.stream_type != StreamType.VIDEO:
         logger.warning(f"Stream {video_stream.id} is not video")
 
-    download_stream(manifest, video_stream)
-    download_stream(manifest, audio_stream)
-    pssh = get_pssh(video_stream)
-    decryption_keys = extractor.get_keys(pssh, license_url)
-    fix_video(decryption_keys)
-    fix_audio(decryption_keys)
-    merge_streams(output_filename)
+    # A live event lasts as long as it is recorded
+    duration = settings.live_duration if catalog.dynamic else catalog.duration
+    job_size = estimate_job_size(video_stream, audio_stream, duration)
+    logger.info(f"Estimated disk usage: {format_size(job_size)}")
+
+    progress.TRACKER.expect(job_size)
+    progress.TRACKER.stage(progress.RESERVING)
+
+    if reservation is not None:
+        if job_size is None:
+            logger.warning("Could not estimate the size of the download, not reserving disk space")
+        else:
+            reservation.acquire(workdir, job_size)
+
+    if to_download_subtitles and catalog.dynamic:
+        logger.warning("Subtitles of live manifests are not recorded")
+        to_download_subtitles = False
+
+    # The admission slot is only taken once the disk space is reserved, so
+    # jobs waiting for space do not hold back the ones that could download
+    progress.TRACKER.stage(progress.WAITING)
+
+    with governor.GOVERNOR.job(), ThreadPoolExecutor() as executor:
+        # Subtitles are small: fetch and convert them while the video downloads
+        subtitle_futures = (
+            [
+                executor.submit(retry.in_job(fetch_subtitles), manifest, s, i, workdir, settings)
+                for i, s in enumerate(subtitle_streams)
+            ]
+            if to_download_subtitles
+            else []
+        )
+
+        progress.TRACKER.stage(progress.DOWNLOADING)
+
+        if catalog.dynamic:
+            live.record(manifest, catalog, [video_stream, audio_stream], workdir, settings)
+        else:
+            download_stream(manifest, video_stream, workdir, settings)
+            download_stream(manifest, audio_stream, workdir, settings)
+        progress.TRACKER.stage(progress.DECRYPTING)
+        pssh = get_pssh(video_stream)
+        decryption_keys = extractor.get_keys(pssh, license_url, settings)
+        fix_video(decryption_keys, workdir, settings)
+        fix_audio(decryption_keys, workdir, settings)
+
+        tracks = [f.result() for f in subtitle_futures]
 
+    return [track for track in tracks if track is not None]
 
-def download_stream(manifest_url: str, stream: Stream):
+
+def download_stream(
+    manifest_url: str, stream: Stream, workdir: str = ".", settings: Optional[Settings] = None
+):
     if manifest_url is None:
         raise ValueError("manifest_url cannot be empty or None")
 
@@ -217,32 +491,206 @@ def download_stream(manifest_url: str, stream: Stream):
     if not isinstance(stream, Stream):
         logger.warning(f"Invalid type for stream: Expected Stream, got {type(stream).__name__}")
 
-    if shutil.which("yt-dlp") is None:
-        logger.fatal("yt-dlp is not installed or not found in PATH")
-        sys.exit(1)
+    if segcache.CACHE is not None and stream.segments is not None:
+        download_segments(manifest_url, stream, segcache.CACHE, workdir)
+        return
+
+    if settings is None:
+        settings = Settings()
+
+    if shutil.which(settings.yt_dlp) is None:
+        raise MissingDependencyError(settings.yt_dlp)
 
     logger.info(f"Downloading encrypted {str(stream.stream_type)} stream: {stream.id}")
 
-    command = ["yt-dlp", "-f", stream.id, "--allow-unplayable-formats", manifest_url]
+    host = governor.host_of(manifest_url)
+
+    # Each attempt asks the governor again, so a retry after throttling uses
+    # fewer fragment connections and does not hold a slot while backing off
+    def attempt():
+        with governor.GOVERNOR.connection(host) as host_stats:
+            # yt-dlp opens its own connections for the fragments: give it the
+            # share of the host limit that other transfers are not using
+            fragments = max(1, host_stats.limit - host_stats.in_flight + 1)
+
+            command = [
+                settings.yt_dlp,
+                "-f",
+                stream.id,
+                "--allow-unplayable-formats",
+                "--socket-timeout",
+                str(settings.timeout),
+                "-N",
+                str(fragments),
+            ]
+
+            rate = governor.GOVERNOR.rate_share()
+            if rate is not None:
+                command += ["--limit-rate", str(rate)]
+
+            command.append(manifest_url)
+
+            logger.info(f'Command: {" ".join(command)}')
+
+            size_before = directory_size(workdir)
+            start = time.monotonic()
+
+            try:
+                subprocess.run(command, capture_output=True, text=True, check=True, cwd=workdir)
+            except subprocess.CalledProcessError as e:
+                status = retry.status_of(e)
+                governor.GOVERNOR.record(host, status=status, error=status is None)
+                raise
+
+            governor.GOVERNOR.record(
+                host, directory_size(workdir) - size_before, time.monotonic() - start
+            )
+
+    try:
+        retry.POLICY.call(attempt, description=f"Download of stream {stream.id}")
+    except subprocess.CalledProcessError as e:
+        error = (e.stderr or "").strip().splitlines()
+        raise DownloadError(
+            f"yt-dlp failed to download stream {stream.id}: {error[-1] if error else e}"
+        ) from e
+
+
+def download_segments(manifest_url: str, stream: Stream, cache: SegmentCache, workdir: str = "."):
+    """
+    Fetch the init and media segments of `stream` through the segment cache
+    and concatenate them into the file name yt-dlp would have produced.
+    """
+    if stream.stream_type == StreamType.VIDEO:
+        output_path = os.path.join(workdir, DEFAULT_ENCRYPTED_VIDEO_FILENAME)
+    else:
+        output_path = os.path.join(workdir, DEFAULT_ENCRYPTED_AUDIO_FILENAME)
+
+    init_url = initialization_url(stream.segments, stream.id, stream.bandwidth, manifest_url)
+    media = media_segments(stream.segments, stream.id, stream.bandwidth, manifest_url)
 
-    logger.info(f'Command: {" ".join(command)}')
+    if not media:
+        raise ManifestError(f"Could not expand the segments of stream {stream.id}")
 
-    subprocess.run(command, capture_output=True, text=True, check=True)
+    urls = ([init_url] if init_url is not None else []) + [s.url for s in media]
+    logger.info(f"Downloading {len(urls)} segments of {str(stream.stream_type)} stream {stream.id}")
 
+    workers = governor.GOVERNOR.connections(governor.host_of(urls[0]))
+    hits = cache.hits
 
-def download_subtitles(subtitle_stream: Stream, output_path: str = None):
-    # TODO: Use the output path
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        with open(output_path + ".part", "wb") as out:
+            # Fetches stay a few segments ahead of the output, so that a stream
+            # larger than the cache does not evict its own segments
+            fetched = segcache.fetch_ahead(
+                executor, retry.in_job(cache.fetch), urls, workers * segcache.FETCH_AHEAD
+            )
 
+            for url, path in zip(urls, fetched):
+                try:
+                    append_segment(out, url, path)
+                except FileNotFoundError:
+                    # Evicted by another job before we got to it
+                    append_segment(out, url, cache.fetch(url))
+
+    os.replace(output_path + ".part", output_path)
+    logger.info(f"Downloaded stream {stream.id} ({cache.hits - hits}/{len(urls)} segments cached)")
+
+
+def append_segment(out, url: str, path: Optional[str]):
+    if path is None:
+        raise DownloadError(f"Failed to download segment {url}")
+
+    with open(path, "rb") as f:
+        shutil.copyfileobj(f, out)
+
+
+def fetch_subtitles(
+    manifest_url: str,
+    subtitle_stream: Stream,
+    index: int,
+    workdir: str = ".",
+    settings: Optional[Settings] = None,
+) -> Optional[SubtitleTrack]:
+    """Download a subtitle stream into `workdir` and convert it to `settings.subtitle_format`."""
+    if settings is None:
+        settings = Settings()
+
+    subtitle_format = settings.subtitle_format
+    raw_path = os.path.join(workdir, f"{DEFAULT_SUBTITLE_FILENAME_PREFIX}.{index}.raw")
+    language = language_tag(subtitle_stream.language)
+    track = SubtitleTrack(track_path(workdir, index, language, subtitle_format), language)
+
+    try:
+        if not download_subtitles(subtitle_stream, raw_path, manifest_url, settings):
+            return None
+
+        convert_subtitles(raw_path, track.path, subtitle_format)
+    except Exception as e:
+        # Missing subtitles should not cost us the whole download
+        logger.error(f"Failed to fetch subtitle stream {subtitle_stream.id}: {e}")
+        return None
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+    return track
+
+
+def download_subtitles(
+    subtitle_stream: Stream,
+    output_path: str = None,
+    manifest_url: Optional[str] = None,
+    settings: Optional[Settings] = None,
+) -> bool:
     if subtitle_stream is None:
         raise ValueError("subtitle_stream cannot be None")
 
     if not isinstance(subtitle_stream, Stream):
-        logger.fatal("")
+        raise TypeError(
+            f"Invalid type for subtitle_stream: Expected Stream, got {type(subtitle_stream).__name__}"
+        )
 
     if subtitle_stream.stream_type != StreamType.SUBTITLES:
-        logger.warning("")
+        logger.warning(f"Stream {subtitle_stream.id} is not a subtitle stream")
+
+    urls = [urljoin(manifest_url or "", url) for url in subtitle_stream.subtitle_urls]
+
+    if not urls and subtitle_stream.segments is not None and manifest_url is not None:
+        # Segmented subtitles (e.g. STPP in fragmented MP4)
+        init_url = initialization_url(
+            subtitle_stream.segments, subtitle_stream.id, subtitle_stream.bandwidth, manifest_url
+        )
+        media = media_segments(
+            subtitle_stream.segments, subtitle_stream.id, subtitle_stream.bandwidth, manifest_url
+        )
+        urls = ([init_url] if init_url is not None else []) + [s.url for s in media]
+
+    if not urls:
+        logger.warning(f"No URLs for subtitle stream {subtitle_stream.id}")
+        return False
+
+    if output_path is None:
+        output_path = urls[0].split("/")[-1]
+
+    logger.info(f"Downloading {len(urls)} subtitle URL(s) for stream {subtitle_stream.id}")
+
+    if len(urls) == 1:
+        if segcache.CACHE is not None:
+            return segcache.CACHE.fetch_to(urls[0], output_path)
+
+        return download_file(urls[0], output_path, settings)
+
+    with open(output_path, "wb") as out:
+        for url in urls:
+            if segcache.CACHE is not None:
+                append_segment(out, url, segcache.CACHE.fetch(url))
+                continue
+
+            part = output_path + ".part"
+            if not download_file(url, part, settings):
+                return False
+
+            append_segment(out, url, part)
+            os.remove(part)
 
-    for url in subtitle_stream.subtitle_urls:
-        logger.info(f"Downloading subtitle URL {url} for stream {subtitle_stream.id}")
-        output_path = url.split("/")[-1]
-        download_file(url, output_path)
+    return True
@@ -0,0 +1,59 @@
+"""
+Exceptions raised by opto-dl.
+
+Library code raises these instead of exiting, so that a batch or an embedding
+service can handle a failure per item and keep its browsers and caches warm.
+"""
+
+from typing import Optional
+
+
+class OptoDLError(Exception):
+    """Base class of every opto-dl error."""
+
+
+class MissingDependencyError(OptoDLError):
+    """An external tool (ffmpeg, mp4decrypt, yt-dlp...) is not installed."""
+
+    def __init__(self, tool: str):
+        super().__init__(f"{tool} is not installed or not found in PATH")
+        self.tool: str = tool
+
+
+class ExtractionError(OptoDLError):
+    """The manifest or license URL of a page could not be found."""
+
+    def __init__(self, message: str, url: Optional[str] = None):
+        super().__init__(message)
+        self.url: Optional[str] = url
+
+
+class BrowserError(ExtractionError):
+    """The browser used for extraction could not be started."""
+
+
+class ManifestError(OptoDLError):
+    """The manifest uses a feature that is not supported (e.g. several periods)."""
+
+
+class StreamNotFoundError(ManifestError):
+    def __init__(self, stream_id: str, available: list[str]):
+        super().__init__(f"No stream {stream_id} found (available: {', '.join(available)})")
+        self.stream_id: str = stream_id
+        self.available: list[str] = available
+
+
+class DownloadError(OptoDLError):
+    """A stream or segment could not be downloaded."""
+
+
+class DecryptionError(OptoDLError):
+    """No keys were obtained, the encrypted streams are missing or mp4decrypt failed."""
+
+
+class MergeError(OptoDLError):
+    """ffmpeg could not merge the decrypted streams and subtitles."""
+
+
+class JobCancelledError(OptoDLError):
+    """A batch job was stopped before writing its output, e.g. its queue lease was lost."""
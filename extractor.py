@@ -1,15 +1,20 @@
 import sys
 import logging
 import re
+import shutil
+import tempfile
 import time
 import json
-import os
+import threading
 
 from collections import namedtuple
+from typing import Callable, Optional
 
 from selenium.webdriver.ie.webdriver import WebDriver
 
-from defaults import DEFAULT_TIMEOUT
+import retry
+from config import Settings
+from errors import BrowserError, DecryptionError, ExtractionError
 
 try:
     import requests
@@ -20,48 +25,203 @@ except ImportError:
 try:
     from selenium import webdriver
     from selenium.webdriver.chrome.options import Options
+    from selenium.common.exceptions import WebDriverException
     from selenium.webdriver.common.by import By
     from selenium.webdriver.support import expected_conditions as ec
 except ImportError:
     sys.stderr.write("Error: 'selenium' is not installed. Install it with: pip install selenium\n")
     sys.exit(1)
 
-# File to where the requests are logged
-REQUESTS_FILE = "requests.txt"
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] [%(module)s.%(funcName)s:%(lineno)d] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
-
 logger = logging.getLogger(__name__)
 
 DecryptionKeys = namedtuple("DecryptionKeys", ["Key", "KeyId"])
 
 
+# Requests the player does not need to start playback, blocked in lean mode
+BLOCKED_URL_PATTERNS = [
+    # Images and fonts
+    "*.png*",
+    "*.jpg*",
+    "*.jpeg*",
+    "*.gif*",
+    "*.webp*",
+    "*.svg*",
+    "*.ico*",
+    "*.woff*",
+    "*.ttf*",
+    "*.otf*",
+    # Analytics, ads and social widgets
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*googlesyndication.com*",
+    "*doubleclick.net*",
+    "*facebook.net*",
+    "*facebook.com/tr*",
+    "*scorecardresearch.com*",
+    "*chartbeat.com*",
+    "*chartbeat.net*",
+    "*hotjar.com*",
+    "*cxense.com*",
+    "*marfeel.com*",
+    "*gemius.pl*",
+    "*taboola.com*",
+    "*outbrain.com*",
+]
+
+# Media segments, blocked once the manifest and license have been captured
+MEDIA_URL_PATTERNS = ["*.m4s*", "*.m4v*", "*.m4a*", "*.mp4*", "*.ts?*", "*.ts"]
+
+LEAN_WINDOW_SIZE = "640,360"
+LEAN_CACHE_SIZE = 16 * 1024**2
+
+STOP_MEDIA_SCRIPT = """
+document.querySelectorAll("video, audio").forEach(function (media) {
+    media.pause();
+    media.removeAttribute("src");
+    media.load();
+});
+window.stop();
+"""
+
+# How often the performance log is read while waiting for the player, in seconds
+POLL_INTERVAL: float = 0.5
+
+
+def create_driver(headless: bool = True, lean: bool = True) -> WebDriver:
+    """
+    Start Chrome with performance logging. In `lean` mode images, fonts and
+    analytics are not loaded, the viewport is small and the disk cache lives
+    in a throwaway directory; use `quit_driver` to remove it.
+    """
+    logger.info("Configuring Chrome driver")
+    options = Options()
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    options.add_argument("--disable-gpu")
+
+    if headless:
+        options.add_argument("--headless=new")
+
+    cache_dir = None
+    if lean:
+        cache_dir = tempfile.mkdtemp(prefix="opto-dl-chrome-")
+
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_argument(f"--window-size={LEAN_WINDOW_SIZE}")
+        options.add_argument(f"--disk-cache-dir={cache_dir}")
+        options.add_argument(f"--disk-cache-size={LEAN_CACHE_SIZE}")
+        options.add_argument("--mute-audio")
+        options.add_argument("--disable-extensions")
+        options.add_argument("--disable-background-networking")
+        options.add_argument("--disable-sync")
+        options.add_argument("--no-first-run")
+        options.add_experimental_option(
+            "prefs", {"profile.managed_default_content_settings.images": 2}
+        )
+
+    try:
+        driver: WebDriver = webdriver.Chrome(options=options)
+        logger.info("Initialized Chrome WebDriver")
+    except Exception as e:
+        logger.error(f"Failed to initialize Chrome WebDriver: {e}")
+        if cache_dir is not None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        raise BrowserError(f"Failed to initialize Chrome WebDriver: {e}") from e
+
+    driver.opto_dl_cache_dir = cache_dir
+    driver.opto_dl_lean = lean
+
+    if lean:
+        block_urls(driver, BLOCKED_URL_PATTERNS)
+
+    return driver
+
+
+def block_urls(driver: WebDriver, patterns: list[str]):
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+    except Exception as e:
+        logger.warning(f"Failed to block requests through CDP: {e}")
+
+
+def stop_media(driver: WebDriver):
+    """Stop the player from fetching media segments once the URLs are known."""
+    block_urls(driver, BLOCKED_URL_PATTERNS + MEDIA_URL_PATTERNS)
+
+    try:
+        driver.execute_script(STOP_MEDIA_SCRIPT)
+    except Exception as e:
+        logger.warning(f"Failed to stop media playback: {e}")
+
+
+def quit_driver(driver: WebDriver):
+    cache_dir = getattr(driver, "opto_dl_cache_dir", None)
+
+    try:
+        driver.quit()
+    finally:
+        if cache_dir is not None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def reset_driver(driver: WebDriver):
+    """Stop the previous page and drop its requests before the driver is reused."""
+    driver.get("about:blank")
+    driver.get_log("performance")
+
+    # Media was blocked when the previous page was stopped
+    if getattr(driver, "opto_dl_lean", False):
+        block_urls(driver, BLOCKED_URL_PATTERNS)
+
+
+def match_requests(req_text: str) -> tuple[Optional[str], Optional[str]]:
+    """Manifest and license URLs among the captured requests, if any."""
+    manifest_match = re.search(r"\b(?:GET|POST)\s+(https?://[^\s]+manifest\.mpd)", req_text)
+    license_match = re.search(r"\bPOST\s+(https://[^\s]*license\?[^\s]+)", req_text)
+
+    return (
+        manifest_match.group(1) if manifest_match is not None else None,
+        license_match.group(1) if license_match is not None else None,
+    )
+
+
 def get_manifest_and_license(
-    url: str, headless: bool = True, max_retries: int = 5
+    url: str,
+    driver: Optional[WebDriver] = None,
+    policy: Optional[retry.RetryPolicy] = None,
+    settings: Optional[Settings] = None,
 ) -> tuple[str, str]:
-    def log_requests(logs):
-        with open(REQUESTS_FILE, "w", encoding="utf-8") as f:
-            for log in logs:
-                try:
-                    message = json.loads(log["message"])["message"]
-                    method = message.get("method")
-
-                    if method == "Network.requestWillBeSent":
-                        req = message["params"]["request"]
-                        request_method = req.get("method", "UNKNOWN")
-                        request_url = req.get("url", "")
-                        f.write(f"{request_method} {request_url}\n")
-                    elif method == "Network.responseReceived":
-                        resp = message["params"]["response"]
-                        f.write(f"{request_method} {resp}\n")
-                except Exception as e:
-                    logger.warning(f"Error parsing log entry: {e}")
-
-    def visit_page(driver: WebDriver, page_url):
+    """
+    Capture the manifest and license URLs requested by the player of `url`.
+    A `driver` can be passed to reuse a browser across calls; it is then left
+    open for the caller to quit.
+    """
+
+    # The requests are kept in memory (instead of a shared file in the CWD)
+    # so that several extractions can run concurrently
+    def log_requests(logs) -> str:
+        lines: list[str] = []
+        request_method = "UNKNOWN"
+
+        for log in logs:
+            try:
+                message = json.loads(log["message"])["message"]
+                method = message.get("method")
+
+                if method == "Network.requestWillBeSent":
+                    req = message["params"]["request"]
+                    request_method = req.get("method", "UNKNOWN")
+                    request_url = req.get("url", "")
+                    lines.append(f"{request_method} {request_url}")
+                elif method == "Network.responseReceived":
+                    resp = message["params"]["response"]
+                    lines.append(f"{request_method} {resp}")
+            except Exception as e:
+                logger.warning(f"Error parsing log entry: {e}")
+
+        return "\n".join(lines)
+
+    def visit_page(driver: WebDriver, page_url) -> str:
         if driver is None:
             raise ValueError("")
 
@@ -76,104 +236,267 @@ def get_manifest_and_license(
         logger.info(f"Navigating to: {url}")
         driver.get(url)
 
-        logger.info("Waiting for page to fully load...")
-        time.sleep(DEFAULT_TIMEOUT)
+        # Poll the performance log instead of waiting a fixed time: most pages
+        # request the manifest and license within a few seconds
+        logger.info("Waiting for the player to request the manifest and license...")
+        deadline = time.monotonic() + settings.timeout
+        requests_seen: list[str] = []
+
+        while True:
+            requests_seen.append(log_requests(driver.get_log("performance")))
+            req_text = "\n".join(requests_seen)
+
+            if all(match_requests(req_text)) or time.monotonic() >= deadline:
+                break
 
-        logger.info("Fetching requests from browser...")
-        logs = driver.get_log("performance")
+            time.sleep(POLL_INTERVAL)
 
-        log_requests(logs)
+        if getattr(driver, "opto_dl_lean", False):
+            stop_media(driver)
+
+        return req_text
 
     if url is None:
-        raise ValueError("")  # TODO: Message
+        raise ValueError("url cannot be None")
 
-    logger.info("Configuring Chrome driver")
-    options = Options()
-    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
-    options.add_argument("--disable-gpu")
+    if settings is None:
+        settings = Settings()
 
-    if headless:
-        options.add_argument("--headless=new")
+    owns_driver = driver is None
+    if owns_driver:
+        driver = create_driver(settings.headless, settings.lean_browser)
+    else:
+        reset_driver(driver)
 
-    try:
-        driver: WebDriver = webdriver.Chrome(options=options)
-        logger.info("Initialized Chrome WebDriver")
-    except Exception as e:
-        logger.error(f"Failed to initialize Chrome WebDriver: {e}")
-        sys.exit(1)
+    if policy is None:
+        policy = retry.POLICY
 
     manifest_url = None
     license_url = None
+    attempts = 0
+
+    # Each attempt already waits up to settings.timeout for the player, the
+    # policy only adds a backoff between page loads
+    def attempt():
+        nonlocal manifest_url, license_url, attempts
 
-    for attempt in range(1, max_retries + 1):
-        logger.info(f"Attempt {attempt}/{max_retries}...")
+        attempts += 1
+        if attempts > 1:
+            reset_driver(driver)
 
         try:
-            # This populates the requests file
-            visit_page(driver, url)
+            req_text = visit_page(driver, url)
+        except WebDriverException as e:
+            raise retry.TransientError(f"Browser error: {e}") from e
+
+        captured_manifest, captured_license = match_requests(req_text)
+
+        if captured_manifest is not None:
+            manifest_url = captured_manifest
+            logger.info(f"Captured manifest URL: {manifest_url}")
+        else:
+            logger.warning("No manifest found")
+
+        if captured_license is not None:
+            license_url = captured_license
+            logger.info(f"Captured License URL: {license_url}")
+        else:
+            logger.warning("No License URL found")
+
+        if not manifest_url or not license_url:
+            raise retry.TransientError("The player did not request both the manifest and license")
+
+    try:
+        policy.call(attempt, description=f"Extraction of {url}")
+    except Exception as e:
+        raise ExtractionError(
+            f"Failed to capture both manifest and license URLs of {url}: {e}", url
+        ) from e
+    finally:
+        if owns_driver:
+            quit_driver(driver)
+            logger.info("Browser session closed.")
 
-            with open(REQUESTS_FILE, "r") as f:
-                req_text = f.read()
+    return manifest_url, license_url
+
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:134.0) Gecko/20100101 Firefox/134.0"
+
+MANIFEST_PATTERN = re.compile(r"https?://[^\s\"'<>]+?manifest\.mpd[^\s\"'<>]*", re.IGNORECASE)
+LICENSE_PATTERN = re.compile(r"https://[^\s\"'<>]*license\?[^\s\"'<>]+", re.IGNORECASE)
+
+# Player configuration documents referenced by the page, followed one level deep
+CONFIG_PATTERN = re.compile(
+    r"https?://[^\s\"'<>]+?(?:config|player|playback|media)[^\s\"'<>]*?\.json[^\s\"'<>]*",
+    re.IGNORECASE,
+)
+
+
+class ResolverStats:
+    """Attempts and hits of each manifest resolver, for the end-of-run summary."""
+
+    def __init__(self):
+        self.attempts: dict[str, int] = {}
+        self.hits: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, resolver: str, hit: bool):
+        with self._lock:
+            self.attempts[resolver] = self.attempts.get(resolver, 0) + 1
+            self.hits[resolver] = self.hits.get(resolver, 0) + (1 if hit else 0)
+
+    def hit_rate(self, resolver: str) -> Optional[float]:
+        with self._lock:
+            attempts = self.attempts.get(resolver, 0)
+            return self.hits.get(resolver, 0) / attempts if attempts else None
+
+    def summary(self) -> str:
+        with self._lock:
+            return ", ".join(
+                f"{name}: {self.hits.get(name, 0)}/{attempts} hits"
+                for name, attempts in self.attempts.items()
+            )
 
-            manifest_match = re.search(r"\b(?:GET|POST)\s+(https?://[^\s]+manifest\.mpd)", req_text)
-            license_match = re.search(r"\bPOST\s+(https://[^\s]*license\?[^\s]+)", req_text)
 
-            if manifest_match is not None:
-                manifest_url = manifest_match.group(1)
-                logger.info(f"Captured manifest URL: {manifest_url}")
-            else:
-                logger.warning("No manifest found")
+RESOLVER_STATS = ResolverStats()
 
-            if license_match is not None:
-                license_url = license_match.group(1)
-                logger.info(f"Captured License URL: {license_url}")
-            else:
-                logger.warning("No License URL found")
 
+def _unescape(text: str) -> str:
+    # URLs inside inline JSON are often written as https:\/\/host\/path
+    return text.replace("\\/", "/").replace("\\u0026", "&").replace("&amp;", "&")
+
+
+def find_manifest_and_license(text: str) -> tuple[Optional[str], Optional[str]]:
+    text = _unescape(text)
+
+    manifest_match = MANIFEST_PATTERN.search(text)
+    license_match = LICENSE_PATTERN.search(text)
+
+    return (
+        manifest_match.group(0) if manifest_match is not None else None,
+        license_match.group(0) if license_match is not None else None,
+    )
+
+
+def resolve_via_http(
+    url: str,
+    session: Optional[requests.Session] = None,
+    settings: Optional[Settings] = None,
+) -> Optional[tuple[str, str]]:
+    """
+    Look for the manifest and license URLs in the page itself, or in the
+    player configuration it references, without starting a browser.
+    """
+    if url is None:
+        raise ValueError("url cannot be None")
+
+    if settings is None:
+        settings = Settings()
+
+    http = session if session is not None else requests
+    headers = {"User-Agent": USER_AGENT}
+
+    try:
+        response = http.get(url, headers=headers, timeout=settings.timeout)
+        response.raise_for_status()
+
+        manifest_url, license_url = find_manifest_and_license(response.text)
+
+        for config_url in CONFIG_PATTERN.findall(_unescape(response.text)):
             if manifest_url and license_url:
-                break  # Success
+                break
 
-        except Exception as e:
-            logger.warning(f"Error during attempt {attempt}: {e}")
-        finally:
-            try:
-                if os.path.exists("requests.txt"):
-                    os.remove("requests.txt")
-                    logger.info("Removed requests.txt")
-            except Exception as e:
-                logger.warning(f"Failed to remove requests.txt: {e}")
+            logger.info(f"Fetching player configuration {config_url}")
+            config = http.get(config_url, headers=headers, timeout=settings.timeout)
+
+            if not config.ok:
+                continue
 
-    driver.quit()
-    logger.info("Browser session closed.")
+            found_manifest, found_license = find_manifest_and_license(config.text)
+            manifest_url = manifest_url or found_manifest
+            license_url = license_url or found_license
+
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"HTTP resolver failed for {url}: {e}")
+        return None
 
     if not manifest_url or not license_url:
-        logger.fatal("Failed to capture both manifest and license URLs after retries.")
-        sys.exit(1)
+        logger.info(f"HTTP resolver found no manifest and license for {url}")
+        return None
 
+    logger.info(f"Resolved {url} over HTTP: {manifest_url}")
     return manifest_url, license_url
 
 
-def get_keys(pssh: str, license_url: str, max_retries=3) -> list[DecryptionKeys]:
-    # TODO: Implement retries. If no response is ok, log.fatal and sys.exit(1)
-    response = requests.post(
-        url="https://cdrm-project.com/api/decrypt",
-        headers={
-            "Content-Type": "application/json",
-        },
-        json={
-            "pssh": pssh,
-            "licurl": license_url,
-            "headers": str(
-                {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:134.0) Gecko/20100101 Firefox/134.0",
-                    "Accept": "*/*",
-                    "Accept-Language": "en-US,en;q=0.7",
-                }
-            ),
-        },
-    )
+def resolve_manifest_and_license(
+    url: str,
+    get_driver: Optional[Callable[[], WebDriver]] = None,
+    session: Optional[requests.Session] = None,
+    settings: Optional[Settings] = None,
+) -> tuple[str, str]:
+    """
+    Resolve the manifest and license URLs of a page, trying a plain HTTP
+    fetch first and driving a browser only when that fails. `get_driver`
+    provides a reusable browser; it is only called on fallback.
+    """
+    result = resolve_via_http(url, session, settings)
+    RESOLVER_STATS.record("http", result is not None)
 
-    response.raise_for_status()
+    if result is not None:
+        return result
+
+    logger.info(f"Falling back to the browser for {url}")
+
+    try:
+        driver = get_driver() if get_driver is not None else None
+        result = get_manifest_and_license(url, driver=driver, settings=settings)
+    except ExtractionError:
+        RESOLVER_STATS.record("browser", False)
+        raise
+
+    RESOLVER_STATS.record("browser", True)
+    return result
+
+
+def get_keys(
+    pssh: str,
+    license_url: str,
+    settings: Optional[Settings] = None,
+    policy: Optional[retry.RetryPolicy] = None,
+) -> list[DecryptionKeys]:
+    if settings is None:
+        settings = Settings()
+
+    if policy is None:
+        policy = retry.POLICY
+
+    def request_keys() -> requests.Response:
+        response = requests.post(
+            url="https://cdrm-project.com/api/decrypt",
+            headers={
+                "Content-Type": "application/json",
+            },
+            json={
+                "pssh": pssh,
+                "licurl": license_url,
+                "headers": str(
+                    {
+                        "User-Agent": USER_AGENT,
+                        "Accept": "*/*",
+                        "Accept-Language": "en-US,en;q=0.7",
+                    }
+                ),
+            },
+            timeout=settings.timeout,
+        )
+
+        response.raise_for_status()
+        return response
+
+    try:
+        response = policy.call(request_keys, description="Key request")
+    except requests.exceptions.RequestException as e:
+        raise DecryptionError(f"Key request failed: {e}") from e
 
     text: str = response.json()["message"]
 
@@ -187,4 +510,7 @@ def get_keys(pssh: str, license_url: str, max_retries=3) -> list[DecryptionKeys]
             logger.error(f"Invalid line: {line} ==> {e}")
             continue
 
+    if not r:
+        raise DecryptionError(f"No keys in the license response: {text}")
+
     return r
@@ -0,0 +1,268 @@
+"""
+Adaptive concurrency and bandwidth governor for the download layer.
+
+Every transfer reports its host, size, duration, latency and outcome. The
+number of parallel connections per host and the number of jobs allowed in
+the download stage follow an AIMD scheme: they grow by one after a window of
+healthy transfers and are halved when the CDN throttles (429), fails (5xx)
+or times out. An optional global bandwidth cap is enforced with a token
+bucket shared by all transfers.
+"""
+
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Optional
+from urllib.parse import urlsplit
+
+from defaults import DEFAULT_MAX_CONNECTIONS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_CONNECTIONS: int = 1
+DEFAULT_INITIAL_CONNECTIONS: int = 4
+
+# Number of successful transfers before the limits are raised
+INCREASE_WINDOW: int = 8
+
+# Minimum time between two decreases, so one burst of errors halves only once
+DECREASE_COOLDOWN: float = 5.0
+
+# Weight of the newest sample in the moving averages
+EWMA_ALPHA: float = 0.2
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def is_throttling(status: Optional[int]) -> bool:
+    return status is not None and (status == 429 or status >= 500)
+
+
+def is_rejection(status: Optional[int]) -> bool:
+    """A 4xx other than 429: the request failed, but says nothing about congestion."""
+    return status is not None and 400 <= status < 500 and status != 429
+
+
+class HostStats:
+    def __init__(self, limit: int):
+        self.limit: int = limit
+        self.in_flight: int = 0
+
+        # Moving averages
+        self.throughput: Optional[float] = None  # bytes/s
+        self.latency: Optional[float] = None  # seconds
+        self.error_rate: float = 0.0
+
+        self.transfers: int = 0
+        self.errors: int = 0
+        self.throttled: int = 0
+
+        self.successes_since_change: int = 0
+        self.last_decrease: float = 0.0
+
+    def observe(self, throughput: Optional[float], latency: Optional[float], failed: bool):
+        self.transfers += 1
+        self.error_rate += EWMA_ALPHA * ((1.0 if failed else 0.0) - self.error_rate)
+
+        if throughput is not None:
+            self.throughput = _ewma(self.throughput, throughput)
+
+        if latency is not None:
+            self.latency = _ewma(self.latency, latency)
+
+
+def _ewma(average: Optional[float], sample: float) -> float:
+    return sample if average is None else average + EWMA_ALPHA * (sample - average)
+
+
+class TokenBucket:
+    def __init__(self, rate: int):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+
+        self.rate: int = rate
+        self._tokens: float = float(rate)
+        self._last: float = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, n: int):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Governor:
+    def __init__(
+        self,
+        min_connections: int = DEFAULT_MIN_CONNECTIONS,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        initial_connections: int = DEFAULT_INITIAL_CONNECTIONS,
+        max_jobs: int = 1,
+        bandwidth_cap: Optional[int] = None,
+    ):
+        if not 1 <= min_connections <= max_connections:
+            raise ValueError("Expected 1 <= min_connections <= max_connections")
+
+        self.min_connections: int = min_connections
+        self.max_connections: int = max_connections
+        self.initial_connections: int = max(
+            min_connections, min(initial_connections, max_connections)
+        )
+
+        self.max_jobs: int = max(1, max_jobs)
+        self.job_limit: int = self.max_jobs
+        self.active_jobs: int = 0
+
+        self.bandwidth_cap: Optional[int] = bandwidth_cap
+        self._bucket: Optional[TokenBucket] = TokenBucket(bandwidth_cap) if bandwidth_cap else None
+
+        self._hosts: dict[str, HostStats] = {}
+        self._active_transfers: int = 0
+        self._cond = threading.Condition()
+
+    def stats(self, host: str) -> HostStats:
+        with self._cond:
+            return self._stats(host)
+
+    def _stats(self, host: str) -> HostStats:
+        if host not in self._hosts:
+            self._hosts[host] = HostStats(self.initial_connections)
+
+        return self._hosts[host]
+
+    def connections(self, host: str) -> int:
+        """Number of parallel connections currently allowed to `host`."""
+        return self.stats(host).limit
+
+    @contextmanager
+    def connection(self, host: str):
+        with self._cond:
+            stats = self._stats(host)
+
+            while stats.in_flight >= stats.limit:
+                self._cond.wait()
+
+            stats.in_flight += 1
+            self._active_transfers += 1
+
+        try:
+            yield stats
+        finally:
+            with self._cond:
+                stats.in_flight -= 1
+                self._active_transfers -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def job(self):
+        """Admission gate for the bandwidth-heavy stage of a job."""
+        with self._cond:
+            while self.active_jobs >= self.job_limit:
+                self._cond.wait()
+
+            self.active_jobs += 1
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active_jobs -= 1
+                self._cond.notify_all()
+
+    def throttle(self, nbytes: int):
+        """Block until `nbytes` may be transferred under the global bandwidth cap."""
+        if self._bucket is not None and nbytes > 0:
+            self._bucket.consume(nbytes)
+
+    def rate_share(self) -> Optional[int]:
+        """Share of the bandwidth cap for one more transfer, for tools that take a rate limit."""
+        if self.bandwidth_cap is None:
+            return None
+
+        with self._cond:
+            return max(1, self.bandwidth_cap // max(1, self._active_transfers))
+
+    def record(
+        self,
+        host: str,
+        nbytes: int = 0,
+        seconds: Optional[float] = None,
+        latency: Optional[float] = None,
+        status: Optional[int] = None,
+        error: bool = False,
+    ):
+        failed = error or is_throttling(status)
+        rejected = is_rejection(status)
+        throughput = nbytes / seconds if seconds and nbytes and not (failed or rejected) else None
+
+        with self._cond:
+            stats = self._stats(host)
+            stats.observe(throughput, latency, failed or rejected)
+
+            if rejected and not failed:
+                # Neither a success nor congestion: leave the limits alone
+                stats.errors += 1
+            elif failed:
+                stats.errors += 1
+                stats.successes_since_change = 0
+
+                if status == 429:
+                    stats.throttled += 1
+
+                self._decrease(host, stats, status)
+            else:
+                stats.successes_since_change += 1
+
+                if stats.successes_since_change >= INCREASE_WINDOW:
+                    stats.successes_since_change = 0
+                    self._increase(host, stats)
+
+            self._cond.notify_all()
+
+    def _increase(self, host: str, stats: HostStats):
+        if stats.limit < self.max_connections:
+            stats.limit += 1
+            logger.info(f"Raising connections to {host} to {stats.limit}")
+
+        if self.job_limit < self.max_jobs:
+            self.job_limit += 1
+            logger.info(f"Raising concurrent jobs to {self.job_limit}")
+
+    def _decrease(self, host: str, stats: HostStats, status: Optional[int]):
+        now = time.monotonic()
+
+        if now - stats.last_decrease < DECREASE_COOLDOWN:
+            return
+
+        stats.last_decrease = now
+        reason = f"HTTP {status}" if status is not None else "errors"
+
+        new_limit = max(self.min_connections, stats.limit // 2)
+        if new_limit != stats.limit:
+            stats.limit = new_limit
+            logger.warning(f"Lowering connections to {host} to {stats.limit} ({reason})")
+
+        new_job_limit = max(1, self.job_limit // 2)
+        if new_job_limit != self.job_limit:
+            self.job_limit = new_job_limit
+            logger.warning(f"Lowering concurrent jobs to {self.job_limit} ({reason})")
+
+
+GOVERNOR = Governor()
+
+
+def configure(**kwargs) -> Governor:
+    """Replace the process-wide governor used by the download layer."""
+    global GOVERNOR
+    GOVERNOR = Governor(**kwargs)
+    return GOVERNOR
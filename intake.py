@@ -0,0 +1,164 @@
+"""
+Streaming URL intake for batch downloads.
+
+URLs are read line by line from a file, from stdin ("-") or from a file that
+keeps growing (follow mode, like `tail -f`), normalised and de-duplicated on
+the fly, so the first download can start as soon as the first URL arrives.
+
+Besides URLs, a line may carry scheduling options (see `scheduler`) that
+apply to the URLs on it:
+
+    https://opto.sic.pt/... priority=high deadline=+30m source=newsroom
+
+`priority` is a number or one of PRIORITY_NAMES (higher runs first),
+`deadline` a local ISO date/time or a delay such as +30m, and `source` the
+name jobs are shared fairly by (by default, the input file).
+"""
+
+import hashlib
+import logging
+import os
+import sys
+import time
+
+from collections import namedtuple
+from datetime import datetime
+from typing import Iterable, Iterator, Optional, TextIO
+
+from config import parse_seconds
+from jobdb import normalize_url
+from utils import get_urls
+
+logger = logging.getLogger(__name__)
+
+STDIN = "-"
+
+Request = namedtuple("Request", ["url", "priority", "deadline", "source"])
+
+PRIORITY_NAMES = {"urgent": 20, "high": 10, "normal": 0, "low": -10}
+
+OPTIONS = ("priority", "deadline", "source")
+
+# How often a followed file is polled for new lines, in seconds
+DEFAULT_POLL_INTERVAL: float = 1.0
+
+
+def iter_lines(
+    source: str, follow: bool = False, poll_interval: float = DEFAULT_POLL_INTERVAL
+) -> Iterator[str]:
+    if source is None:
+        raise ValueError("source cannot be None")
+
+    if source == STDIN:
+        yield from sys.stdin
+        return
+
+    with open(source, "r", encoding="utf-8") as f:
+        yield from _read_lines(f, follow, poll_interval)
+
+
+def _read_lines(f: TextIO, follow: bool, poll_interval: float) -> Iterator[str]:
+    partial = ""
+
+    while True:
+        line = f.readline()
+
+        if not line:
+            if not follow:
+                break
+
+            time.sleep(poll_interval)
+            continue
+
+        # A producer may still be in the middle of writing this line
+        if follow and not line.endswith("\n"):
+            partial += line
+            continue
+
+        yield partial + line
+        partial = ""
+
+    if partial:
+        yield partial
+
+
+def source_name(source: str) -> str:
+    """Default `source` option of the requests read from `source`."""
+    return "stdin" if source == STDIN else os.path.basename(source)
+
+
+def parse_priority(value: str) -> int:
+    if value.lower() in PRIORITY_NAMES:
+        return PRIORITY_NAMES[value.lower()]
+
+    return int(value)
+
+
+def parse_deadline(value: str, now: Optional[float] = None) -> float:
+    """Parse +30m (from `now`) or a local ISO date/time into a timestamp."""
+    if value.startswith("+"):
+        return (now if now is not None else time.time()) + parse_seconds(value[1:])
+
+    return datetime.fromisoformat(value).timestamp()
+
+
+def parse_options(line: str, default_source: str) -> dict:
+    """The scheduling options of `line`; invalid ones are logged and ignored."""
+    options = {"priority": 0, "deadline": None, "source": default_source}
+
+    for token in line.split():
+        name, separator, value = token.partition("=")
+
+        if not separator or name.lower() not in OPTIONS or "://" in token:
+            continue
+
+        name = name.lower()
+
+        try:
+            if name == "priority":
+                options["priority"] = parse_priority(value)
+            elif name == "deadline":
+                options["deadline"] = parse_deadline(value)
+            elif value:
+                options["source"] = value
+        except ValueError as e:
+            logger.warning(f"Ignoring invalid option {token}: {e}")
+
+    return options
+
+
+def _unique_urls(lines: Iterable[str]) -> Iterator[tuple[str, str]]:
+    """(line, url) of the first occurrence of every URL of `lines`."""
+    seen: set[bytes] = set()
+
+    for line in lines:
+        for url in get_urls(line):
+            url = normalize_url(url)
+            digest = hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest()
+
+            if digest in seen:
+                logger.info(f"Skipping duplicate URL: {url}")
+                continue
+
+            seen.add(digest)
+            yield line, url
+
+
+def iter_urls(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Extract, normalise and de-duplicate URLs from `lines`. Only a short digest
+    of each URL is kept, so memory stays small even for very large lists.
+    """
+    for _, url in _unique_urls(lines):
+        yield url
+
+
+def iter_requests(lines: Iterable[str], default_source: str = "default") -> Iterator[Request]:
+    """The URLs of `iter_urls`, with the scheduling options of their line."""
+    options_line, options = None, None
+
+    for line, url in _unique_urls(lines):
+        if line is not options_line:
+            options_line, options = line, parse_options(line, default_source)
+
+        yield Request(url, options["priority"], options["deadline"], options["source"])
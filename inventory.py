@@ -0,0 +1,129 @@
+"""
+Bulk manifest inspection for --list-streams.
+
+Many page URLs and manifests are resolved and parsed concurrently. Manifests
+are fetched through one shared HTTP session, and page URLs are resolved with
+one browser per worker thread that is reused across items, instead of one
+CLI start and one browser launch per item.
+"""
+
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+import extractor
+import mpdparse
+from config import Settings
+from mpdparse import fetch_manifest
+from stream import Stream
+
+logger = logging.getLogger(__name__)
+
+
+class InventoryItem:
+    def __init__(
+        self,
+        source: str,
+        manifest_url: Optional[str],
+        streams: list[Stream],
+        duration: Optional[float],
+        error: Optional[str] = None,
+    ):
+        # Page URL or manifest given by the user
+        self.source: str = source
+        self.manifest_url: Optional[str] = manifest_url
+
+        self.streams: list[Stream] = streams
+        self.duration: Optional[float] = duration
+
+        self.error: Optional[str] = error
+
+
+class BrowserPool:
+    """One lazily started browser per thread, all quit on `close`."""
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings: Settings = settings if settings is not None else Settings()
+        self._local = threading.local()
+        self._drivers = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        driver = getattr(self._local, "driver", None)
+
+        if driver is None:
+            driver = extractor.create_driver(self.settings.headless, self.settings.lean_browser)
+            self._local.driver = driver
+
+            with self._lock:
+                self._drivers.append(driver)
+
+        return driver
+
+    def close(self):
+        with self._lock:
+            for driver in self._drivers:
+                try:
+                    extractor.quit_driver(driver)
+                except Exception as e:
+                    logger.warning(f"Failed to close browser: {e}")
+
+            self._drivers.clear()
+
+
+def create_session(workers: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def inspect_manifest(
+    source: str, manifest: str, session: requests.Session, settings: Settings
+) -> InventoryItem:
+    catalog = mpdparse.parse_manifest(fetch_manifest(manifest, session, settings.timeout), settings)
+    return InventoryItem(source, manifest, catalog.streams, catalog.duration)
+
+
+def inspect_sources(
+    urls: Iterable[str] = (),
+    manifests: Iterable[str] = (),
+    settings: Optional[Settings] = None,
+) -> Iterator[InventoryItem]:
+    """Inspect page URLs and manifests concurrently, yielding results in input order."""
+    if settings is None:
+        settings = Settings()
+
+    workers = settings.inspect_jobs
+    session = create_session(workers)
+    browsers = BrowserPool(settings)
+
+    def inspect(source: str, is_page_url: bool) -> InventoryItem:
+        try:
+            manifest = source
+            if is_page_url:
+                manifest, _ = extractor.resolve_manifest_and_license(
+                    source, get_driver=browsers.get, session=session, settings=settings
+                )
+
+            return inspect_manifest(source, manifest, session, settings)
+        # One bad item must not end the inventory
+        except Exception as e:
+            logger.error(f"Failed to inspect {source}: {e}")
+            return InventoryItem(source, None, [], None, f"{type(e).__name__}: {e}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(inspect, url, True) for url in urls]
+            futures += [executor.submit(inspect, manifest, False) for manifest in manifests]
+
+            for future in futures:
+                yield future.result()
+    finally:
+        browsers.close()
+        session.close()
@@ -0,0 +1,261 @@
+"""
+Persistent job store for batch downloads.
+
+Every URL handed to `download_by_file` gets a row in a small SQLite database
+that records how far its pipeline got (extracted, downloaded, muxed), the
+output path, per-stage timestamps and the last error. Re-running a batch
+skips finished and duplicate URLs and resumes interrupted ones from the last
+completed stage.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from enum import Enum
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+
+class JobState(Enum):
+    PENDING = "pending"
+    EXTRACTED = "extracted"
+    DOWNLOADED = "downloaded"
+    MUXED = "muxed"
+    FAILED = "failed"
+
+    def __str__(self):
+        return self.value
+
+
+# Column that holds the completion timestamp of each stage
+STAGE_COLUMNS = {
+    JobState.EXTRACTED: "extracted_at",
+    JobState.DOWNLOADED: "downloaded_at",
+    JobState.MUXED: "muxed_at",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    url TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    manifest_url TEXT,
+    license_url TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    started_at REAL,
+    extracted_at REAL,
+    downloaded_at REAL,
+    muxed_at REAL
+)
+"""
+
+
+class Job:
+    def __init__(
+        self,
+        url: str,
+        state: JobState,
+        output_path: str,
+        manifest_url: Optional[str] = None,
+        license_url: Optional[str] = None,
+        error: Optional[str] = None,
+        attempts: int = 0,
+        created_at: Optional[float] = None,
+        updated_at: Optional[float] = None,
+        started_at: Optional[float] = None,
+        extracted_at: Optional[float] = None,
+        downloaded_at: Optional[float] = None,
+        muxed_at: Optional[float] = None,
+    ):
+        self.url: str = url
+        self.state: JobState = state
+        self.output_path: str = output_path
+
+        self.manifest_url: Optional[str] = manifest_url
+        self.license_url: Optional[str] = license_url
+
+        self.error: Optional[str] = error
+        self.attempts: int = attempts
+
+        # Timings (seconds since the epoch)
+        self.created_at: Optional[float] = created_at
+        self.updated_at: Optional[float] = updated_at
+        self.started_at: Optional[float] = started_at
+        self.extracted_at: Optional[float] = extracted_at
+        self.downloaded_at: Optional[float] = downloaded_at
+        self.muxed_at: Optional[float] = muxed_at
+
+    @property
+    def key(self) -> str:
+        return job_key(self.url)
+
+    @property
+    def done(self) -> bool:
+        return self.state == JobState.MUXED
+
+    def resume_stage(self) -> JobState:
+        """Last stage this job completed, regardless of a later failure."""
+        if self.muxed_at is not None:
+            return JobState.MUXED
+
+        if self.downloaded_at is not None:
+            return JobState.DOWNLOADED
+
+        if self.extracted_at is not None and self.manifest_url and self.license_url:
+            return JobState.EXTRACTED
+
+        return JobState.PENDING
+
+    @staticmethod
+    def from_row(row: sqlite3.Row):
+        values = dict(row)
+        values["state"] = JobState(values["state"])
+        return Job(**values)
+
+
+def normalize_url(url: str) -> str:
+    if url is None:
+        raise ValueError("url cannot be None")
+
+    url = url.strip()
+    parts = urlsplit(url)
+
+    # Scheme and host are case insensitive; fragments never reach the server
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
+
+
+def job_key(url: str) -> str:
+    return hashlib.sha1(normalize_url(url).encode("utf-8")).hexdigest()[:12]
+
+
+def output_filename_for(url: str, extension: str = ".mp4") -> str:
+    """
+    Stable output name derived from the URL itself, so adding or removing
+    lines from the input file does not rename the other outputs.
+    """
+    segments = [s for s in urlsplit(normalize_url(url)).path.split("/") if s]
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "-", segments[-1]).strip("-") if segments else ""
+
+    return f"{slug or 'file'}_{job_key(url)[:8]}{extension}"
+
+
+class JobDB:
+    def __init__(self, path: str):
+        if path is None:
+            raise ValueError("path cannot be None")
+
+        self.path: str = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(SCHEMA)
+
+        logger.info(f"Using job database {path}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, url: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE url = ?", (normalize_url(url),)
+            ).fetchone()
+
+        return Job.from_row(row) if row is not None else None
+
+    def add(self, url: str, output_path: Optional[str] = None) -> tuple[Job, bool]:
+        """Register a URL. Returns the job and whether it was newly created."""
+        url = normalize_url(url)
+        now = time.time()
+
+        if output_path is None:
+            output_path = output_filename_for(url)
+
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (url, state, output_path, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (url, str(JobState.PENDING), output_path, now, now),
+            )
+            created = cursor.rowcount == 1
+            row = self._conn.execute("SELECT * FROM jobs WHERE url = ?", (url,)).fetchone()
+
+        return Job.from_row(row), created
+
+    def start(self, job: Job):
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET attempts = attempts + 1, started_at = ?, updated_at = ?, "
+                "error = NULL WHERE url = ?",
+                (now, now, job.url),
+            )
+
+        job.attempts += 1
+        job.started_at = now
+        job.updated_at = now
+        job.error = None
+
+    def advance(self, job: Job, state: JobState, **fields):
+        """Mark `state` as completed for `job`, storing any extra columns given."""
+        if state not in STAGE_COLUMNS:
+            raise ValueError(f"Cannot advance job to {state}")
+
+        now = time.time()
+        fields[STAGE_COLUMNS[state]] = now
+        fields["state"] = str(state)
+        fields["updated_at"] = now
+
+        self._update(job.url, fields)
+
+        for name, value in fields.items():
+            setattr(job, name, value)
+        job.state = state
+
+    def fail(self, job: Job, error: str):
+        now = time.time()
+        self._update(job.url, {"state": str(JobState.FAILED), "error": error, "updated_at": now})
+
+        job.state = JobState.FAILED
+        job.error = error
+        job.updated_at = now
+
+    def jobs(self, state: Optional[JobState] = None) -> list[Job]:
+        with self._lock:
+            if state is None:
+                rows = self._conn.execute("SELECT * FROM jobs ORDER BY created_at").fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT * FROM jobs WHERE state = ? ORDER BY created_at", (str(state),)
+                ).fetchall()
+
+        return [Job.from_row(row) for row in rows]
+
+    def _update(self, url: str, fields: dict):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE url = ?", (*fields.values(), url))
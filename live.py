@@ -0,0 +1,300 @@
+"""
+Recording of live (type="dynamic") manifests.
+
+A live MPD only lists the segments of its time-shift window and is replaced
+every minimumUpdatePeriod. The recorder fetches it again at that period and,
+for each recorded stream, fetches only the SegmentTimeline entries after the
+last segment it appended, writing them to the work file as they arrive; the
+usual decryption and merge run once recording stops. It stops after
+`settings.live_duration` seconds of media, or when the event ends: the
+manifest turns static or stops announcing updates, or no new segment has been
+listed for LIVE_STALL_TIMEOUT seconds. If the manifest cannot be refreshed any
+more, or a recorded stream leaves it, recording stops too and what was
+appended so far is kept, as a partial recording.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import governor
+import mpdparse
+import retry
+import segcache
+from config import Settings
+from defaults import DEFAULT_ENCRYPTED_AUDIO_FILENAME, DEFAULT_ENCRYPTED_VIDEO_FILENAME
+from errors import DownloadError, ManifestError
+from mpdparse import Catalog
+from segments import Segment, initialization_url, media_segments, timeline_entries
+from stream import Stream, StreamType
+from utils import download_file
+
+logger = logging.getLogger(__name__)
+
+# Segments behind the live edge where recording starts, unless live_from_start
+LIVE_EDGE_SEGMENTS: int = 3
+
+# Seconds without new segments after which the event is considered over
+LIVE_STALL_TIMEOUT: float = 120
+
+# Lower bound of the refresh interval, for manifests announcing PT0S
+MIN_REFRESH_INTERVAL: float = 1
+
+# Seconds of media recorded, and whether recording stopped before the event
+# (or the requested duration) ended
+Recording = namedtuple("Recording", ["seconds", "partial"])
+
+
+class LiveTrack:
+    """A stream being recorded, and the position of its last appended segment."""
+
+    def __init__(self, stream: Stream, output_path: str):
+        self.stream: Stream = stream
+        self.output_path: str = output_path
+
+        # End of the last appended segment, in timescale units
+        self.next_time: Optional[int] = None
+
+        # Seconds of media appended
+        self.recorded: float = 0
+        self.missing: int = 0
+
+    def pending(
+        self, stream: Stream, manifest_url: str, start: Optional[float], limit: Optional[float]
+    ) -> list[tuple[Segment, int]]:
+        """
+        (segment, duration) of the refreshed `stream` not appended yet: after the
+        last appended one, or from `start` seconds for the first ones, up to
+        `limit` seconds of recording.
+        """
+        info = stream.segments
+        entries = timeline_entries(info)
+        segments = media_segments(info, stream.id, stream.bandwidth, manifest_url)
+
+        if self.next_time is not None:
+            new = [(s, d) for s, (t, d) in zip(segments, entries) if t >= self.next_time]
+
+            if new and new[0][0].time > self.next_time:
+                gap = (new[0][0].time - self.next_time) / info.timescale
+                logger.warning(f"Stream {stream.id} lost {gap:.1f} s that left the live window")
+        elif start is not None:
+            new = [(s, d) for s, (t, d) in zip(segments, entries) if t + d > start * info.timescale]
+        else:
+            new = list(zip(segments, (d for _, d in entries)))
+
+        pending = []
+        recorded = self.recorded
+
+        for segment, d in new:
+            if limit is not None and recorded >= limit:
+                break
+
+            pending.append((segment, d))
+            recorded += d / info.timescale
+
+        return pending
+
+
+def output_path_for(stream: Stream, workdir: str) -> str:
+    if stream.stream_type == StreamType.VIDEO:
+        return os.path.join(workdir, DEFAULT_ENCRYPTED_VIDEO_FILENAME)
+
+    return os.path.join(workdir, DEFAULT_ENCRYPTED_AUDIO_FILENAME)
+
+
+def live_edge(stream: Stream) -> float:
+    """Presentation time, in seconds, LIVE_EDGE_SEGMENTS segments behind the edge."""
+    entries = timeline_entries(stream.segments)
+
+    if not entries:
+        raise ManifestError(f"Live stream {stream.id} lists no segments")
+
+    t, _ = entries[max(0, len(entries) - LIVE_EDGE_SEGMENTS)]
+    return t / stream.segments.timescale
+
+
+def fetch_catalog(manifest: str, settings: Settings) -> Catalog:
+    return mpdparse.parse_manifest(
+        retry.POLICY.call(
+            mpdparse.fetch_manifest,
+            manifest,
+            timeout=settings.timeout,
+            description="Manifest refresh",
+        ),
+        settings,
+    )
+
+
+def fetch_segment(url: str, workdir: str, settings: Settings) -> Optional[str]:
+    """
+    Path of the downloaded segment, None if it could not be fetched; outside
+    the segment cache it is a temporary file for the caller to remove.
+    """
+    if segcache.CACHE is not None:
+        return segcache.CACHE.fetch(url)
+
+    fd, path = tempfile.mkstemp(dir=workdir, suffix=".segment")
+    os.close(fd)
+
+    if not download_file(url, path, settings):
+        os.remove(path)
+        return None
+
+    return path
+
+
+def append_segments(
+    track: LiveTrack, out, segments: list[tuple[Segment, int]], workdir: str, settings: Settings
+) -> int:
+    """Fetch `segments` concurrently and append them in order, returning the appended count."""
+    if not segments:
+        return 0
+
+    urls = [segment.url for segment, _ in segments]
+    workers = governor.GOVERNOR.connections(governor.host_of(urls[0]))
+    fetch = retry.in_job(lambda url: fetch_segment(url, workdir, settings))
+    appended = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        fetched = segcache.fetch_ahead(executor, fetch, urls, workers * segcache.FETCH_AHEAD)
+
+        for (segment, d), path in zip(segments, fetched):
+            # The segment is gone for good at this point: a gap is better than
+            # losing the whole recording
+            if path is None:
+                logger.warning(f"Skipping segment {segment.url} of stream {track.stream.id}")
+                track.missing += 1
+            else:
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, out)
+
+                if segcache.CACHE is None:
+                    os.remove(path)
+
+                appended += 1
+
+            track.next_time = segment.time + d
+            track.recorded += d / track.stream.segments.timescale
+
+    out.flush()
+    return appended
+
+
+def record(
+    manifest: str,
+    catalog: Catalog,
+    streams: list[Stream],
+    workdir: str = ".",
+    settings: Optional[Settings] = None,
+) -> Recording:
+    """
+    Record `streams` of the live `manifest`, whose first fetch is `catalog`,
+    into the work files of `workdir`.
+    """
+    if manifest is None:
+        raise ValueError("manifest cannot be None")
+
+    if catalog is None:
+        raise ValueError("catalog cannot be None")
+
+    if settings is None:
+        settings = Settings()
+
+    for s in streams:
+        if s.segments is None or s.segments.timeline is None:
+            raise ManifestError(f"Live stream {s.id} has no SegmentTimeline, cannot record it")
+
+    tracks = [LiveTrack(s, output_path_for(s, workdir)) for s in streams]
+    start = None if settings.live_from_start else live_edge(streams[0])
+    limit = settings.live_duration
+
+    logger.info(
+        f"Recording live streams {[s.id for s in streams]} "
+        f"for {f'{limit:.0f} s' if limit is not None else 'the whole event'}"
+    )
+
+    files = [open(track.output_path, "wb") for track in tracks]
+    last_new = time.monotonic()
+    partial = False
+
+    try:
+        # Init segments first, the media segments are appended after them
+        for track, out in zip(tracks, files):
+            info = track.stream.segments
+            init_url = initialization_url(info, track.stream.id, track.stream.bandwidth, manifest)
+
+            if init_url is not None:
+                path = fetch_segment(init_url, workdir, settings)
+
+                if path is None:
+                    raise DownloadError(f"Failed to download segment {init_url}")
+
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, out)
+
+                if segcache.CACHE is None:
+                    os.remove(path)
+
+        while True:
+            refreshed = time.monotonic()
+            new = 0
+            current = {s.id: s for s in catalog.streams if s.segments is not None}
+            gone = [track.stream.id for track in tracks if track.stream.id not in current]
+
+            if gone:
+                logger.warning(f"Streams {gone} left the live manifest, stopping")
+                partial = True
+                break
+
+            for track, out in zip(tracks, files):
+                segments = track.pending(current[track.stream.id], manifest, start, limit)
+                new += len(segments)
+                append_segments(track, out, segments, workdir, settings)
+
+            recorded = min(track.recorded for track in tracks)
+
+            if new:
+                last_new = time.monotonic()
+                logger.info(f"Recorded {recorded:.0f} s of the live event")
+
+            if limit is not None and recorded >= limit:
+                logger.info(f"Recorded the requested {limit:.0f} s")
+                break
+
+            if not catalog.dynamic or catalog.update_period is None:
+                logger.info("The live event has ended")
+                break
+
+            if time.monotonic() - last_new > LIVE_STALL_TIMEOUT:
+                logger.warning(f"No new segments for {LIVE_STALL_TIMEOUT:.0f} s, stopping")
+                break
+
+            interval = max(MIN_REFRESH_INTERVAL, catalog.update_period)
+            time.sleep(max(0, interval - (time.monotonic() - refreshed)))
+
+            try:
+                catalog = fetch_catalog(manifest, settings)
+            except (OSError, ManifestError) as e:
+                logger.error(f"Could not refresh the live manifest, stopping: {e}")
+                partial = True
+                break
+    finally:
+        for out in files:
+            out.close()
+
+    missing = sum(track.missing for track in tracks)
+    if missing:
+        logger.warning(f"{missing} segments could not be downloaded and were skipped")
+
+    recorded = min(track.recorded for track in tracks)
+
+    if partial:
+        logger.warning(f"Keeping the {recorded:.0f} s recorded before the event ended")
+
+    return Recording(recorded, partial)
@@ -0,0 +1,78 @@
+"""
+Logging setup of the command line tool.
+
+Library modules only create their loggers; the CLI configures the root logger
+once, as plain text (the historical format), JSON lines for log collectors,
+or rich output that scrolls above the progress dashboard.
+"""
+
+import json
+import logging
+import sys
+import time
+
+from typing import Optional
+
+LOG_FORMATS = ("text", "json")
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] [%(module)s.%(funcName)s:%(lineno)d] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Attributes every LogRecord has; anything else was passed with `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+    "taskName",
+}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with the `extra` fields of the record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith("_"):
+                entry[name] = value
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def setup_logging(level: int = logging.INFO, fmt: str = "text", console=None):
+    """
+    Configure the root logger, replacing its handlers. With a rich `console`
+    (see `dashboard.Dashboard`), text logs are printed above its live display.
+    """
+    if fmt not in LOG_FORMATS:
+        raise ValueError(f"Unsupported log format: {fmt}")
+
+    handler: Optional[logging.Handler] = None
+
+    if fmt == "json":
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JSONFormatter())
+    elif console is not None:
+        from rich.logging import RichHandler
+
+        handler = RichHandler(console=console, show_path=False, log_time_format="[%X]")
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+
+    root = logging.getLogger()
+
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+
+    root.addHandler(handler)
+    root.setLevel(level)
@@ -0,0 +1,384 @@
+"""
+Streaming MPD parser.
+
+`mpegdash` builds a Python object for every element of the manifest, which
+for multi-hour SegmentTimeline manifests means millions of `S` nodes that are
+only read once. This parser walks the document with lxml's iterparse, keeps
+only the fields `Stream` and `segments.SegmentInfo` need (timelines become
+lists of (t, d, r) tuples shared by the representations that inherit them)
+and frees every element once it has been read. It produces the same stream
+catalog as `stream.get_streams` on an `mpegdash` tree; `settings.mpd_parser`
+selects either path, see scripts/bench_mpd.py for a comparison.
+"""
+
+import io
+import logging
+import re
+
+from typing import Optional, Union
+from urllib.parse import urljoin
+
+import requests
+
+import stream
+from config import Settings
+from errors import ManifestError
+from segments import SegmentInfo
+from stream import Stream, StreamType
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+try:
+    from mpegdash.parser import MPEGDASHParser
+except ImportError:
+    MPEGDASHParser = None
+
+logger = logging.getLogger(__name__)
+
+MPD_PARSERS = ("lxml", "mpegdash")
+
+
+class Catalog:
+    def __init__(
+        self,
+        streams: list[Stream],
+        duration: Optional[float],
+        dynamic: bool = False,
+        update_period: Optional[float] = None,
+    ):
+        # Video, then audio, then subtitle streams, as returned by stream.get_streams
+        self.streams: list[Stream] = streams
+
+        # Presentation duration in seconds, if the manifest states it
+        self.duration: Optional[float] = duration
+
+        # Live manifest (type="dynamic"), to be fetched again every
+        # minimumUpdatePeriod seconds; None when it will not change any more
+        self.dynamic: bool = dynamic
+        self.update_period: Optional[float] = update_period
+
+
+# The attributes below mirror the ones of the mpegdash nodes, so that the
+# classification functions of `stream` apply to both
+
+
+class _BaseURL:
+    def __init__(self, base_url_value: Optional[str]):
+        self.base_url_value: Optional[str] = base_url_value
+
+
+class _PSSH:
+    def __init__(self, pssh: Optional[str]):
+        self.pssh: Optional[str] = pssh
+
+
+class _ContentProtection:
+    def __init__(self, attrib):
+        self.scheme_id_uri: Optional[str] = attrib.get("schemeIdUri")
+        self.value: Optional[str] = attrib.get("value")
+        self.id: Optional[str] = attrib.get("id")
+        self.default_key_id: Optional[str] = attrib.get("default_KID")
+        self.cenc_default_kid: Optional[str] = _namespaced(attrib, "default_KID")
+        self.pssh: Optional[list[_PSSH]] = None
+
+
+class _SegmentTemplate:
+    def __init__(self, attrib):
+        self.media: Optional[str] = attrib.get("media")
+        self.initialization: Optional[str] = attrib.get("initialization")
+        self.timescale: Optional[int] = _int(attrib.get("timescale"))
+        self.start_number: Optional[int] = _int(attrib.get("startNumber"))
+        self.duration: Optional[int] = _int(attrib.get("duration"))
+        self.timeline: Optional[list[tuple[Optional[int], int, int]]] = None
+
+
+class _Node:
+    """MPD, Period, AdaptationSet or Representation."""
+
+    def __init__(self, attrib):
+        self.id: Optional[str] = attrib.get("id")
+        self.lang: Optional[str] = attrib.get("lang")
+        self.codecs: Optional[str] = attrib.get("codecs")
+        self.content_type: Optional[str] = attrib.get("contentType")
+        self.mime_type: Optional[str] = attrib.get("mimeType")
+        self.bandwidth: Optional[int] = _int(attrib.get("bandwidth"))
+        self.width: Optional[int] = _int(attrib.get("width"))
+        self.height: Optional[int] = _int(attrib.get("height"))
+        self.frame_rate: Optional[str] = attrib.get("frameRate")
+        self.duration: Optional[str] = attrib.get("duration")
+
+        self.base_urls: list[_BaseURL] = []
+        self.template: Optional[_SegmentTemplate] = None
+        self.content_protections: Optional[list[_ContentProtection]] = None
+        self.representations: list["_Node"] = []
+
+
+def _int(value: Optional[str]) -> Optional[int]:
+    return int(value) if value is not None else None
+
+
+def _namespaced(attrib, name: str) -> Optional[str]:
+    for key, value in attrib.items():
+        if key.startswith("{") and key.endswith("}" + name):
+            return value
+
+    return None
+
+
+def _localname(tag) -> str:
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _free(element):
+    """Release an element that has been read, and the siblings before it."""
+    element.clear()
+
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def _segment_info(
+    mpd: _Node, period: _Node, adaptation: _Node, representation: _Node, duration: Optional[float]
+) -> Optional[SegmentInfo]:
+    """Same inheritance rules as `segments.segment_info`."""
+    templates = [
+        node.template for node in (representation, adaptation, period) if node.template is not None
+    ]
+
+    if not templates:
+        return None
+
+    base_url = ""
+    for node in (mpd, period, adaptation, representation):
+        url = node.base_urls[0] if node.base_urls else None
+        if url is not None and url.base_url_value:
+            base_url = urljoin(base_url, url.base_url_value.strip())
+
+    def inherited(attribute: str):
+        return next(
+            (getattr(t, attribute) for t in templates if getattr(t, attribute) is not None), None
+        )
+
+    return SegmentInfo(
+        base_url,
+        inherited("media"),
+        inherited("initialization"),
+        inherited("timescale") or 1,
+        inherited("start_number") or 1,
+        inherited("duration"),
+        inherited("timeline"),
+        duration,
+    )
+
+
+def _streams_of(
+    mpd: _Node, period: _Node, adaptation: _Node, duration: Optional[float]
+) -> tuple[Optional[StreamType], list[Stream]]:
+    if stream.is_audio_adaptation(adaptation):
+        stream_type = StreamType.AUDIO
+    elif stream.is_subtitle_adaptation(adaptation):
+        stream_type = StreamType.SUBTITLES
+    elif stream.is_video_adaptation(adaptation):
+        stream_type = StreamType.VIDEO
+    else:
+        return None, []
+
+    streams = []
+
+    for r in adaptation.representations:
+        subtitle_urls = (
+            [url.base_url_value for url in r.base_urls]
+            if stream_type == StreamType.SUBTITLES
+            else []
+        )
+
+        streams.append(
+            Stream(
+                r.id,
+                stream_type,
+                r.bandwidth,
+                r.width,
+                r.height,
+                r.frame_rate,
+                subtitle_urls,
+                r.content_protections,
+                _segment_info(mpd, period, adaptation, r, duration),
+                adaptation.lang,
+                r.codecs or adaptation.codecs,
+            )
+        )
+
+    return stream_type, streams
+
+
+def parse_catalog(source: Union[str, bytes]) -> Catalog:
+    """Parse an MPD document (text or bytes) into its stream catalog."""
+    if etree is None:
+        raise ValueError("The lxml MPD parser needs the lxml module: pip install lxml")
+
+    if source is None:
+        raise ValueError("source cannot be None")
+
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+
+    mpd: Optional[_Node] = None
+    period: Optional[_Node] = None
+    adaptation: Optional[_Node] = None
+    representation: Optional[_Node] = None
+    template: Optional[_SegmentTemplate] = None
+    protection: Optional[_ContentProtection] = None
+
+    periods = 0
+    duration: Optional[float] = None
+    dynamic = False
+    update_period: Optional[float] = None
+    by_type: dict[StreamType, list[Stream]] = {t: [] for t in StreamType}
+
+    # Node whose BaseURL, SegmentTemplate... children are being read
+    owners: list[_Node] = []
+
+    try:
+        for event, element in etree.iterparse(
+            io.BytesIO(source), events=("start", "end"), remove_comments=True
+        ):
+            name = _localname(element.tag)
+
+            if event == "start":
+                if name == "MPD":
+                    mpd = _Node(element.attrib)
+                    owners.append(mpd)
+                    duration = stream.parse_duration(
+                        element.attrib.get("mediaPresentationDuration")
+                    )
+                    dynamic = element.attrib.get("type") == "dynamic"
+                    update_period = stream.parse_duration(element.attrib.get("minimumUpdatePeriod"))
+                elif name == "Period":
+                    periods += 1
+                    period = _Node(element.attrib)
+                    owners.append(period)
+
+                    if duration is None and periods == 1:
+                        duration = stream.parse_duration(period.duration)
+                elif name == "AdaptationSet":
+                    adaptation = _Node(element.attrib)
+                    owners.append(adaptation)
+                elif name == "Representation":
+                    representation = _Node(element.attrib)
+                    owners.append(representation)
+                elif name == "SegmentTemplate":
+                    template = _SegmentTemplate(element.attrib)
+
+                    if owners and owners[-1].template is None:
+                        owners[-1].template = template
+                elif name == "SegmentTimeline" and template is not None:
+                    if template.timeline is None:
+                        template.timeline = []
+                elif name == "ContentProtection":
+                    protection = _ContentProtection(element.attrib)
+
+                    if representation is not None and owners[-1] is representation:
+                        if representation.content_protections is None:
+                            representation.content_protections = []
+                        representation.content_protections.append(protection)
+
+                continue
+
+            if name == "S" and template is not None and template.timeline is not None:
+                attrib = element.attrib
+                template.timeline.append(
+                    (_int(attrib.get("t")), int(attrib.get("d", 0)), int(attrib.get("r") or 0))
+                )
+                _free(element)
+            elif name == "BaseURL" and owners:
+                owners[-1].base_urls.append(_BaseURL(element.text))
+            elif name == "pssh" and protection is not None:
+                if protection.pssh is None:
+                    protection.pssh = []
+                protection.pssh.append(_PSSH(element.text or None))
+            elif name == "ContentProtection":
+                protection = None
+            elif name == "SegmentTemplate":
+                template = None
+            elif name == "Representation":
+                adaptation.representations.append(owners.pop())
+                representation = None
+                _free(element)
+            elif name == "AdaptationSet":
+                owners.pop()
+
+                # Only the streams of the first period are kept, as with get_streams
+                if periods == 1:
+                    stream_type, streams = _streams_of(mpd, period, adaptation, duration)
+                    if stream_type is not None:
+                        by_type[stream_type] += streams
+
+                adaptation = None
+                _free(element)
+            elif name == "Period":
+                owners.pop()
+                _free(element)
+    except etree.XMLSyntaxError as e:
+        raise ManifestError(f"Invalid manifest: {e}") from e
+
+    if mpd is None:
+        raise ManifestError("Not an MPD manifest")
+
+    if periods != 1:
+        raise ManifestError(f"Manifests with {periods} periods are not supported, only one")
+
+    logger.info(f"Audio Streams: {[s.id for s in by_type[StreamType.AUDIO]]}")
+    logger.info(f"Video Streams: {[s.id for s in by_type[StreamType.VIDEO]]}")
+
+    return Catalog(
+        by_type[StreamType.VIDEO] + by_type[StreamType.AUDIO] + by_type[StreamType.SUBTITLES],
+        duration,
+        dynamic,
+        update_period,
+    )
+
+
+def parse_catalog_mpegdash(source: Union[str, bytes]) -> Catalog:
+    """The same catalog, through the full `mpegdash` object tree."""
+    if MPEGDASHParser is None:
+        raise ValueError("The mpegdash MPD parser needs the mpegdash module: pip install mpegdash")
+
+    if isinstance(source, bytes):
+        source = source.decode("utf-8")
+
+    mpd = MPEGDASHParser.parse(source)
+    return Catalog(
+        stream.get_streams(mpd),
+        stream.get_duration(mpd),
+        mpd.type == "dynamic",
+        stream.parse_duration(mpd.minimum_update_period),
+    )
+
+
+def fetch_manifest(
+    manifest: str, session: Optional[requests.Session] = None, timeout: Optional[int] = None
+) -> bytes:
+    """The MPD document at `manifest`, a URL or a local path."""
+    if re.match(r"https?://", manifest, re.IGNORECASE):
+        response = (session or requests).get(manifest, timeout=timeout)
+        response.raise_for_status()
+        return response.content
+
+    with open(manifest, "rb") as f:
+        return f.read()
+
+
+def parse_manifest(source: Union[str, bytes], settings: Optional[Settings] = None) -> Catalog:
+    """Parse an MPD document with the parser of `settings.mpd_parser`."""
+    if settings is None:
+        settings = Settings()
+
+    if settings.mpd_parser == "mpegdash":
+        return parse_catalog_mpegdash(source)
+
+    return parse_catalog(source)
@@ -5,42 +5,194 @@ import argparse
 import logging
 import sys
 
-from mpegdash.parser import MPEGDASHParser
-
-import downloader
+import api
+import config
 import extractor
+import intake
+import logs
 import pp
-import stream
+import progress
+import retry
 import utils
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] [%(module)s.%(funcName)s:%(lineno)d] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
+from dashboard import Dashboard
+from defaults import (
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_CONFIG_PATHS,
+    DEFAULT_DISK_MARGIN,
+    DEFAULT_JOB_DB_FILENAME,
+    DEFAULT_LEASE_TIME,
+    DEFAULT_MAX_CONNECTIONS,
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_MERGED_VIDEO_FILENAME,
+    DEFAULT_SCRATCH_DIR,
+    DEFAULT_SUBTITLE_FORMAT,
+    DEFAULT_TIMEOUT,
 )
+from diskspace import format_size
+from logs import LOG_FORMATS
+from mpdparse import MPD_PARSERS
+from pp import LIST_FORMATS
+from stream import CONTAINERS
+from retry import DEFAULT_BASE_DELAY, DEFAULT_MAX_ATTEMPTS, DEFAULT_MAX_DELAY, DEFAULT_RETRY_BUDGET
+from subtitles import SUBTITLE_FORMATS
 
 logger = logging.getLogger(__name__)
 
-parser = argparse.ArgumentParser(prog="opto-dl", description="Download media from Opto")
+parser = argparse.ArgumentParser(
+    prog="opto-dl",
+    description="Download media from Opto",
+    epilog="Settings are read from the defaults, then a config file, then OPTO_DL_* environment "
+    "variables (e.g. OPTO_DL_TIMEOUT=30), then these flags",
+)
+
+parser.add_argument(
+    "--config",
+    help="TOML or JSON settings file (default: $OPTO_DL_CONFIG, or the first of "
+    f"{', '.join(DEFAULT_CONFIG_PATHS)} that exists)",
+)
+
+parser.add_argument("-f", "--file", help="File with multiple URLs (- to read from stdin)")
+
+parser.add_argument(
+    "--follow",
+    action="store_true",
+    help="Keep reading URLs appended to --file until interrupted",
+)
+
+parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    help="Number of URLs from --file to download concurrently (default: 1), "
+    f"or of items to inspect with --list-streams (default: {DEFAULT_MAX_WORKERS})",
+)
+
+parser.add_argument(
+    "--max-connections",
+    type=int,
+    help="Upper bound for the adaptive number of parallel connections per host "
+    f"(default: {DEFAULT_MAX_CONNECTIONS})",
+)
+
+parser.add_argument(
+    "--host-jobs",
+    type=int,
+    help="With -f, run at most this many jobs per manifest host at a time (default: --jobs)",
+)
+
+parser.add_argument(
+    "--bandwidth-cap",
+    type=config.parse_size,
+    help="Global download rate limit in bytes per second (e.g. 500K, 20M)",
+)
+
+parser.add_argument(
+    "--retry-config",
+    help="JSON or TOML file with the retry policy (attempts, delays, budget and per-error rules)",
+)
+
+parser.add_argument(
+    "--retries",
+    type=int,
+    help="Retries of a failed request whose error is retryable "
+    f"(default: {DEFAULT_MAX_ATTEMPTS - 1})",
+)
+
+parser.add_argument(
+    "--retry-delay",
+    type=float,
+    help=f"Initial backoff between retries, in seconds (default: {DEFAULT_BASE_DELAY})",
+)
+
+parser.add_argument(
+    "--retry-max-delay",
+    type=float,
+    help=f"Longest backoff between retries, in seconds (default: {DEFAULT_MAX_DELAY})",
+)
+
+parser.add_argument(
+    "--retry-budget",
+    type=int,
+    help="Retries a single job may spend in total before failing "
+    f"(default: {DEFAULT_RETRY_BUDGET})",
+)
+
+parser.add_argument(
+    "--disk-margin",
+    type=config.parse_size,
+    help="Free disk space to always keep, in bytes (e.g. 500M, 2G); "
+    f"jobs wait for space before downloading (default: {format_size(DEFAULT_DISK_MARGIN)})",
+)
+
+parser.add_argument(
+    "--cache-dir",
+    help="Directory of the segment cache shared by all downloads (disabled by default)",
+)
+
+parser.add_argument(
+    "--cache-size",
+    type=config.parse_size,
+    help="Size limit of the segment cache (e.g. 10G); least recently used entries are evicted "
+    f"(default: {format_size(DEFAULT_CACHE_SIZE)})",
+)
+
+parser.add_argument(
+    "--scratch-dir",
+    help=f"Directory of the per-job work directories (default: {DEFAULT_SCRATCH_DIR})",
+)
+
+parser.add_argument(
+    "--job-db",
+    help="Database used to track the state of batch (--file) downloads "
+    f"(default: {DEFAULT_JOB_DB_FILENAME})",
+)
+
+parser.add_argument(
+    "--queue",
+    help="Shared queue for distributed downloads: a SQLite file on shared storage or a "
+    "redis://host:port/db URL. With --file, the URLs are added to it; with --worker, jobs are "
+    "taken from it",
+)
 
-parser.add_argument("-f", "--file", help="File with multiple URLs")
+parser.add_argument(
+    "--worker",
+    action="store_true",
+    help="Download URLs from --queue, --jobs at a time, until interrupted",
+)
+
+parser.add_argument(
+    "--drain",
+    action="store_true",
+    help="With --worker, exit once the queue has no queued or running URLs",
+)
+
+parser.add_argument(
+    "--lease-time",
+    type=int,
+    help="Seconds a claimed URL stays leased without a heartbeat before another worker "
+    f"takes it (default: {DEFAULT_LEASE_TIME})",
+)
 
 parser.add_argument(
     "--url",
-    help="URL of the video (from https://opto.sic.pt/)",
+    action="extend",
+    nargs="+",
+    help="URL of the video (from https://opto.sic.pt/); --list-streams accepts several",
 )
 
 
 parser.add_argument(
     "--manifest",
-    help="URL of the manifest",
+    action="extend",
+    nargs="+",
+    help="URL of the manifest; --list-streams accepts several",
 )
 
-# TODO: Use this
 parser.add_argument(
     "--timeout",
     type=int,
-    help="Timeout in seconds",
+    help="Timeout of HTTP requests, and time the player has to request the manifest, in seconds "
+    f"(default: {DEFAULT_TIMEOUT})",
 )
 
 parser.add_argument(
@@ -49,20 +201,58 @@ parser.add_argument(
     help="Download subtitles",
 )
 
+parser.add_argument(
+    "--subtitle-format",
+    choices=SUBTITLE_FORMATS,
+    help="Format the subtitles are converted to before being muxed into the output "
+    f"(default: {DEFAULT_SUBTITLE_FORMAT})",
+)
+
 parser.add_argument(
     "--list-streams",
     action="store_true",
     help="List available streams",
 )
 
+parser.add_argument(
+    "--list-format",
+    choices=LIST_FORMATS,
+    default="table",
+    help="Output format of --list-streams",
+)
+
+parser.add_argument(
+    "--mpd-parser",
+    choices=MPD_PARSERS,
+    help="lxml parses manifests incrementally, using far less memory on long SegmentTimelines; "
+    "mpegdash builds the full object tree (default: lxml)",
+)
+
+parser.add_argument(
+    "--live-duration",
+    type=config.parse_seconds,
+    help="For live manifests, stop recording after this much media, e.g. 90m or 2h "
+    "(default: record until the event ends)",
+)
+
+parser.add_argument(
+    "--live-from-start",
+    action="store_true",
+    default=None,
+    help="For live manifests, start at the beginning of the time-shift window instead of "
+    "the live edge",
+)
+
 parser.add_argument(
     "--audio-stream",
-    help="Audio stream ID",
+    help="Audio stream ID, glob, /regex/ or attribute selector (e.g. audio:lang=por); "
+    "also applies to every URL of --file",
 )
 
 parser.add_argument(
     "--video-stream",
-    help="Video stream ID",
+    help="Video stream ID, glob, /regex/ or attribute selector (e.g. video:height<=720); "
+    "also applies to every URL of --file",
 )
 
 parser.add_argument(
@@ -71,43 +261,193 @@ parser.add_argument(
     help="License URL",
 )
 
+parser.add_argument(
+    "--container",
+    choices=CONTAINERS,
+    help="Output container: mp4, faststart (mp4 with the index at the front), fmp4 "
+    "(fragmented, streamable) or mkv (default: from the output name; fmp4 for pipes)",
+)
+
 parser.add_argument(
     "-o",
     "--output",
-    help="Output file",
+    help="Output file, or - to write the video to stdout (e.g. to pipe it to an uploader)",
+)
+
+parser.add_argument(
+    "-q",
+    "--quiet",
+    action="store_true",
+    default=None,
+    help="Only log warnings and errors",
+)
+
+parser.add_argument(
+    "--log-format",
+    choices=LOG_FORMATS,
+    help="text, or json for one JSON object per line, e.g. for log collectors (default: text)",
+)
+
+parser.add_argument(
+    "--progress",
+    action=argparse.BooleanOptionalAction,
+    help="Show the live dashboard of a --file batch (default: when stderr is a terminal); "
+    "without it, a progress summary is logged periodically",
 )
 
 args = parser.parse_args()
 
+try:
+    retry_config = retry.load_config(args.retry_config) if args.retry_config is not None else {}
+
+    for key, value in (
+        ("max_attempts", args.retries + 1 if args.retries is not None else None),
+        ("base_delay", args.retry_delay),
+        ("max_delay", args.retry_max_delay),
+        ("budget", args.retry_budget),
+    ):
+        if value is not None:
+            retry_config[key] = value
+
+    settings = config.load_settings(
+        args.config,
+        {
+            "timeout": args.timeout,
+            "jobs": args.jobs,
+            "inspect_jobs": args.jobs,
+            "max_connections": args.max_connections,
+            "host_jobs": args.host_jobs,
+            "bandwidth_cap": args.bandwidth_cap,
+            "disk_margin": args.disk_margin,
+            "cache_dir": args.cache_dir,
+            "cache_size": args.cache_size,
+            "scratch_dir": args.scratch_dir,
+            "job_db": args.job_db,
+            "queue": args.queue,
+            "lease_time": args.lease_time,
+            "subtitle_format": args.subtitle_format,
+            "container": args.container,
+            "mpd_parser": args.mpd_parser,
+            "live_duration": args.live_duration,
+            "live_from_start": args.live_from_start,
+            "video_stream": args.video_stream,
+            "audio_stream": args.audio_stream,
+            "log_format": args.log_format,
+            "quiet": args.quiet,
+            "progress": args.progress,
+            "retry": retry_config,
+        },
+    )
+
+    show_dashboard = (
+        (args.worker or (args.file is not None and settings.queue is None))
+        and not args.list_streams
+        and settings.log_format == "text"
+        and (settings.progress if settings.progress is not None else sys.stderr.isatty())
+    )
+
+    # The dashboard replaces the INFO lines of the batch
+    dashboard = Dashboard() if show_dashboard else None
+    logs.setup_logging(
+        logging.WARNING if settings.quiet or show_dashboard else logging.INFO,
+        settings.log_format,
+        dashboard.console if dashboard is not None else None,
+    )
+
+    api.configure(settings)
+except (OSError, ValueError, TypeError) as e:
+    sys.stderr.write(f"Invalid settings: {e}\n")
+    sys.exit(1)
+
 if args.list_streams:
-    if args.manifest is None and args.url is None:
+    urls = list(args.url or [])
+    manifests = list(args.manifest or [])
+
+    if args.file is not None:
+        urls += intake.iter_urls(intake.iter_lines(args.file))
+
+    if not urls and not manifests:
         sys.stderr.write("Must provide URL or manifest\n")
         sys.exit(1)
-    elif args.manifest is not None:
-        manifest = args.manifest
-    elif args.url is not None:
-        manifest, _ = extractor.get_manifest_and_license(args.url)
 
-    mpd = MPEGDASHParser.parse(manifest)
-    streams = stream.get_streams(mpd)
-    pp.pp_streams(streams)
+    pp.pp_inventory(api.list_streams(urls, manifests, settings), args.list_format)
+
+    if extractor.RESOLVER_STATS.attempts:
+        logger.info(f"Manifest resolvers: {extractor.RESOLVER_STATS.summary()}")
+
+    sys.exit(0)
+
+if args.worker and settings.queue is None:
+    sys.stderr.write("--worker needs --queue\n")
+    sys.exit(1)
+
+if settings.queue is not None and args.file is not None and not args.worker:
+    try:
+        added = api.enqueue(intake.iter_urls(intake.iter_lines(args.file, args.follow)), settings)
+    except (OSError, ValueError) as e:
+        sys.stderr.write(f"{e}\n")
+        sys.exit(1)
+
+    logger.info(f"Queued {added} URL(s) in {settings.queue}")
     sys.exit(0)
 
+if len(args.url or []) > 1 or len(args.manifest or []) > 1:
+    sys.stderr.write("Only one --url or --manifest can be downloaded, use --file for several\n")
+    sys.exit(1)
+
+if (
+    not args.worker
+    and args.file is None
+    and args.url is None
+    and (args.manifest is None or args.license_url is None)
+):
+    sys.stderr.write("Must provide --file, --url, --manifest with --license-url, or --worker\n")
+    sys.exit(1)
+
+results: list[api.JobResult] = []
+
 try:
-    if args.file is not None:
-        downloader.download_by_file(args.file)
+    if args.worker:
+        with dashboard if dashboard is not None else progress.periodic_log():
+            results += api.run_worker(args.download_subtitles, args.drain, settings)
+    elif args.file is not None:
+        with dashboard if dashboard is not None else progress.periodic_log():
+            results += api.download_batch(args.file, args.download_subtitles, args.follow, settings)
     elif args.url is not None:
-        downloader.download_by_url(
-            args.url, args.download_subtitles, args.output, args.audio_stream, args.video_stream
+        results.append(
+            api.download(
+                url=args.url[0],
+                output=args.output or DEFAULT_MERGED_VIDEO_FILENAME,
+                audio_stream=args.audio_stream,
+                video_stream=args.video_stream,
+                subtitles=args.download_subtitles,
+                settings=settings,
+            )
         )
     if args.manifest is not None and args.license_url is not None:
-        downloader.download_by_manifest_and_license_url(
-            args.manifest,
-            args.license_url,
-            args.download_subtitles,
-            args.audio_stream,
-            args.video_stream,
-            args.output,
+        results.append(
+            api.download(
+                manifest=args.manifest[0],
+                license_url=args.license_url,
+                output=args.output or DEFAULT_MERGED_VIDEO_FILENAME,
+                audio_stream=args.audio_stream,
+                video_stream=args.video_stream,
+                subtitles=args.download_subtitles,
+                settings=settings,
+            )
         )
+except (OSError, ValueError, TypeError) as e:
+    sys.stderr.write(f"{e}\n")
+    sys.exit(1)
 finally:
     utils.cleanup()
+
+    if extractor.RESOLVER_STATS.attempts:
+        logger.info(f"Manifest resolvers: {extractor.RESOLVER_STATS.summary()}")
+
+failed = [result for result in results if not result.ok]
+
+for result in failed:
+    sys.stderr.write(f"Failed: {result.source}: {result.error}\n")
+
+sys.exit(1 if failed else 0)
@@ -1,7 +1,13 @@
+import csv
+import json
 import sys
 import logging
 
-from stream import Stream, StreamType
+from typing import Iterable, Optional
+
+from diskspace import format_size
+from inventory import InventoryItem
+from stream import Stream, StreamType, estimate_size
 
 try:
     from rich.console import Console
@@ -10,25 +16,108 @@ except ImportError:
     sys.stderr.write("Error: rich module not found. Install it with: pip install rich\n")
     sys.exit(1)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] [%(module)s.%(funcName)s:%(lineno)d] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
-
 logger = logging.getLogger(__name__)
 
 
-def pp_streams(streams: list[Stream]):
+LIST_FORMATS = ("table", "json", "csv")
+
+STREAM_FIELDS = [
+    "id",
+    "type",
+    "width",
+    "height",
+    "fps",
+    "bandwidth",
+    "codecs",
+    "language",
+    "estimated_size",
+]
+
+
+def stream_record(stream: Stream, duration: Optional[float] = None) -> dict:
+    return {
+        "id": stream.id,
+        "type": str(stream.stream_type),
+        "width": stream.width,
+        "height": stream.height,
+        "fps": stream.fps,
+        "bandwidth": stream.bandwidth,
+        "codecs": stream.codecs,
+        "language": stream.language,
+        "estimated_size": estimate_size(stream, duration),
+    }
+
+
+def pp_inventory(items: Iterable[InventoryItem], fmt: str = "table"):
+    if fmt == "json":
+        pp_inventory_json(items)
+    elif fmt == "csv":
+        pp_inventory_csv(items)
+    elif fmt == "table":
+        for item in items:
+            if item.manifest_url is not None and item.manifest_url != item.source:
+                print(f"{item.source} -> {item.manifest_url}")
+            else:
+                print(item.source)
+
+            if item.error is not None:
+                print(f"Error: {item.error}")
+            else:
+                pp_streams(item.streams, item.duration)
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def pp_inventory_json(items: Iterable[InventoryItem]):
+    records = [
+        {
+            "source": item.source,
+            "manifest": item.manifest_url,
+            "duration": item.duration,
+            "error": item.error,
+            "streams": [stream_record(s, item.duration) for s in item.streams],
+        }
+        for item in items
+    ]
+
+    json.dump(records, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+def pp_inventory_csv(items: Iterable[InventoryItem]):
+    writer = csv.DictWriter(
+        sys.stdout, fieldnames=["source", "manifest", "duration", "error"] + STREAM_FIELDS
+    )
+    writer.writeheader()
+
+    for item in items:
+        common = {
+            "source": item.source,
+            "manifest": item.manifest_url,
+            "duration": item.duration,
+            "error": item.error,
+        }
+
+        if not item.streams:
+            writer.writerow(common)
+
+        for s in item.streams:
+            writer.writerow(common | stream_record(s, item.duration))
+
+        # Rows are flushed per item so that long inventories can be tailed
+        sys.stdout.flush()
+
+
+def pp_streams(streams: list[Stream], duration: Optional[float] = None):
     if streams is None:
         raise ValueError("streams cannot be None")
 
     if not isinstance(streams, list):
-        logger.fatal(f"Invalid type for streams: Expected str, list {type(streams).__name__}")
+        raise TypeError(f"Invalid type for streams: Expected list, got {type(streams).__name__}")
 
     if not all(isinstance(x, Stream) for x in streams):
         invalid_types = {type(x).__name__ for x in streams if not isinstance(x, Stream)}
-        logger.fatal(
+        raise TypeError(
             f"Invalid items in streams: Expected all Stream instances, got {', '.join(invalid_types)}"
         )
 
@@ -44,6 +133,7 @@ def pp_streams(streams: list[Stream]):
     table.add_column("Resolution")
     table.add_column("Fps")
     table.add_column("Bandwidth")
+    table.add_column("Est. Size")
 
     for stream in streams:
         if stream.stream_type == StreamType.VIDEO:
@@ -52,12 +142,20 @@ def pp_streams(streams: list[Stream]):
                 str(stream.stream_type),
                 f"{stream.width}x{stream.height}",
                 str(stream.fps),
-                "--",
+                str(stream.bandwidth),
+                format_size(estimate_size(stream, duration)),
             )
         elif stream.stream_type == StreamType.AUDIO:
-            table.add_row(stream.id, str(stream.stream_type), "--", "--", str(stream.bandwidth))
+            table.add_row(
+                stream.id,
+                str(stream.stream_type),
+                "--",
+                "--",
+                str(stream.bandwidth),
+                format_size(estimate_size(stream, duration)),
+            )
         elif stream.stream_type == StreamType.SUBTITLES:
-            table.add_row(stream.id, str(stream.stream_type), "--", "--", "--")
+            table.add_row(stream.id, str(stream.stream_type), "--", "--", "--", "--")
         else:
             pass
 
@@ -0,0 +1,358 @@
+"""
+Progress of a batch, for the dashboard and the periodic progress log.
+
+`process_job` reports the stage of each job (resolving, downloading,
+decrypting...) and its estimated size; the bytes written so far are sampled
+from the job's work directory, which covers yt-dlp and native segment
+downloads alike. From these the tracker derives per-job and aggregate rates,
+a batch ETA and the resource most jobs are waiting on.
+"""
+
+import contextvars
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Optional
+
+from diskspace import format_size
+from utils import directory_size
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RESOLVING = "resolving"
+RESERVING = "reserving disk"
+WAITING = "waiting"
+DOWNLOADING = "downloading"
+DECRYPTING = "decrypting"
+MUXING = "muxing"
+DONE = "done"
+FAILED = "failed"
+
+ACTIVE_STAGES = (RESOLVING, RESERVING, WAITING, DOWNLOADING, DECRYPTING, MUXING)
+
+# Resource a job in each stage is bound by
+STAGE_RESOURCES = {
+    RESOLVING: "browser",
+    WAITING: "bandwidth",
+    DOWNLOADING: "bandwidth",
+    RESERVING: "disk",
+    DECRYPTING: "disk",
+    MUXING: "disk",
+}
+
+# Weight of the newest sample in the rate averages
+EWMA_ALPHA: float = 0.3
+
+# Seconds between two progress lines when there is no dashboard
+PROGRESS_LOG_INTERVAL: float = 30.0
+
+
+class JobProgress:
+    def __init__(self, url: str, workdir: Optional[str] = None):
+        self.url: str = url
+        self.workdir: Optional[str] = workdir
+        self.stage: str = QUEUED
+
+        # Estimated size of the download (see stream.estimate_job_size)
+        self.expected_bytes: Optional[int] = None
+        self.bytes: int = 0
+        self.rate: Optional[float] = None
+
+        self.started_at: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.stage in ACTIVE_STAGES
+
+    @property
+    def eta(self) -> Optional[float]:
+        if self.stage != DOWNLOADING or not self.rate or self.expected_bytes is None:
+            return None
+
+        return max(0.0, self.expected_bytes - self.bytes) / self.rate
+
+
+def _ewma(average: Optional[float], sample: float) -> float:
+    return sample if average is None else EWMA_ALPHA * sample + (1 - EWMA_ALPHA) * average
+
+
+class BatchProgress:
+    def __init__(self):
+        # Queued and running jobs; finished ones only count in the totals, so
+        # that a followed input can run forever in bounded memory
+        self.jobs: dict[str, JobProgress] = {}
+
+        # URLs read from the input so far (None before the first), which is
+        # the size of the batch once the input is closed
+        self.total: Optional[int] = None
+        self.input_closed: bool = False
+        self.skipped: int = 0
+
+        self.started_at: float = time.monotonic()
+        self.rate: Optional[float] = None
+
+        # Bytes of the jobs that are no longer sampled
+        self._finished_bytes: int = 0
+
+        # Total size and count of the finished downloads, for the ETA
+        self._done_bytes: int = 0
+        self._done_sized: int = 0
+
+        # Jobs per stage, finished ones included
+        self._stages: dict[str, int] = {}
+
+        self._sampled_at: Optional[float] = None
+        self._sampled_bytes: int = 0
+
+        self._lock = threading.Lock()
+
+    def add(self, key: str, url: str, workdir: Optional[str] = None):
+        with self._lock:
+            previous = self.jobs.get(key)
+            if previous is not None:
+                self._count(previous.stage, -1)
+
+            self.jobs[key] = JobProgress(url, workdir)
+            self._count(QUEUED, 1)
+            self.total = (self.total or 0) + 1
+
+    def _count(self, stage: str, n: int):
+        self._stages[stage] = self._stages.get(stage, 0) + n
+
+        if not self._stages[stage]:
+            del self._stages[stage]
+
+    def skip(self):
+        with self._lock:
+            self.skipped += 1
+            self.total = (self.total or 0) + 1
+
+    def close_input(self):
+        """Every URL of the batch has been read: `total` is final."""
+        with self._lock:
+            self.input_closed = True
+            self.total = self.total or 0
+
+    def stage(self, stage: str, key: Optional[str] = None):
+        """Move the job `key`, or the current job (see `job`), to `stage`."""
+        key = key or _CURRENT.get()
+
+        with self._lock:
+            job = self.jobs.get(key)
+            if job is None:
+                return
+
+            if job.started_at is None and stage in ACTIVE_STAGES:
+                job.started_at = time.monotonic()
+
+            if job.stage == DOWNLOADING and job.workdir is not None:
+                # Last sample of the download, before decryption adds its own files
+                job.bytes = max(job.bytes, _workdir_size(job.workdir))
+
+            self._count(job.stage, -1)
+            self._count(stage, 1)
+            job.stage = stage
+
+            if stage in (DONE, FAILED):
+                del self.jobs[key]
+                self._finished_bytes += job.bytes
+
+                if stage == DONE and job.bytes:
+                    self._done_bytes += job.bytes
+                    self._done_sized += 1
+
+    def expect(self, nbytes: Optional[int], key: Optional[str] = None):
+        key = key or _CURRENT.get()
+
+        with self._lock:
+            if key in self.jobs:
+                self.jobs[key].expected_bytes = nbytes
+
+    @contextmanager
+    def job(self, key: str):
+        """Scope in which `stage` and `expect` apply to the job `key`."""
+        token = _CURRENT.set(key)
+
+        try:
+            yield
+        finally:
+            _CURRENT.reset(token)
+
+    def sample(self):
+        """Update the bytes and rates from the work directories of the running jobs."""
+        now = time.monotonic()
+
+        with self._lock:
+            jobs = [job for job in self.jobs.values() if job.active and job.workdir is not None]
+
+        sizes = [(job, _workdir_size(job.workdir)) for job in jobs]
+
+        with self._lock:
+            elapsed = now - self._sampled_at if self._sampled_at is not None else None
+
+            for job, size in sizes:
+                if elapsed and job.stage == DOWNLOADING:
+                    job.rate = _ewma(job.rate, max(0, size - job.bytes) / elapsed)
+
+                # Decrypting rewrites the streams, only the download counts
+                if job.stage in (RESERVING, DOWNLOADING):
+                    job.bytes = size
+
+            total = self._finished_bytes + sum(
+                job.bytes for job in self.jobs.values() if job.active
+            )
+
+            if elapsed:
+                self.rate = _ewma(self.rate, max(0, total - self._sampled_bytes) / elapsed)
+
+            self._sampled_at = now
+            self._sampled_bytes = total
+
+    def active_jobs(self) -> list[JobProgress]:
+        """Running jobs, oldest first."""
+        with self._lock:
+            jobs = [job for job in self.jobs.values() if job.active]
+
+        return sorted(jobs, key=lambda job: job.started_at or 0)
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._stages)
+
+    def bottleneck(self) -> Optional[str]:
+        """Resource (browser, bandwidth, disk) that holds the most running jobs."""
+        resources = {}
+
+        for stage, count in self.counts().items():
+            if stage in STAGE_RESOURCES:
+                resources[STAGE_RESOURCES[stage]] = resources.get(STAGE_RESOURCES[stage], 0) + count
+
+        if not resources:
+            return None
+
+        return max(resources, key=resources.get)
+
+    @property
+    def bytes(self) -> int:
+        return self._sampled_bytes
+
+    def eta(self) -> Optional[float]:
+        """
+        Seconds until the batch is done: the bytes the running jobs still have to
+        download, plus the queued jobs at the average size of the finished ones,
+        at the current aggregate rate.
+        """
+        with self._lock:
+            active = [job for job in self.jobs.values() if job.active]
+            total, rate = self.total, self.rate
+            input_closed = self.input_closed
+            settled = self._stages.get(DONE, 0) + self._stages.get(FAILED, 0)
+            done_bytes, done_sized = self._done_bytes, self._done_sized
+
+        # Unknown until the whole input has been read
+        if not input_closed or not rate:
+            return None
+
+        queued = max(0, total - self.skipped - settled - len(active))
+
+        if done_sized:
+            average = done_bytes / done_sized
+        else:
+            sizes = [job.expected_bytes for job in active if job.expected_bytes]
+            average = sum(sizes) / len(sizes) if sizes else None
+
+        if queued and average is None:
+            return None
+
+        remaining = sum(
+            max(0, (job.expected_bytes or job.bytes) - job.bytes)
+            for job in active
+            if job.stage in (RESOLVING, WAITING, RESERVING, DOWNLOADING)
+        )
+        remaining += queued * (average or 0)
+
+        return remaining / rate
+
+    def summary(self) -> dict:
+        """Counters of the batch, e.g. for a JSON log line."""
+        counts = self.counts()
+        eta = self.eta()
+
+        return {
+            "total": self.total,
+            "input_closed": self.input_closed,
+            "skipped": self.skipped,
+            "done": counts.get(DONE, 0),
+            "failed": counts.get(FAILED, 0),
+            "active": sum(counts.get(stage, 0) for stage in ACTIVE_STAGES),
+            "stages": {stage: counts[stage] for stage in ACTIVE_STAGES if stage in counts},
+            "bytes": self.bytes,
+            "rate": round(self.rate) if self.rate is not None else None,
+            "eta": round(eta) if eta is not None else None,
+            "bottleneck": self.bottleneck(),
+        }
+
+
+def _workdir_size(workdir: str) -> int:
+    try:
+        return directory_size(workdir)
+    except FileNotFoundError:
+        return 0
+
+
+_CURRENT: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "progress_job", default=None
+)
+
+TRACKER = BatchProgress()
+
+
+def configure() -> BatchProgress:
+    """Start tracking a new batch."""
+    global TRACKER
+    TRACKER = BatchProgress()
+    return TRACKER
+
+
+@contextmanager
+def periodic_log(interval: float = PROGRESS_LOG_INTERVAL):
+    """Log a summary of `TRACKER` every `interval` seconds, for runs without a dashboard."""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            TRACKER.sample()
+            summary = TRACKER.summary()
+            logger.info(
+                f"Batch progress: {summary['done']} done, {summary['failed']} failed, "
+                f"{summary['active']} active, {format_rate(TRACKER.rate)}, "
+                f"ETA {format_duration(summary['eta'])}",
+                extra={"progress": summary},
+            )
+
+    thread = threading.Thread(target=run, name="progress-log", daemon=True)
+    thread.start()
+
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def format_rate(rate: Optional[float]) -> str:
+    return f"{format_size(int(rate))}/s" if rate is not None else "--"
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--"
+
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+    return f"{seconds // 60}m{seconds % 60:02d}s"
@@ -0,0 +1,315 @@
+"""
+Retry policy shared by every network stage.
+
+Failures are classified (timeout, connection, server, throttled, client,
+process, transient, other) and each class has its own rule: how many attempts
+it gets and how long to back off between them. Delays grow exponentially with
+jitter, so that concurrent jobs do not retry in lockstep, and a 429/503
+`Retry-After` is honoured. Every job also has a retry budget: once it is
+spent, the job fails instead of hammering a CDN that is clearly unhappy.
+"""
+
+import contextvars
+import email.utils
+import logging
+import random
+import re
+import subprocess
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+import requests.exceptions
+
+from config import load_file
+
+logger = logging.getLogger(__name__)
+
+ERROR_CLASSES = (
+    "timeout",
+    "connection",
+    "server",
+    "throttled",
+    "client",
+    "process",
+    "transient",
+    "other",
+)
+
+DEFAULT_MAX_ATTEMPTS: int = 4
+DEFAULT_BASE_DELAY: float = 1.0
+DEFAULT_MAX_DELAY: float = 60.0
+DEFAULT_MULTIPLIER: float = 2.0
+DEFAULT_JITTER: float = 0.5
+DEFAULT_RETRY_BUDGET: int = 20
+
+
+class TransientError(Exception):
+    """A failure worth retrying that is not a network error (e.g. nothing captured yet)."""
+
+
+class RetryRule:
+    def __init__(
+        self,
+        retry: bool = True,
+        max_attempts: Optional[int] = None,
+        base_delay: Optional[float] = None,
+        max_delay: Optional[float] = None,
+    ):
+        self.retry: bool = retry
+
+        # None inherits the value of the policy
+        self.max_attempts: Optional[int] = max_attempts
+        self.base_delay: Optional[float] = base_delay
+        self.max_delay: Optional[float] = max_delay
+
+
+DEFAULT_RULES = {
+    "timeout": RetryRule(),
+    "connection": RetryRule(),
+    "server": RetryRule(),
+    "throttled": RetryRule(max_attempts=6, base_delay=5.0),
+    # A 4xx or a bug will not fix itself
+    "client": RetryRule(retry=False),
+    # yt-dlp, ffmpeg... failing without a recognisable HTTP error
+    "process": RetryRule(max_attempts=2),
+    "transient": RetryRule(max_attempts=5, base_delay=2.0),
+    "other": RetryRule(retry=False),
+}
+
+
+class RetryBudget:
+    """Number of retries a job may still spend, shared by all its threads."""
+
+    def __init__(self, limit: int):
+        self.limit: int = limit
+        self.spent: int = 0
+        self._lock = threading.Lock()
+
+    def consume(self) -> bool:
+        with self._lock:
+            if self.spent >= self.limit:
+                return False
+
+            self.spent += 1
+            return True
+
+
+_BUDGET: contextvars.ContextVar[Optional[RetryBudget]] = contextvars.ContextVar(
+    "retry_budget", default=None
+)
+
+
+def status_of(error: BaseException) -> Optional[int]:
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code
+
+    if isinstance(error, subprocess.CalledProcessError):
+        match = re.search(r"HTTP Error (\d{3})", str(error.stderr or ""))
+        return int(match.group(1)) if match is not None else None
+
+    return None
+
+
+def classify(error: BaseException) -> str:
+    if isinstance(error, TransientError):
+        return "transient"
+
+    if isinstance(error, (requests.exceptions.Timeout, subprocess.TimeoutExpired, TimeoutError)):
+        return "timeout"
+
+    if isinstance(error, (requests.exceptions.ConnectionError, ConnectionError)):
+        return "connection"
+
+    status = status_of(error)
+
+    if status is not None:
+        if status == 429:
+            return "throttled"
+        if status == 408:
+            return "timeout"
+        if status >= 500:
+            return "server"
+        return "client"
+
+    if isinstance(error, subprocess.CalledProcessError):
+        return "process"
+
+    if isinstance(error, requests.exceptions.RequestException):
+        return "connection"
+
+    return "other"
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds requested by the server's Retry-After header, if any."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        multiplier: float = DEFAULT_MULTIPLIER,
+        jitter: float = DEFAULT_JITTER,
+        budget: int = DEFAULT_RETRY_BUDGET,
+        rules: Optional[dict[str, dict]] = None,
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter must be between 0 and 1")
+
+        self.max_attempts: int = max_attempts
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.multiplier: float = multiplier
+        self.jitter: float = jitter
+        self.budget: int = budget
+
+        self.rules: dict[str, RetryRule] = {}
+        for name, default in DEFAULT_RULES.items():
+            fields = dict(vars(default))
+            fields.update((rules or {}).get(name, {}))
+            self.rules[name] = RetryRule(**fields)
+
+        unknown = set(rules or {}) - set(ERROR_CLASSES)
+        if unknown:
+            raise ValueError(f"Unknown error classes in retry rules: {', '.join(sorted(unknown))}")
+
+    def attempts_for(self, error_class: str) -> int:
+        rule = self.rules[error_class]
+
+        if not rule.retry:
+            return 1
+
+        return rule.max_attempts if rule.max_attempts is not None else self.max_attempts
+
+    def delay(self, error: BaseException, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying after the `attempt`-th failure, None to give up."""
+        error_class = classify(error)
+        rule = self.rules[error_class]
+
+        base_delay = rule.base_delay if rule.base_delay is not None else self.base_delay
+        max_delay = rule.max_delay if rule.max_delay is not None else self.max_delay
+
+        delay = min(max_delay, base_delay * self.multiplier ** (attempt - 1))
+        delay = random.uniform(delay * (1 - self.jitter), delay)
+
+        requested = retry_after(error) if error_class in ("throttled", "server") else None
+        if requested is not None:
+            if requested > max_delay:
+                # Waiting that long would only hold the job slot
+                logger.warning(f"Server asked to retry in {requested:.0f}s, giving up")
+                return None
+
+            delay = max(delay, requested)
+
+        return delay
+
+    def call(self, fn: Callable, *args, description: Optional[str] = None, **kwargs):
+        """Call `fn`, retrying the failures its error class allows."""
+        description = description or getattr(fn, "__name__", "operation")
+        attempt = 0
+
+        while True:
+            attempt += 1
+
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                error_class = classify(e)
+                attempts = self.attempts_for(error_class)
+
+                if attempt >= attempts:
+                    if attempts > 1:
+                        logger.error(f"{description} failed after {attempt} attempts: {e}")
+                    raise
+
+                delay = self.delay(e, attempt)
+                if delay is None:
+                    raise
+
+                budget = _BUDGET.get()
+                if budget is not None and not budget.consume():
+                    logger.error(f"Retry budget of the job exhausted ({budget.limit} retries)")
+                    raise
+
+                logger.warning(
+                    f"{description} failed ({error_class}: {e}), "
+                    f"retrying in {delay:.1f}s [{attempt}/{attempts - 1}]"
+                )
+                time.sleep(delay)
+
+    @contextmanager
+    def job(self):
+        """
+        Scope of a job: every retry made in it (see `in_job`) spends the same
+        budget. Nested scopes share the budget of the outermost one.
+        """
+        budget = _BUDGET.get()
+        if budget is None:
+            budget = RetryBudget(self.budget)
+
+        token = _BUDGET.set(budget)
+
+        try:
+            yield budget
+        finally:
+            _BUDGET.reset(token)
+
+
+def in_job(fn: Callable) -> Callable:
+    """Wrap `fn` to run in the caller's job, e.g. when it is submitted to an executor."""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+CONFIG_KEYS = {"max_attempts", "base_delay", "max_delay", "multiplier", "jitter", "budget", "rules"}
+
+
+def load_config(path: str) -> dict:
+    """Read a retry policy from a JSON or TOML file."""
+    if path is None:
+        raise ValueError("path cannot be None")
+
+    config = load_file(path)
+
+    unknown = set(config) - CONFIG_KEYS
+    if unknown:
+        raise ValueError(f"Unknown retry settings in {path}: {', '.join(sorted(unknown))}")
+
+    return config
+
+
+POLICY = RetryPolicy()
+
+
+def configure(**kwargs) -> RetryPolicy:
+    """Replace the process-wide retry policy."""
+    global POLICY
+    POLICY = RetryPolicy(**kwargs)
+    return POLICY
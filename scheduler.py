@@ -0,0 +1,244 @@
+"""
+Priority and fair-share scheduling of batch jobs.
+
+`download_by_file` feeds the jobs of its input into a Scheduler, and every
+worker of the pool asks it for the next one to run, instead of taking them
+in file order. A job is chosen, among those whose host is not at its job cap:
+
+1. urgent first: jobs whose deadline is less than URGENT_WINDOW away, the
+   earliest deadline first
+2. by priority, highest first, then by deadline
+3. fairly: from the source (input file or `source=` option), then the
+   host, with the fewest running jobs, the least recently served source
+   winning ties
+4. in input order
+
+Running jobs are never preempted: urgent work takes the next free worker,
+and bulk work keeps every other worker busy. The host of a job is the one of
+its manifest, where the video is downloaded from: the pages of a batch are
+usually all on the same site. A new job only learns it once its page is
+resolved, so it is handed out regardless of the cap and `admit` holds it
+back, after the resolution, while its host is full; jobs whose manifest a
+previous run resolved are capped before they start. The governor still
+bounds the connections to each host.
+
+Pending jobs are kept in heaps per (source, host), in priority order, and
+those with a deadline in heaps per host, earliest first, so choosing a job
+only looks at the top of each heap rather than at the whole window.
+"""
+
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+
+from typing import Optional
+
+import governor
+from defaults import DEFAULT_SCHEDULE_WINDOW
+from intake import Request
+from jobdb import Job
+
+logger = logging.getLogger(__name__)
+
+# Seconds before its deadline from which a job goes before every other one
+URGENT_WINDOW: float = 15 * 60
+
+
+class Entry:
+    def __init__(self, job: Job, request: Request, sequence: int):
+        self.job: Job = job
+        self.request: Request = request
+        self.sequence: int = sequence
+
+        # Host of the manifest, None until the page is resolved
+        self.host: Optional[str] = governor.host_of(job.manifest_url) if job.manifest_url else None
+
+        # Handed out: still in a heap until it reaches its top
+        self.taken: bool = False
+
+    @property
+    def source(self) -> str:
+        return self.request.source
+
+    @property
+    def deadline(self) -> float:
+        return self.request.deadline if self.request.deadline is not None else math.inf
+
+    def urgent(self, now: float) -> bool:
+        deadline = self.request.deadline
+        return deadline is not None and deadline - now <= URGENT_WINDOW
+
+
+class Scheduler:
+    def __init__(self, host_limit: Optional[int] = None, window: int = DEFAULT_SCHEDULE_WINDOW):
+        if host_limit is not None and host_limit < 1:
+            raise ValueError("host_limit must be at least 1")
+
+        if window < 1:
+            raise ValueError("window must be at least 1")
+
+        # Concurrent jobs per manifest host, None for no limit but the pool size
+        self.host_limit: Optional[int] = host_limit
+
+        # Jobs read ahead of the workers: an urgent job further down the input
+        # is only seen once the jobs before it fit in the window
+        self.window: int = window
+
+        # (-priority, deadline, sequence, entry) per (source, host), and
+        # (deadline, -priority, sequence, entry) of the jobs with a deadline per host
+        self._queues: dict[tuple[str, Optional[str]], list[tuple]] = {}
+        self._deadlines: dict[Optional[str], list[tuple]] = {}
+        self._pending: int = 0
+
+        self._running_sources: dict[str, int] = {}
+        self._running_hosts: dict[str, int] = {}
+        self._served: dict[str, float] = {}
+        self._sequence = itertools.count()
+        self._closed: bool = False
+        self._cond = threading.Condition()
+
+    def put(self, job: Job, request: Request):
+        """Add a job, blocking while the window is full."""
+        with self._cond:
+            while self._pending >= self.window:
+                self._cond.wait()
+
+            entry = Entry(job, request, next(self._sequence))
+            priority = -request.priority
+
+            heapq.heappush(
+                self._queues.setdefault((entry.source, entry.host), []),
+                (priority, entry.deadline, entry.sequence, entry),
+            )
+
+            if request.deadline is not None:
+                heapq.heappush(
+                    self._deadlines.setdefault(entry.host, []),
+                    (entry.deadline, priority, entry.sequence, entry),
+                )
+
+            self._pending += 1
+            self._cond.notify_all()
+
+    def close(self):
+        """No more jobs will be added; `get` returns None once the pending ones ran."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def get(self) -> Optional[Entry]:
+        """The next job to run, waiting for one to be eligible, or None when all ran."""
+        with self._cond:
+            while True:
+                entry = self._next(time.time())
+
+                if entry is not None:
+                    break
+
+                if self._closed and not self._pending:
+                    return None
+
+                self._cond.wait()
+
+            entry.taken = True
+            self._pending -= 1
+            self._running_sources[entry.source] = self._running_sources.get(entry.source, 0) + 1
+
+            if entry.host is not None:
+                self._running_hosts[entry.host] = self._running_hosts.get(entry.host, 0) + 1
+
+            self._served[entry.source] = time.monotonic()
+            self._cond.notify_all()
+
+        deadline = entry.request.deadline
+        if deadline is not None and deadline < time.time():
+            logger.warning(
+                f"Starting {entry.job.url} {time.time() - deadline:.0f}s after its deadline"
+            )
+
+        return entry
+
+    def admit(self, entry: Entry, manifest_url: str):
+        """
+        Count a job whose page was just resolved on the host of `manifest_url`,
+        waiting while that host is at its cap.
+        """
+        if entry.host is not None:
+            return
+
+        host = governor.host_of(manifest_url)
+
+        with self._cond:
+            while not self._eligible(host):
+                self._cond.wait()
+
+            entry.host = host
+            self._running_hosts[host] = self._running_hosts.get(host, 0) + 1
+
+    def done(self, entry: Entry):
+        with self._cond:
+            self._running_sources[entry.source] -= 1
+
+            if entry.host is not None:
+                self._running_hosts[entry.host] -= 1
+
+            self._cond.notify_all()
+
+    def _eligible(self, host: Optional[str]) -> bool:
+        return (
+            host is None
+            or self.host_limit is None
+            or self._running_hosts.get(host, 0) < self.host_limit
+        )
+
+    @staticmethod
+    def _top(heaps: dict, key) -> Optional[Entry]:
+        """First entry of `heaps[key]` still pending, dropping the heap once empty."""
+        heap = heaps[key]
+
+        while heap and heap[0][-1].taken:
+            heapq.heappop(heap)
+
+        if not heap:
+            del heaps[key]
+            return None
+
+        return heap[0][-1]
+
+    def _next(self, now: float) -> Optional[Entry]:
+        urgent = [
+            entry
+            for host in list(self._deadlines)
+            if self._eligible(host)
+            and (entry := self._top(self._deadlines, host)) is not None
+            and entry.urgent(now)
+        ]
+
+        if urgent:
+            return min(urgent, key=lambda entry: (entry.deadline, -entry.request.priority))
+
+        # Entries of a heap only differ in priority, deadline and input
+        # order, so the best of each heap is its top
+        eligible = [
+            entry
+            for key in list(self._queues)
+            if self._eligible(key[1]) and (entry := self._top(self._queues, key)) is not None
+        ]
+
+        if not eligible:
+            return None
+
+        return min(eligible, key=self._rank)
+
+    def _rank(self, entry: Entry) -> tuple:
+        return (
+            -entry.request.priority,
+            entry.deadline,
+            self._running_sources.get(entry.source, 0),
+            self._running_hosts.get(entry.host, 0),
+            self._served.get(entry.source, 0),
+            entry.sequence,
+        )
@@ -0,0 +1,199 @@
+"""
+Compare the MPD parsers of mpdparse: parse time, peak memory and catalog.
+
+Each parser runs in its own process, and its peak memory is the growth of
+the process's maximum resident set size while parsing, so that the memory
+libxml2 allocates outside the Python heap is counted too.
+
+    python scripts/bench_mpd.py                  # synthetic 6 hour manifest
+    python scripts/bench_mpd.py --hours 12
+    python scripts/bench_mpd.py manifest.mpd     # a saved manifest
+
+Segments of the synthetic manifest are written without `r` repeats, as the
+timelines of live-to-VOD events often are, so every segment is an `S` node.
+"""
+
+import argparse
+import os
+import pickle
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mpdparse  # noqa: E402
+from segments import media_segments  # noqa: E402
+
+SEGMENT_SECONDS = 2
+TIMESCALE = 90000
+
+VIDEO_RENDITIONS = [(640, 360, 800000), (1280, 720, 2500000), (1920, 1080, 5000000)]
+AUDIO_RENDITIONS = [("por", 96000), ("eng", 128000)]
+
+PARSERS = {
+    "mpegdash": mpdparse.parse_catalog_mpegdash,
+    "lxml": mpdparse.parse_catalog,
+}
+
+
+def synthetic_manifest(hours: float) -> bytes:
+    count = int(hours * 3600 / SEGMENT_SECONDS)
+    d = SEGMENT_SECONDS * TIMESCALE
+
+    # Slightly irregular durations, as encoders produce
+    timeline = "".join(
+        f'<S t="{i * d}" d="{d + (i % 3) - 1}"/>' if i == 0 else f'<S d="{d + (i % 3) - 1}"/>'
+        for i in range(count)
+    )
+    template = (
+        f'<SegmentTemplate timescale="{TIMESCALE}" initialization="$RepresentationID$/init.mp4" '
+        f'media="$RepresentationID$/$Time$.m4s" startNumber="1">'
+        f"<SegmentTimeline>{timeline}</SegmentTimeline></SegmentTemplate>"
+    )
+    protection = (
+        '<ContentProtection schemeIdUri="urn:mpeg:dash:mp4protection:2011" value="cenc" '
+        'cenc:default_KID="00000000-0000-0000-0000-000000000001"/>'
+        '<ContentProtection schemeIdUri="urn:uuid:edef8ba9-79d6-4ace-a3c8-27dcd51d21ed">'
+        "<cenc:pssh>AAAAW3Bzc2gAAAAA7e+LqXnWSs6jyCfc1R0h7QAAADsIARIQ</cenc:pssh>"
+        "</ContentProtection>"
+    )
+
+    video = "".join(
+        f'<Representation id="video={bandwidth}" bandwidth="{bandwidth}" width="{width}" '
+        f'height="{height}" frameRate="25" codecs="avc1.64001f">{protection}</Representation>'
+        for width, height, bandwidth in VIDEO_RENDITIONS
+    )
+    audio = "".join(
+        f'<AdaptationSet contentType="audio" mimeType="audio/mp4" lang="{lang}">{template}'
+        f'<Representation id="audio_{lang}={bandwidth}" bandwidth="{bandwidth}" '
+        f'codecs="mp4a.40.2">{protection}</Representation></AdaptationSet>'
+        for lang, bandwidth in AUDIO_RENDITIONS
+    )
+
+    seconds = int(hours * 3600)
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" xmlns:cenc="urn:mpeg:cenc:2013" '
+        f'type="static" mediaPresentationDuration="PT{seconds}S">'
+        '<Period id="1"><BaseURL>https://example.com/event/</BaseURL>'
+        f'<AdaptationSet contentType="video" mimeType="video/mp4">{template}{video}'
+        f"</AdaptationSet>{audio}</Period></MPD>"
+    ).encode("utf-8")
+
+
+def max_rss() -> int:
+    """Maximum resident set size of this process so far, in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run_parser(name: str, path: str):
+    """Child process: parse `path` and write (time, peak memory, description) to stdout."""
+    with open(path, "rb") as f:
+        source = f.read()
+
+    before = max_rss()
+    start = time.perf_counter()
+
+    catalog = PARSERS[name](source)
+
+    elapsed = time.perf_counter() - start
+    peak = max_rss() - before
+
+    pickle.dump((elapsed, peak, describe(catalog)), sys.stdout.buffer)
+
+
+def measure(name: str, path: str):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--parser", name, path],
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+
+    return pickle.loads(result.stdout)
+
+
+def describe(catalog: mpdparse.Catalog) -> list:
+    """Everything the download path reads from a catalog, as plain values."""
+    description = [catalog.duration, catalog.dynamic, catalog.update_period]
+
+    for s in catalog.streams:
+        protections = [
+            (p.scheme_id_uri, p.value, [x.pssh for x in p.pssh or []])
+            for p in s.content_protections or []
+        ]
+        segments = None
+
+        if s.segments is not None:
+            info = s.segments
+            expanded = media_segments(info, s.id, s.bandwidth, "https://example.com/event.mpd")
+            segments = (
+                info.base_url,
+                info.media,
+                info.initialization,
+                info.timescale,
+                info.start_number,
+                info.duration,
+                len(expanded),
+                [(x.url, x.number, x.time) for x in expanded[:3] + expanded[-3:]],
+            )
+
+        description.append(
+            (
+                s.id,
+                s.stream_type,
+                s.bandwidth,
+                s.width,
+                s.height,
+                s.fps,
+                s.subtitle_urls,
+                s.language,
+                s.codecs,
+                protections,
+                segments,
+            )
+        )
+
+    return description
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MPD parsers")
+    parser.add_argument("manifest", nargs="?", help="MPD file (default: a synthetic manifest)")
+    parser.add_argument("--hours", type=float, default=6, help="Length of the synthetic manifest")
+    parser.add_argument("--parser", choices=PARSERS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.parser is not None:
+        run_parser(args.parser, args.manifest)
+        return
+
+    if args.manifest is not None:
+        source = mpdparse.fetch_manifest(args.manifest)
+    else:
+        source = synthetic_manifest(args.hours)
+
+    print(f"Manifest: {len(source) / 1e6:.1f} MB")
+
+    descriptions = {}
+
+    with tempfile.NamedTemporaryFile(suffix=".mpd") as f:
+        f.write(source)
+        f.flush()
+
+        for name in PARSERS:
+            elapsed, peak, descriptions[name] = measure(name, f.name)
+            print(f"{name:>9}: {elapsed:7.2f} s  peak {peak / 1e6:8.1f} MB")
+
+    same = descriptions["mpegdash"] == descriptions["lxml"]
+    print(f"Same catalog: {'yes' if same else 'NO'}")
+
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
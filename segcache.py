@@ -0,0 +1,299 @@
+"""
+Content cache shared by all download paths.
+
+Files are stored under a digest of their cache key, which is the URL without
+volatile query parameters (tokens, expiry times, signatures) or an explicit
+key. Identical init and media segments requested by different jobs, qualities
+or page URLs are therefore fetched once. Hits are hard-linked (or copied,
+across devices) to their destination, and the least recently used entries are
+evicted once the cache grows past its size limit.
+"""
+
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Executor
+from typing import Callable, Iterable, Iterator, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from config import Settings
+from defaults import DEFAULT_CACHE_SIZE
+from utils import download_file
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that change between sessions without changing the content,
+# on any host
+VOLATILE_PARAMS = {
+    "token",
+    "tok",
+    "auth",
+    "hdnts",
+    "hdnea",
+    "exp",
+    "expires",
+    "signature",
+    "sig",
+    "policy",
+    "key-pair-id",
+    "session",
+    "sessionid",
+}
+
+# Short, generic names (`e`, `st`...) are only dropped on the hosts (and their
+# subdomains) whose CDN is known to use them for tokens: elsewhere they may
+# select distinct content
+HOST_VOLATILE_PARAMS: dict[str, set[str]] = {}
+
+# Segments fetched ahead of the one being appended, per connection: enough to
+# keep the connections busy without evicting segments before they are used
+FETCH_AHEAD: int = 4
+
+# Seconds a writer waits for another job or process holding the index lock
+LOCK_TIMEOUT: float = 60
+
+# Stores between two recounts of the total size from the index, which other
+# processes sharing the cache also update
+RECOUNT_INTERVAL: int = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    digest TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+)
+"""
+
+
+def volatile_params(host: str) -> set[str]:
+    host = host.lower().split(":")[0]
+    params = VOLATILE_PARAMS
+
+    for suffix, names in HOST_VOLATILE_PARAMS.items():
+        if host == suffix or host.endswith("." + suffix):
+            params = params | names
+
+    return params
+
+
+def cache_key(url: str) -> str:
+    parts = urlsplit(url)
+    volatile = volatile_params(parts.netloc)
+    query = sorted(
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name.lower() not in volatile
+    )
+
+    return urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), "")
+    )
+
+
+class SegmentCache:
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = DEFAULT_CACHE_SIZE,
+        settings: Optional[Settings] = None,
+    ):
+        if directory is None:
+            raise ValueError("directory cannot be None")
+
+        self.directory: str = directory
+        self.max_bytes: int = max_bytes
+        self.settings: Settings = settings if settings is not None else Settings()
+        self.hits: int = 0
+        self.misses: int = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(directory, "index.sqlite3"),
+            timeout=LOCK_TIMEOUT,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(SCHEMA)
+
+        self._total: int = self._count()
+        self._stores: int = 0
+
+        logger.info(f"Using segment cache {directory} (limit {max_bytes} bytes)")
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Path of the cached file for `key`, or None on a miss."""
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        path = self._path(digest)
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size FROM entries WHERE digest = ?", (digest,)
+            ).fetchone()
+
+            if row is None or not os.path.exists(path):
+                if row is not None:
+                    self._conn.execute("DELETE FROM entries WHERE digest = ?", (digest,))
+                return None
+
+            self._conn.execute(
+                "UPDATE entries SET last_access = ? WHERE digest = ?", (time.time(), digest)
+            )
+
+        return path
+
+    def store(self, key: str, source: str) -> str:
+        """Move `source` into the cache under `key` and return its cached path."""
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        path = self._path(digest)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source, path)
+
+        size = os.path.getsize(path)
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size FROM entries WHERE digest = ?", (digest,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (digest, key, size, last_access) VALUES (?, ?, ?, ?)",
+                (digest, key, size, time.time()),
+            )
+
+            self._stores += 1
+            if self._stores % RECOUNT_INTERVAL == 0:
+                self._total = self._count()
+            else:
+                self._total += size - (row[0] if row is not None else 0)
+
+            over = self._total > self.max_bytes
+
+        if over:
+            self.evict()
+
+        return path
+
+    def fetch(self, url: str, key: Optional[str] = None) -> Optional[str]:
+        """Path of the cached copy of `url`, downloading it on a miss."""
+        if key is None:
+            key = cache_key(url)
+
+        path = self.lookup(key)
+
+        with self._lock:
+            if path is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if path is not None:
+            return path
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        os.close(fd)
+
+        try:
+            if not download_file(url, tmp, self.settings):
+                return None
+
+            return self.store(key, tmp)
+        finally:
+            # Left behind when the download or the store failed
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def fetch_to(self, url: str, output_path: str, key: Optional[str] = None) -> bool:
+        """Materialise `url` at `output_path`, hard-linking the cached copy when possible."""
+        path = self.fetch(url, key)
+
+        if path is None:
+            return False
+
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+        try:
+            os.link(path, output_path)
+        except OSError:
+            shutil.copyfile(path, output_path)
+
+        return True
+
+    def evict(self):
+        with self._lock:
+            total = self._count()
+
+            if total <= self.max_bytes:
+                self._total = total
+                return
+
+            rows = self._conn.execute(
+                "SELECT digest, size FROM entries ORDER BY last_access"
+            ).fetchall()
+
+            for digest, size in rows:
+                if total <= self.max_bytes:
+                    break
+
+                try:
+                    os.remove(self._path(digest))
+                except FileNotFoundError:
+                    pass
+
+                self._conn.execute("DELETE FROM entries WHERE digest = ?", (digest,))
+                total -= size
+
+            self._total = total
+
+        logger.info(f"Evicted segment cache down to {total} bytes")
+
+
+def fetch_ahead(
+    executor: Executor, fetch: Callable[[str], Optional[str]], urls: Iterable[str], ahead: int
+) -> Iterator[Optional[str]]:
+    """
+    Results of `fetch` over `urls` in order, like `executor.map`, but running
+    at most `ahead` fetches past the result being consumed.
+    """
+    urls = iter(urls)
+    futures = deque(executor.submit(fetch, url) for url in itertools.islice(urls, ahead))
+
+    for url in urls:
+        future = futures.popleft()
+        futures.append(executor.submit(fetch, url))
+        yield future.result()
+
+    while futures:
+        yield futures.popleft().result()
+
+
+CACHE: Optional[SegmentCache] = None
+
+
+def configure(
+    directory: Optional[str],
+    max_bytes: int = DEFAULT_CACHE_SIZE,
+    settings: Optional[Settings] = None,
+):
+    """Enable (or, with no directory, disable) the process-wide cache."""
+    global CACHE
+    CACHE = SegmentCache(directory, max_bytes, settings) if directory is not None else None
+    return CACHE
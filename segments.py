@@ -0,0 +1,204 @@
+"""
+SegmentTemplate expansion for DASH representations.
+
+Resolves the template that applies to a representation (SegmentTemplate and
+BaseURL are inherited from the AdaptationSet, Period and MPD) and expands it
+into the list of initialization and media segment URLs, for both
+`$Number$`-based templates and SegmentTimeline (`$Time$`) templates.
+"""
+
+import logging
+import math
+import re
+
+from collections import namedtuple
+from typing import Optional
+from urllib.parse import urljoin
+
+logger = logging.getLogger(__name__)
+
+Segment = namedtuple("Segment", ["url", "number", "time"])
+
+TEMPLATE_IDENTIFIER = re.compile(r"\$(RepresentationID|Number|Time|Bandwidth)(?:%0(\d+)d)?\$")
+
+
+class SegmentInfo:
+    def __init__(
+        self,
+        base_url: str,
+        media: Optional[str],
+        initialization: Optional[str],
+        timescale: int = 1,
+        start_number: int = 1,
+        duration: Optional[int] = None,
+        timeline: Optional[list[tuple[Optional[int], int, int]]] = None,
+        presentation_duration: Optional[float] = None,
+    ):
+        # Relative to the manifest URL unless absolute
+        self.base_url: str = base_url
+
+        self.media: Optional[str] = media
+        self.initialization: Optional[str] = initialization
+
+        self.timescale: int = timescale
+        self.start_number: int = start_number
+
+        # Fixed segment duration (in timescale units) for $Number$ templates
+        self.duration: Optional[int] = duration
+
+        # (t, d, r) entries of the SegmentTimeline, t is None when implicit
+        self.timeline: Optional[list[tuple[Optional[int], int, int]]] = timeline
+
+        # Length of the period in seconds, needed to expand open-ended templates
+        self.presentation_duration: Optional[float] = presentation_duration
+
+
+def _first(nodes):
+    return nodes[0] if nodes else None
+
+
+def _inherited(attribute: str, *nodes):
+    for node in nodes:
+        value = getattr(node, attribute, None) if node is not None else None
+        if value is not None:
+            return value
+
+    return None
+
+
+def segment_info(
+    manifest, period, adaptation, representation, presentation_duration: Optional[float] = None
+) -> Optional[SegmentInfo]:
+    """Build the SegmentInfo of a representation, or None if it has no SegmentTemplate."""
+    # Most specific first
+    templates = [
+        _first(node.segment_templates)
+        for node in (representation, adaptation, period)
+        if node is not None
+    ]
+    templates = [t for t in templates if t is not None]
+
+    if not templates:
+        return None
+
+    base_url = ""
+    for node in (manifest, period, adaptation, representation):
+        url = _first(getattr(node, "base_urls", None)) if node is not None else None
+        if url is not None and url.base_url_value:
+            base_url = urljoin(base_url, url.base_url_value.strip())
+
+    timeline = None
+    segment_timeline = _first(_inherited("segment_timelines", *templates))
+    if segment_timeline is not None:
+        timeline = [(s.t, s.d, s.r or 0) for s in segment_timeline.Ss or []]
+
+    return SegmentInfo(
+        base_url,
+        _inherited("media", *templates),
+        _inherited("initialization", *templates),
+        _inherited("timescale", *templates) or 1,
+        _inherited("start_number", *templates) or 1,
+        _inherited("duration", *templates),
+        timeline,
+        presentation_duration,
+    )
+
+
+def fill_template(
+    template: str,
+    representation_id: str,
+    bandwidth: Optional[int],
+    number: Optional[int] = None,
+    time: Optional[int] = None,
+) -> str:
+    values = {
+        "RepresentationID": representation_id,
+        "Bandwidth": bandwidth,
+        "Number": number,
+        "Time": time,
+    }
+
+    def replace(match: re.Match) -> str:
+        name, width = match.group(1), match.group(2)
+        value = values[name]
+
+        if value is None:
+            raise ValueError(f"No value for ${name}$ in segment template {template}")
+
+        return str(value).zfill(int(width)) if width else str(value)
+
+    return TEMPLATE_IDENTIFIER.sub(replace, template).replace("$$", "$")
+
+
+def timeline_entries(info: SegmentInfo) -> list[tuple[int, int]]:
+    """(time, duration) of every media segment of the timeline."""
+    entries: list[tuple[int, int]] = []
+    end = (
+        int(info.presentation_duration * info.timescale)
+        if info.presentation_duration is not None
+        else None
+    )
+
+    t = 0
+    for index, (start, d, r) in enumerate(info.timeline or []):
+        if start is not None:
+            t = start
+
+        if r < 0:
+            # Repeat until the next entry, or the end of the period
+            following = info.timeline[index + 1][0] if index + 1 < len(info.timeline) else None
+            limit = following if following is not None else end
+
+            if limit is None:
+                logger.warning("Open-ended SegmentTimeline without a known duration")
+                r = 0
+            else:
+                r = max(0, math.ceil((limit - t) / d) - 1)
+
+        for _ in range(r + 1):
+            entries.append((t, d))
+            t += d
+
+    return entries
+
+
+def initialization_url(
+    info: SegmentInfo, representation_id: str, bandwidth: Optional[int], manifest_url: str
+) -> Optional[str]:
+    if info.initialization is None:
+        return None
+
+    relative = fill_template(info.initialization, representation_id, bandwidth)
+    return urljoin(urljoin(manifest_url, info.base_url), relative)
+
+
+def media_segments(
+    info: SegmentInfo, representation_id: str, bandwidth: Optional[int], manifest_url: str
+) -> list[Segment]:
+    if info.media is None:
+        return []
+
+    base = urljoin(manifest_url, info.base_url)
+    segments: list[Segment] = []
+
+    if info.timeline is not None:
+        for i, (t, _) in enumerate(timeline_entries(info)):
+            number = info.start_number + i
+            relative = fill_template(info.media, representation_id, bandwidth, number, t)
+            segments.append(Segment(urljoin(base, relative), number, t))
+
+        return segments
+
+    if info.duration is None or info.presentation_duration is None:
+        logger.warning(f"Cannot expand segments of {representation_id}: unknown duration")
+        return []
+
+    count = math.ceil(info.presentation_duration * info.timescale / info.duration)
+
+    for i in range(count):
+        number = info.start_number + i
+        t = i * info.duration
+        relative = fill_template(info.media, representation_id, bandwidth, number, t)
+        segments.append(Segment(urljoin(base, relative), number, t))
+
+    return segments
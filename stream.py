@@ -7,11 +7,14 @@ import shutil
 import sys
 import subprocess
 import os
+import re
 import logging
 
 from enum import Enum, auto
 from typing import Optional
 
+from config import Settings
+from errors import DecryptionError, ManifestError, MergeError, MissingDependencyError
 from defaults import (
     DEFAULT_ENCRYPTED_VIDEO_FILENAME,
     DEFAULT_ENCRYPTED_AUDIO_FILENAME,
@@ -21,6 +24,8 @@ from defaults import (
 )
 
 from extractor import DecryptionKeys
+from segments import SegmentInfo, segment_info
+from subtitles import SubtitleTrack
 
 try:
     from mpegdash.nodes import AdaptationSet, Representation
@@ -28,12 +33,6 @@ except ImportError:
     sys.stderr.write("Error: mpegdash module not found. Install it with: pip install mpegdash\n")
     sys.exit(1)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] [%(module)s.%(funcName)s:%(lineno)d] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
-
 logger = logging.getLogger(__name__)
 
 
@@ -64,6 +63,9 @@ class Stream:
         fps: Optional[int],
         subtitle_urls: list[str],
         content_protections,
+        segments: Optional[SegmentInfo] = None,
+        language: Optional[str] = None,
+        codecs: Optional[str] = None,
     ):
         # TODO: Perform some sanity checks
         self.id: str = stream_id
@@ -83,16 +85,27 @@ class Stream:
         # for finding pssh
         self.content_protections = content_protections
 
+        # for fetching the segments without yt-dlp
+        self.segments: Optional[SegmentInfo] = segments
+
+        self.language: Optional[str] = language
+        self.codecs: Optional[str] = codecs
+
     @staticmethod
-    def from_representation(r: Representation, stream_type: StreamType):
+    def from_representation(
+        r: Representation,
+        stream_type: StreamType,
+        segments: Optional[SegmentInfo] = None,
+        adaptation: Optional[AdaptationSet] = None,
+    ):
         if r is None:
             raise ValueError("")
 
         if not isinstance(r, Representation):
-            logger.fatal(f"Invalid type for r: Expected Representation, got {type(r).__name__}")
+            raise TypeError(f"Invalid type for r: Expected Representation, got {type(r).__name__}")
 
         subtitle_urls = (
-            [url.base_url_value for url in r.base_urls]
+            [url.base_url_value for url in r.base_urls or []]
             if stream_type == StreamType.SUBTITLES
             else []
         )
@@ -106,6 +119,9 @@ class Stream:
             r.frame_rate,
             subtitle_urls,
             r.content_protections,
+            segments,
+            adaptation.lang if adaptation is not None else None,
+            r.codecs or (adaptation.codecs if adaptation is not None else None),
         )
         return instance
 
@@ -118,43 +134,49 @@ def get_stream_by_id(stream_id: str, streams: list[Stream]) -> Optional[Stream]:
         raise ValueError("streams cannot be None")
 
     if not isinstance(stream_id, str):
-        logger.fatal(f"Invalid type for stream_id: Expected str, got {type(stream_id).__name__}")
+        raise TypeError(f"Invalid type for stream_id: Expected str, got {type(stream_id).__name__}")
 
     if not isinstance(streams, list):
-        logger.fatal(f"Invalid type for streams: Expected list, got {type(streams).__name__}")
+        raise TypeError(f"Invalid type for streams: Expected list, got {type(streams).__name__}")
 
     if not all(isinstance(x, Stream) for x in streams):
-        logger.fatal("all items in streams list must be Stream instances")
+        raise TypeError("all items in streams list must be Stream instances")
 
     logger.info(f"Searching for stream with id: {stream_id}")
     logger.info(f'Existing streams: {",".join(s.id for s in streams)}')
 
-    return next((stream for stream in streams if stream.id == id), None)
+    return next((stream for stream in streams if stream.id == stream_id), None)
 
 
 def get_streams(manifest) -> list[Stream]:
     if len(manifest.periods) != 1:
-        sys.stderr.write("Not implemented for len(periods) != 1")
-        sys.exit(1)
+        raise ManifestError(
+            f"Manifests with {len(manifest.periods)} periods are not supported, only one"
+        )
 
     period = manifest.periods[0]
+    duration = get_duration(manifest)
+
+    def from_representation(adaptation: AdaptationSet, r: Representation, stream_type):
+        info = segment_info(manifest, period, adaptation, r, duration)
+        return Stream.from_representation(r, stream_type, info, adaptation)
 
     audio_streams: list[Stream] = [
-        Stream.from_representation(s, StreamType.AUDIO)
+        from_representation(adaptation, s, StreamType.AUDIO)
         for adaptation in period.adaptation_sets
         if is_audio_adaptation(adaptation)
         for s in adaptation.representations
     ]
 
     subtitle_streams: list[Stream] = [
-        Stream.from_representation(s, StreamType.SUBTITLES)
+        from_representation(adaptation, s, StreamType.SUBTITLES)
         for adaptation in period.adaptation_sets
         if is_subtitle_adaptation(adaptation)
         for s in adaptation.representations
     ]
 
     video_streams: list[Stream] = [
-        Stream.from_representation(s, StreamType.VIDEO)
+        from_representation(adaptation, s, StreamType.VIDEO)
         for adaptation in period.adaptation_sets
         if is_video_adaptation(adaptation)
         for s in adaptation.representations
@@ -171,6 +193,57 @@ def get_streams(manifest) -> list[Stream]:
     return video_streams + audio_streams + subtitle_streams
 
 
+# Peak disk usage of a job relative to the size of the chosen streams: the
+# encrypted download, the decrypted copy and the merged output
+PEAK_SIZE_FACTOR: int = 3
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse an xs:duration such as PT1H2M3.5S into seconds."""
+    if not value:
+        return None
+
+    match = re.fullmatch(
+        r"P(?:(\d+(?:\.\d+)?)D)?(?:T(?:(\d+(?:\.\d+)?)H)?(?:(\d+(?:\.\d+)?)M)?(?:(\d+(?:\.\d+)?)S)?)?",
+        value.strip(),
+    )
+
+    if match is None:
+        logger.warning(f"Unsupported duration: {value}")
+        return None
+
+    days, hours, minutes, seconds = (float(g) if g else 0.0 for g in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def get_duration(manifest) -> Optional[float]:
+    """Duration of the presentation in seconds, if the manifest states it."""
+    duration = parse_duration(manifest.media_presentation_duration)
+
+    if duration is None and manifest.periods:
+        duration = parse_duration(manifest.periods[0].duration)
+
+    return duration
+
+
+def estimate_size(stream: Stream, duration: Optional[float]) -> Optional[int]:
+    """Estimated size in bytes of a stream, from its declared bandwidth (bits/s)."""
+    if duration is None or not stream.bandwidth:
+        return None
+
+    return int(stream.bandwidth * duration / 8)
+
+
+def estimate_job_size(video: Stream, audio: Stream, duration: Optional[float]) -> Optional[int]:
+    """Estimated peak disk usage of downloading, decrypting and merging two streams."""
+    sizes = [estimate_size(video, duration), estimate_size(audio, duration)]
+
+    if any(size is None for size in sizes):
+        return None
+
+    return PEAK_SIZE_FACTOR * sum(sizes)
+
+
 def is_audio_codec(name: str) -> bool:
     return name.startswith(
         (
@@ -199,7 +272,8 @@ def is_audio_stream(s: Representation):
     if not s:
         raise ValueError()
 
-    if not isinstance(s, Representation):
+    # mpegdash Representations, or the lighter nodes of mpdparse
+    if not hasattr(s, "mime_type"):
         logger.warning(f"Invalid type: Expected Representation, got {type(s).__name__}")
 
     return s.mime_type and s.mime_type.startswith("audio/")
@@ -312,14 +386,14 @@ def get_pssh(stream: Stream) -> str:
     pssh_list = [p for p in stream.content_protections if p.pssh is not None]
 
     if len(pssh_list) != 1:
-        logger.fatal("Not implemented for len(pssh_list) != 1")
-        sys.exit(1)
+        raise ManifestError(
+            f"Stream {stream.id} has {len(pssh_list)} content protections with a PSSH, expected one"
+        )
 
     pssh = pssh_list[0].pssh
 
     if len(pssh) != 1:
-        logger.fatal("Not implemented for len(pssh) != 1")
-        sys.exit(1)
+        raise ManifestError(f"Stream {stream.id} has {len(pssh)} PSSH boxes, expected one")
 
     p = pssh[0].pssh
 
@@ -327,68 +401,213 @@ def get_pssh(stream: Stream) -> str:
     return p
 
 
-def fix_audio(decryption_keys: list[DecryptionKeys]):
-    if shutil.which("mp4decrypt") is None:
-        logger.fatal("mp4decrypt is not installed or not found in PATH")
-        sys.exit(1)
+def fix_audio(
+    decryption_keys: list[DecryptionKeys],
+    workdir: str = ".",
+    settings: Optional[Settings] = None,
+):
+    if settings is None:
+        settings = Settings()
+
+    if shutil.which(settings.mp4decrypt) is None:
+        raise MissingDependencyError(settings.mp4decrypt)
+
+    encrypted_audio = os.path.join(workdir, DEFAULT_ENCRYPTED_AUDIO_FILENAME)
+    decrypted_audio = os.path.join(workdir, DEFAULT_DECRYPTED_AUDIO_FILENAME)
 
-    if not os.path.exists(DEFAULT_ENCRYPTED_AUDIO_FILENAME):
-        logger.fatal("Encrypted audio file does not exist")
-        sys.exit(1)
+    if not os.path.exists(encrypted_audio):
+        raise DecryptionError(f"Encrypted audio file {encrypted_audio} does not exist")
 
     logger.info("Decrypting audio stream")
 
-    cmd = ["mp4decrypt"]
+    cmd = [settings.mp4decrypt]
     for key_id, key in decryption_keys:
         cmd += ["--key", f"1:{key_id}:{key}"]
 
-    cmd += [DEFAULT_ENCRYPTED_AUDIO_FILENAME, DEFAULT_DECRYPTED_AUDIO_FILENAME]
+    cmd += [encrypted_audio, decrypted_audio]
 
     logger.info(f'Command: {" ".join(cmd)}')
+    run_mp4decrypt(cmd)
 
-    subprocess.run(cmd, capture_output=True, text=True, check=True)
 
+def fix_video(
+    decryption_keys: list[DecryptionKeys],
+    workdir: str = ".",
+    settings: Optional[Settings] = None,
+):
+    if settings is None:
+        settings = Settings()
 
-def fix_video(decryption_keys: list[DecryptionKeys]):
-    if shutil.which("mp4decrypt") is None:
-        logger.fatal("mp4decrypt is not installed or not found in PATH")
-        sys.exit(1)
+    if shutil.which(settings.mp4decrypt) is None:
+        raise MissingDependencyError(settings.mp4decrypt)
 
-    if not os.path.exists(DEFAULT_ENCRYPTED_VIDEO_FILENAME):
-        logger.fatal("Encrypted video file does not exist")
-        sys.exit(1)
+    encrypted_video = os.path.join(workdir, DEFAULT_ENCRYPTED_VIDEO_FILENAME)
+    decrypted_video = os.path.join(workdir, DEFAULT_DECRYPTED_VIDEO_FILENAME)
+
+    if not os.path.exists(encrypted_video):
+        raise DecryptionError(f"Encrypted video file {encrypted_video} does not exist")
 
     logger.info("Decrypting video stream")
 
-    cmd = ["mp4decrypt"]
+    cmd = [settings.mp4decrypt]
     for key_id, key in decryption_keys:
         cmd += ["--key", f"1:{key_id}:{key}"]
 
-    cmd += [DEFAULT_ENCRYPTED_VIDEO_FILENAME, DEFAULT_DECRYPTED_VIDEO_FILENAME]
+    cmd += [encrypted_video, decrypted_video]
 
     logger.info(f'Command: {" ".join(cmd)}')
-    subprocess.run(cmd, capture_output=True, text=True, check=True)
+    run_mp4decrypt(cmd)
+
+
+def run_mp4decrypt(cmd: list[str]):
+    try:
+        subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        raise DecryptionError(f"mp4decrypt failed: {(e.stderr or '').strip()}") from e
+
 
+# ffmpeg options of each output container
+CONTAINER_OPTIONS = {
+    # moov atom at the end, written once the whole file is known
+    "mp4": ["-f", "mp4"],
+    # moov atom moved to the front, so players and ingest can start before the end
+    "faststart": ["-f", "mp4", "-movflags", "+faststart"],
+    # Fragmented MP4, written sequentially, so it can be streamed to a pipe
+    "fmp4": ["-f", "mp4", "-movflags", "+frag_keyframe+empty_moov+default_base_moof"],
+    "mkv": ["-f", "matroska"],
+}
 
-def merge_streams(output_filename: str = None):
-    if shutil.which("ffmpeg") is None:
-        logger.fatal("ffmpeg is not installed or not found in PATH")
-        sys.exit(1)
+CONTAINERS = tuple(CONTAINER_OPTIONS)
+
+# Containers that can be written to a non-seekable output
+STREAMABLE_CONTAINERS = ("fmp4", "mkv")
+
+STDOUT = "-"
+
+
+def is_pipe(output_filename: str) -> bool:
+    return output_filename == STDOUT or output_filename.startswith("pipe:")
+
+
+def container_for(output_filename: str, container: Optional[str] = None) -> Optional[str]:
+    """
+    The container to write, from `container` or else the output name; None
+    leaves the choice to ffmpeg (e.g. for .webm).
+    """
+    if container is not None:
+        if container not in CONTAINER_OPTIONS:
+            raise ValueError(f"Unsupported container: {container}")
+
+        if is_pipe(output_filename) and container not in STREAMABLE_CONTAINERS:
+            raise ValueError(
+                f"{container} cannot be written to a pipe, use one of "
+                f"{', '.join(STREAMABLE_CONTAINERS)}"
+            )
+
+        return container
+
+    if is_pipe(output_filename):
+        return "fmp4"
+
+    if output_filename.lower().endswith((".mkv", ".mka")):
+        return "mkv"
+
+    if output_filename.lower().endswith((".mp4", ".m4v", ".mov")):
+        return "mp4"
+
+    return None
+
+
+def container_extension(container: Optional[str]) -> str:
+    return ".mkv" if container == "mkv" else ".mp4"
+
+
+def merge_streams(
+    output_filename: str = None,
+    workdir: str = ".",
+    subtitle_tracks: Optional[list[SubtitleTrack]] = None,
+    settings: Optional[Settings] = None,
+) -> str:
+    """
+    Mux the decrypted streams and `subtitle_tracks` into `output_filename`,
+    which may be "-" (stdout) or an ffmpeg pipe such as "pipe:3", in the
+    container of `settings.container`.
+    """
+    if settings is None:
+        settings = Settings()
+
+    if shutil.which(settings.ffmpeg) is None:
+        raise MissingDependencyError(settings.ffmpeg)
 
     if output_filename is None:
         output_filename = DEFAULT_MERGED_VIDEO_FILENAME
 
-    logger.info("Merging (decrypted) audio and video streams")
+    if subtitle_tracks is None:
+        subtitle_tracks = []
+
+    container = container_for(output_filename, settings.container)
+    to_pipe = is_pipe(output_filename)
+
+    logger.info(f"Merging (decrypted) audio and video streams into {container or output_filename}")
 
     cmd = [
-        "ffmpeg",
+        settings.ffmpeg,
+        "-nostdin",
+        "-y",
         "-i",
-        DEFAULT_DECRYPTED_VIDEO_FILENAME,
+        os.path.join(workdir, DEFAULT_DECRYPTED_VIDEO_FILENAME),
         "-i",
-        DEFAULT_DECRYPTED_AUDIO_FILENAME,
-        "-c",
-        "copy",
-        output_filename,
+        os.path.join(workdir, DEFAULT_DECRYPTED_AUDIO_FILENAME),
     ]
+
+    for track in subtitle_tracks:
+        cmd += ["-i", track.path]
+
+    if subtitle_tracks:
+        logger.info(f"Muxing {len(subtitle_tracks)} subtitle track(s)")
+
+        cmd += ["-map", "0:v", "-map", "1:a"]
+        for i in range(len(subtitle_tracks)):
+            cmd += ["-map", f"{i + 2}:s"]
+
+    cmd += ["-c", "copy"]
+
+    if subtitle_tracks:
+        # Text subtitles cannot be stream-copied into MP4, which only takes mov_text
+        cmd += ["-c:s", subtitle_codec(output_filename, container)]
+
+        for i, track in enumerate(subtitle_tracks):
+            if track.language is not None:
+                cmd += [f"-metadata:s:s:{i}", f"language={track.language}"]
+
+    cmd += CONTAINER_OPTIONS.get(container, [])
+    cmd.append("pipe:1" if output_filename == STDOUT else output_filename)
+
     logger.info(f'Command: {" ".join(cmd)}')
-    subprocess.run(cmd, capture_output=True, text=True, check=True)
+
+    # Failures are not retried: ffmpeg fails the same way on the same local
+    # inputs, and whatever was already written to a pipe cannot be taken back
+    try:
+        if to_pipe:
+            # The muxed stream goes to our stdout (or the given descriptor)
+            fd = int(output_filename[len("pipe:") :] or 1) if output_filename != STDOUT else 1
+            subprocess.run(
+                cmd, stderr=subprocess.PIPE, text=True, check=True, pass_fds=(fd,) if fd > 2 else ()
+            )
+        else:
+            subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        error = (e.stderr or "").strip().splitlines()
+        raise MergeError(f"ffmpeg failed: {error[-1] if error else e}") from e
+
+    return output_filename
+
+
+def subtitle_codec(output_filename: str, container: Optional[str] = None) -> str:
+    if container == "mkv" or output_filename.lower().endswith((".mkv", ".mka")):
+        return "srt"
+
+    if output_filename.lower().endswith(".webm"):
+        return "webvtt"
+
+    return "mov_text"
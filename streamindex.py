@@ -0,0 +1,268 @@
+"""
+Explicit stream selection (--video-stream, --audio-stream).
+
+A selector is one of:
+
+- an exact stream id, e.g. `video=2000000`
+- a glob matching whole ids, e.g. `video=*`
+- a regular expression over the ids between slashes, e.g. `/^audio_(por|pt)/`
+- comma-separated attribute conditions, e.g. `height<=720` or `lang=por,codecs=mp4a*`
+- a stream type alone, e.g. `audio`
+
+Globs, regular expressions and conditions may be prefixed by a stream type
+(`video:height<=720`, `audio:lang=por`); without one they apply to the type
+being selected. When several streams match, the best one is chosen (highest
+resolution, then highest bandwidth), so that the same selector pins a
+comparable rendition across many manifests.
+"""
+
+import fnmatch
+import functools
+import logging
+import operator
+import re
+
+from typing import Callable, Optional
+
+from stream import Stream, StreamType
+from subtitles import language_tag
+
+logger = logging.getLogger(__name__)
+
+SELECTOR_TYPES = {
+    "video": StreamType.VIDEO,
+    "audio": StreamType.AUDIO,
+    "subtitle": StreamType.SUBTITLES,
+    "subtitles": StreamType.SUBTITLES,
+}
+
+# Stream attribute of each selector attribute
+NUMERIC_ATTRIBUTES = {
+    "width": "width",
+    "height": "height",
+    "fps": "fps",
+    "bandwidth": "bandwidth",
+}
+
+TEXT_ATTRIBUTES = {
+    "id": "id",
+    "lang": "language",
+    "language": "language",
+    "codecs": "codecs",
+}
+
+OPERATORS: dict[str, Callable] = {
+    "<=": operator.le,
+    ">=": operator.ge,
+    "!=": operator.ne,
+    "=": operator.eq,
+    "<": operator.lt,
+    ">": operator.gt,
+}
+
+CONDITION_PATTERN = re.compile(r"\s*([a-z]+)\s*(<=|>=|!=|=|<|>)\s*(.*?)\s*")
+
+
+def parse_number(value) -> Optional[float]:
+    """A number such as 720, 2.5M (bandwidth) or 30000/1001 (frame rate)."""
+    if value is None or value == "":
+        return None
+
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    value = str(value).strip()
+
+    if "/" in value:
+        numerator, denominator = value.split("/", 1)
+        return float(numerator) / float(denominator)
+
+    multiplier = {"k": 1e3, "m": 1e6, "g": 1e9}.get(value[-1].lower())
+    if multiplier is not None:
+        return float(value[:-1]) * multiplier
+
+    return float(value)
+
+
+class Condition:
+    def __init__(self, attribute: str, op: str, value: str):
+        if attribute in NUMERIC_ATTRIBUTES:
+            try:
+                self.value = parse_number(value)
+            except ValueError:
+                self.value = None
+
+            if self.value is None:
+                raise ValueError(f"Invalid number for {attribute}: {value}")
+        elif op in ("=", "!="):
+            self.value = value.lower()
+        else:
+            raise ValueError(f"{attribute} can only be compared with = or !=")
+
+        self.attribute: str = attribute
+        self.op: str = op
+
+    def matches(self, stream: Stream) -> bool:
+        if self.attribute in NUMERIC_ATTRIBUTES:
+            actual = parse_number(getattr(stream, NUMERIC_ATTRIBUTES[self.attribute]))
+            return actual is not None and OPERATORS[self.op](actual, self.value)
+
+        actual = getattr(stream, TEXT_ATTRIBUTES[self.attribute]) or ""
+        matched = fnmatch.fnmatchcase(actual.lower(), self.value)
+
+        if not matched and self.attribute in ("lang", "language"):
+            # "por" also matches streams tagged "pt" or "pt-PT"
+            tag = language_tag(actual)
+            matched = tag is not None and tag == language_tag(self.value)
+
+        return matched if self.op == "=" else not matched
+
+
+class Selector:
+    def __init__(
+        self,
+        text: str,
+        stream_type: Optional[StreamType] = None,
+        id_pattern: Optional[re.Pattern] = None,
+        conditions: Optional[list[Condition]] = None,
+        glob: bool = False,
+    ):
+        self.text: str = text
+        self.stream_type: Optional[StreamType] = stream_type
+
+        # Glob (matching whole ids) or regular expression (searched) over the stream ids
+        self.id_pattern: Optional[re.Pattern] = id_pattern
+        self.glob: bool = glob
+        self.conditions: list[Condition] = conditions or []
+
+    def matches_id(self, stream_id: str) -> bool:
+        if self.id_pattern is None:
+            return True
+
+        if self.glob:
+            return self.id_pattern.fullmatch(stream_id) is not None
+
+        return self.id_pattern.search(stream_id) is not None
+
+    def matches(self, stream: Stream) -> bool:
+        if self.stream_type is not None and stream.stream_type != self.stream_type:
+            return False
+
+        if not self.matches_id(stream.id):
+            return False
+
+        return all(condition.matches(stream) for condition in self.conditions)
+
+
+def parse_conditions(text: str) -> Optional[list[Condition]]:
+    """The conditions of `text`, or None if it is not a list of conditions (e.g. a glob)."""
+    conditions = []
+
+    for part in text.split(","):
+        match = CONDITION_PATTERN.fullmatch(part)
+
+        if match is None:
+            return None
+
+        attribute, op, value = match.groups()
+
+        if attribute not in NUMERIC_ATTRIBUTES and attribute not in TEXT_ATTRIBUTES:
+            return None
+
+        conditions.append(Condition(attribute, op, value))
+
+    return conditions
+
+
+@functools.lru_cache(maxsize=256)
+def parse_selector(text: str) -> Selector:
+    """Parse a selector once; batch jobs reuse it for every manifest."""
+    if not text or not text.strip():
+        raise ValueError("Empty stream selector")
+
+    text = text.strip()
+    stream_type = None
+    rest = text
+
+    # A bare type ("audio") selects the best stream of that type
+    prefix, separator, remainder = text.partition(":")
+    if prefix.lower() in SELECTOR_TYPES:
+        stream_type = SELECTOR_TYPES[prefix.lower()]
+        rest = remainder.strip()
+
+    if not rest:
+        return Selector(text, stream_type)
+
+    if len(rest) >= 2 and rest.startswith("/") and rest.endswith("/"):
+        try:
+            return Selector(text, stream_type, id_pattern=re.compile(rest[1:-1]))
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression in stream selector {text}: {e}") from e
+
+    conditions = parse_conditions(rest)
+    if conditions is not None:
+        return Selector(text, stream_type, conditions=conditions)
+
+    return Selector(text, stream_type, id_pattern=re.compile(fnmatch.translate(rest)), glob=True)
+
+
+def quality(stream: Stream) -> tuple:
+    return ((stream.width or 0) * (stream.height or 0), stream.bandwidth or 0)
+
+
+class StreamIndex:
+    """Streams of one manifest, indexed by id and type."""
+
+    def __init__(self, streams: list[Stream]):
+        if streams is None:
+            raise ValueError("streams cannot be None")
+
+        if not all(isinstance(x, Stream) for x in streams):
+            raise TypeError("all items in streams list must be Stream instances")
+
+        self.streams: list[Stream] = list(streams)
+        self.by_id: dict[str, Stream] = {}
+        self.by_type: dict[StreamType, list[Stream]] = {}
+
+        for stream in self.streams:
+            if stream.id in self.by_id:
+                logger.warning(f"Duplicate stream id {stream.id}, keeping the first")
+            else:
+                self.by_id[stream.id] = stream
+
+            self.by_type.setdefault(stream.stream_type, []).append(stream)
+
+    def ids(self) -> list[str]:
+        return list(self.by_id)
+
+    def get(self, stream_id: str) -> Optional[Stream]:
+        return self.by_id.get(stream_id)
+
+    def select(self, selector: str, stream_type: Optional[StreamType] = None) -> Optional[Stream]:
+        """
+        The best stream matching `selector`, None if there is none. An exact id
+        is always honoured; otherwise `stream_type` applies unless the selector
+        names its own type.
+        """
+        if selector is None:
+            raise ValueError("selector cannot be None")
+
+        if not isinstance(selector, str):
+            raise TypeError(
+                f"Invalid type for selector: Expected str, got {type(selector).__name__}"
+            )
+
+        stream = self.by_id.get(selector.strip())
+        if stream is not None:
+            return stream
+
+        parsed = parse_selector(selector)
+        stream_type = parsed.stream_type or stream_type
+
+        candidates = self.by_type.get(stream_type, []) if stream_type is not None else self.streams
+        matches = [stream for stream in candidates if parsed.matches(stream)]
+
+        if not matches:
+            return None
+
+        return max(matches, key=quality)
@@ -0,0 +1,254 @@
+"""
+In-process subtitle conversion.
+
+Subtitles are published either as plain TTML/WebVTT files or as STPP, i.e.
+TTML documents carried in the `mdat` boxes of fragmented MP4 segments. Both
+are converted to WebVTT or SRT so that ffmpeg can mux them as regular text
+tracks alongside the video.
+"""
+
+import glob
+import logging
+import os
+import re
+import struct
+import xml.etree.ElementTree as ET
+
+from collections import namedtuple
+from typing import Optional
+
+from defaults import DEFAULT_SUBTITLE_FILENAME_PREFIX
+
+logger = logging.getLogger(__name__)
+
+SUBTITLE_FORMATS = ("vtt", "srt")
+
+Cue = namedtuple("Cue", ["start", "end", "text"])
+
+SubtitleTrack = namedtuple("SubtitleTrack", ["path", "language"])
+
+# ffmpeg expects ISO 639-2 codes in MP4 and MKV language tags
+ISO_639_2 = {
+    "pt": "por",
+    "en": "eng",
+    "es": "spa",
+    "fr": "fra",
+    "de": "deu",
+    "it": "ita",
+    "nl": "nld",
+}
+
+TTML_PARAMETER_NS = "http://www.w3.org/ns/ttml#parameter"
+
+
+def language_tag(language: Optional[str]) -> Optional[str]:
+    if not language:
+        return None
+
+    primary = language.split("-")[0].lower()
+    return ISO_639_2.get(primary, primary)
+
+
+def track_path(workdir: str, index: int, language: Optional[str], fmt: str) -> str:
+    return os.path.join(
+        workdir, f"{DEFAULT_SUBTITLE_FILENAME_PREFIX}.{index}.{language or 'und'}.{fmt}"
+    )
+
+
+def find_tracks(workdir: str) -> list[SubtitleTrack]:
+    """Converted subtitle tracks in `workdir`, in the order they were fetched."""
+    tracks = []
+
+    for path in glob.glob(
+        os.path.join(glob.escape(workdir), f"{DEFAULT_SUBTITLE_FILENAME_PREFIX}.*")
+    ):
+        parts = os.path.basename(path).split(".")
+
+        if len(parts) != 4 or parts[3] not in SUBTITLE_FORMATS:
+            continue
+
+        tracks.append((int(parts[1]), SubtitleTrack(path, None if parts[2] == "und" else parts[2])))
+
+    return [track for _, track in sorted(tracks)]
+
+
+def iter_boxes(data: bytes):
+    """Top-level ISO BMFF boxes of `data` as (type, payload) pairs."""
+    offset = 0
+
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack(">I4s", data[offset : offset + 8])
+        header = 8
+
+        if size == 1:
+            size = struct.unpack(">Q", data[offset + 8 : offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = len(data) - offset
+
+        if size < header:
+            break
+
+        yield box_type.decode("latin-1"), data[offset + header : offset + size]
+        offset += size
+
+
+def extract_documents(data: bytes) -> list[str]:
+    """The text documents in `data`: the file itself, or each STPP sample."""
+    stripped = data.lstrip(b"\xef\xbb\xbf \t\r\n")
+
+    if stripped.startswith(b"<") or stripped.startswith(b"WEBVTT"):
+        return [stripped.decode("utf-8")]
+
+    return [payload.decode("utf-8") for box_type, payload in iter_boxes(data) if box_type == "mdat"]
+
+
+def parse_ttml_time(value: str, frame_rate: float = 30.0, tick_rate: float = 1.0) -> float:
+    match = re.fullmatch(r"(\d+):(\d{2}):(\d{2})(?:([.:])(\d+))?", value)
+
+    if match is not None:
+        hours, minutes, seconds = (int(g) for g in match.group(1, 2, 3))
+        total = hours * 3600 + minutes * 60 + seconds
+
+        if match.group(4) == ".":
+            total += float(f"0.{match.group(5)}")
+        elif match.group(4) == ":":
+            total += int(match.group(5)) / frame_rate
+
+        return total
+
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)(h|m|s|ms|f|t)", value)
+
+    if match is None:
+        raise ValueError(f"Unsupported TTML time expression: {value}")
+
+    number, unit = float(match.group(1)), match.group(2)
+    divisor = {"h": 1 / 3600, "m": 1 / 60, "s": 1, "ms": 1000, "f": frame_rate, "t": tick_rate}
+
+    return number / divisor[unit]
+
+
+def _local_name(tag) -> str:
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _text(element) -> str:
+    parts = [element.text or ""]
+
+    for child in element:
+        if _local_name(child.tag) == "br":
+            parts.append("\n")
+        else:
+            parts.append(_text(child))
+
+        parts.append(child.tail or "")
+
+    return "".join(parts)
+
+
+def ttml_to_cues(document: str) -> list[Cue]:
+    root = ET.fromstring(document)
+
+    frame_rate = float(root.get(f"{{{TTML_PARAMETER_NS}}}frameRate", 30))
+    tick_rate = float(root.get(f"{{{TTML_PARAMETER_NS}}}tickRate", 1))
+
+    cues = []
+    for element in root.iter():
+        if _local_name(element.tag) != "p" or element.get("begin") is None:
+            continue
+
+        start = parse_ttml_time(element.get("begin"), frame_rate, tick_rate)
+
+        if element.get("end") is not None:
+            end = parse_ttml_time(element.get("end"), frame_rate, tick_rate)
+        elif element.get("dur") is not None:
+            end = start + parse_ttml_time(element.get("dur"), frame_rate, tick_rate)
+        else:
+            continue
+
+        text = "\n".join(line.strip() for line in _text(element).strip().splitlines())
+
+        if text:
+            cues.append(Cue(start, end, text))
+
+    return cues
+
+
+def parse_webvtt_time(value: str) -> float:
+    seconds = 0.0
+
+    for part in value.strip().split(":"):
+        seconds = seconds * 60 + float(part)
+
+    return seconds
+
+
+def webvtt_to_cues(document: str) -> list[Cue]:
+    cues = []
+
+    for block in re.split(r"\n\s*\n", document.replace("\r\n", "\n")):
+        lines = block.strip().split("\n")
+        timing = next((i for i, line in enumerate(lines) if "-->" in line), None)
+
+        if timing is None:
+            continue
+
+        start, end = lines[timing].split("-->")
+        end = end.strip().split(" ")[0]
+
+        cues.append(
+            Cue(parse_webvtt_time(start), parse_webvtt_time(end), "\n".join(lines[timing + 1 :]))
+        )
+
+    return cues
+
+
+def _timestamp(seconds: float, separator: str) -> str:
+    milliseconds = round(seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+def to_webvtt(cues: list[Cue]) -> str:
+    blocks = ["WEBVTT\n"]
+
+    for cue in cues:
+        blocks.append(f"{_timestamp(cue.start, '.')} --> {_timestamp(cue.end, '.')}\n{cue.text}\n")
+
+    return "\n".join(blocks)
+
+
+def to_srt(cues: list[Cue]) -> str:
+    blocks = []
+
+    for i, cue in enumerate(cues, start=1):
+        blocks.append(
+            f"{i}\n{_timestamp(cue.start, ',')} --> {_timestamp(cue.end, ',')}\n{cue.text}\n"
+        )
+
+    return "\n".join(blocks)
+
+
+def convert(input_path: str, output_path: str, fmt: str = "vtt"):
+    """Convert a TTML, STPP or WebVTT file to WebVTT or SRT."""
+    if fmt not in SUBTITLE_FORMATS:
+        raise ValueError(f"Unsupported subtitle format: {fmt}")
+
+    with open(input_path, "rb") as f:
+        documents = extract_documents(f.read())
+
+    cues: list[Cue] = []
+    for document in documents:
+        if document.startswith("WEBVTT"):
+            cues += webvtt_to_cues(document)
+        else:
+            cues += ttml_to_cues(document)
+
+    cues.sort(key=lambda cue: cue.start)
+    logger.info(f"Converted {len(cues)} cues from {input_path} to {fmt}")
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(to_webvtt(cues) if fmt == "vtt" else to_srt(cues))
@@ -0,0 +1,156 @@
+import os
+import threading
+
+import pytest
+
+import api
+import downloader
+import extractor
+from config import Settings
+from defaults import DEFAULT_DECRYPTED_AUDIO_FILENAME, DEFAULT_DECRYPTED_VIDEO_FILENAME
+from errors import DecryptionError, ExtractionError, MergeError
+from jobdb import Job, JobState, output_filename_for
+
+PAGE = "https://opto.sic.pt/videos/episode-1"
+MANIFEST = "https://cdn.example.com/episode-1/manifest.mpd"
+LICENSE = "https://license.example.com/widevine"
+
+
+@pytest.fixture
+def settings(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        extractor, "resolve_manifest_and_license", lambda url, settings=None: (MANIFEST, LICENSE)
+    )
+    return Settings(scratch_dir=str(tmp_path / "scratch"))
+
+
+def fake_pipeline(monkeypatch, workdirs, error=None, merge_error=None):
+    """Stand-ins for the download and merge that write their files in the workdir."""
+
+    def download_and_decrypt(manifest, license_url, subtitles, audio, video, workdir, **kwargs):
+        workdirs.append(workdir)
+
+        if error is not None:
+            raise error
+
+        for filename in (DEFAULT_DECRYPTED_VIDEO_FILENAME, DEFAULT_DECRYPTED_AUDIO_FILENAME):
+            with open(os.path.join(workdir, filename), "w") as f:
+                f.write(manifest)
+
+        return []
+
+    def merge_streams(output, workdir, subtitle_tracks, settings):
+        if merge_error is not None:
+            raise merge_error
+
+        with open(os.path.join(workdir, DEFAULT_DECRYPTED_VIDEO_FILENAME)) as src:
+            with open(output, "w") as out:
+                out.write(src.read())
+
+        return output
+
+    monkeypatch.setattr(downloader, "download_and_decrypt", download_and_decrypt)
+    monkeypatch.setattr(downloader, "merge_streams", merge_streams)
+
+
+def test_download_a_page(settings, monkeypatch):
+    workdirs = []
+    fake_pipeline(monkeypatch, workdirs)
+
+    result = api.download(url=PAGE, settings=settings)
+
+    assert result.ok
+    assert (result.source, result.manifest_url, result.license_url) == (PAGE, MANIFEST, LICENSE)
+    assert result.output_path == output_filename_for(PAGE)
+    assert open(result.output_path).read() == MANIFEST
+    assert result.elapsed >= 0
+
+    # The work directory is private to the call and removed afterwards
+    (workdir,) = workdirs
+    assert os.path.dirname(workdir) == settings.scratch_dir
+    assert not os.path.exists(workdir)
+    assert not os.path.exists(DEFAULT_DECRYPTED_VIDEO_FILENAME)
+
+
+def test_concurrent_downloads_do_not_share_files(settings, monkeypatch):
+    workdirs = []
+    fake_pipeline(monkeypatch, workdirs)
+    manifests = [f"https://cdn.example.com/{i}/manifest.mpd" for i in range(8)]
+    results = {}
+
+    def download(manifest):
+        # Without an output, each is named after its manifest
+        results[manifest] = api.download(manifest=manifest, license_url=LICENSE, settings=settings)
+
+    threads = [threading.Thread(target=download, args=(m,)) for m in manifests]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(workdirs)) == len(manifests)
+    assert all(result.ok for result in results.values())
+    assert {open(r.output_path).read() for r in results.values()} == set(manifests)
+
+
+@pytest.mark.parametrize(
+    "error, merge_error, expected",
+    [
+        (DecryptionError("No keys obtained"), None, DecryptionError),
+        (None, MergeError("ffmpeg failed: Invalid data"), MergeError),
+    ],
+)
+def test_failures_are_reported_in_the_result(settings, monkeypatch, error, merge_error, expected):
+    fake_pipeline(monkeypatch, [], error, merge_error)
+
+    result = api.download(manifest=MANIFEST, license_url=LICENSE, settings=settings)
+
+    assert not result.ok
+    assert result.output_path is None
+    assert isinstance(result.exception, expected)
+    assert result.error == f"{expected.__name__}: {result.exception}"
+    assert os.listdir(settings.scratch_dir) == []
+
+
+def test_extraction_failure(settings, monkeypatch):
+    def resolve(url, settings=None):
+        raise ExtractionError(f"No manifest found for {url}", url)
+
+    monkeypatch.setattr(extractor, "resolve_manifest_and_license", resolve)
+
+    result = api.download(url=PAGE, settings=settings)
+
+    assert isinstance(result.exception, ExtractionError)
+    assert result.error.startswith("ExtractionError: No manifest found")
+    assert result.manifest_url is None
+
+
+def test_invalid_arguments_raise():
+    with pytest.raises(ValueError):
+        api.download()
+
+    with pytest.raises(ValueError):
+        api.download(manifest=MANIFEST)
+
+
+def test_result_of_a_batch_job():
+    done = Job(PAGE, JobState.MUXED, "episode-1.mp4", MANIFEST, LICENSE)
+    done.started_at, done.muxed_at = 100.0, 160.0
+    failed = Job(PAGE, JobState.FAILED, "episode-1.mp4", error="MergeError: ffmpeg failed")
+
+    ok = api.JobResult.from_job(done)
+    ko = api.JobResult.from_job(failed)
+
+    assert (ok.ok, ok.output_path, ok.elapsed, ok.manifest_url) == (
+        True,
+        "episode-1.mp4",
+        60,
+        MANIFEST,
+    )
+    assert (ko.ok, ko.output_path, ko.error, ko.exception) == (
+        False,
+        None,
+        "MergeError: ffmpeg failed",
+        None,
+    )
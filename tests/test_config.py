@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from config import Settings, from_environ, load_settings, parse_seconds, parse_size
+
+
+@pytest.fixture(autouse=True)
+def no_default_config(tmp_path, monkeypatch):
+    # Keep the config files of the machine running the tests out of the way
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("HOME", str(tmp_path))
+
+
+def test_defaults():
+    settings = load_settings(environ={})
+
+    assert settings.jobs == Settings().jobs
+    assert settings.retry == {}
+
+
+def test_file_then_environment_then_overrides(tmp_path):
+    path = tmp_path / "settings.toml"
+    path.write_text('jobs = 3\ntimeout = 20\ncache_size = "2G"\n[retry]\nmax_attempts = 7\n')
+
+    settings = load_settings(
+        str(path),
+        overrides={"timeout": 30, "jobs": None},
+        environ={"OPTO_DL_JOBS": "4", "OPTO_DL_HEADLESS": "no"},
+    )
+
+    assert settings.jobs == 4
+    assert settings.timeout == 30
+    assert settings.cache_size == 2 * 1024**3
+    assert settings.headless is False
+    assert settings.retry == {"max_attempts": 7}
+
+
+def test_config_file_from_the_environment(tmp_path):
+    path = tmp_path / "other.json"
+    path.write_text(json.dumps({"jobs": 6}))
+
+    assert load_settings(environ={"OPTO_DL_CONFIG": str(path)}).jobs == 6
+
+
+def test_default_config_path(tmp_path):
+    (tmp_path / "opto-dl.toml").write_text("jobs = 2\n")
+
+    assert load_settings(environ={}).jobs == 2
+
+
+def test_retry_is_merged_key_by_key(tmp_path):
+    path = tmp_path / "settings.json"
+    path.write_text(json.dumps({"retry": {"max_attempts": 7, "base_delay": 2}}))
+
+    settings = load_settings(str(path), environ={"OPTO_DL_RETRY": '{"base_delay": 5}'})
+
+    assert settings.retry == {"max_attempts": 7, "base_delay": 5}
+
+
+def test_unknown_environment_variables_are_ignored():
+    assert from_environ({"OPTO_DL_SOMETHING_ELSE": "1", "OPTO_DL_JOBS": "2"}) == {"jobs": 2}
+
+
+def test_invalid_environment_values():
+    with pytest.raises(ValueError):
+        from_environ({"OPTO_DL_JOBS": "many"})
+
+    with pytest.raises(ValueError):
+        from_environ({"OPTO_DL_RETRY": "max_attempts=3"})
+
+
+def test_unknown_file_settings(tmp_path):
+    path = tmp_path / "settings.toml"
+    path.write_text("jobz = 3\n")
+
+    with pytest.raises(ValueError, match="Unknown setting jobz"):
+        load_settings(str(path), environ={})
+
+
+@pytest.mark.parametrize(
+    "value, size", [("500K", 500 * 1024), ("1.5G", int(1.5 * 1024**3)), ("20MiB", 20 * 1024**2)]
+)
+def test_parse_size(value, size):
+    assert parse_size(value) == size
+
+
+@pytest.mark.parametrize("value, seconds", [("90", 90), ("45m", 2700), ("1h30m", 5400)])
+def test_parse_seconds(value, seconds):
+    assert parse_seconds(value) == seconds
@@ -0,0 +1,121 @@
+import os
+import shutil
+from collections import namedtuple
+
+import pytest
+
+import diskspace
+import downloader
+import progress
+from config import Settings
+from defaults import DEFAULT_DECRYPTED_AUDIO_FILENAME, DEFAULT_DECRYPTED_VIDEO_FILENAME
+from diskspace import DiskSpace, InsufficientDiskSpaceError
+from jobdb import JobDB, JobState
+
+MiB = 1024 * 1024
+
+Usage = namedtuple("Usage", ["total", "used", "free"])
+
+
+@pytest.fixture
+def batch(tmp_path, monkeypatch):
+    """Settings of a batch in `tmp_path`, with fresh disk space and progress trackers."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(diskspace, "DISK_SPACE", DiskSpace(margin=0))
+    monkeypatch.setattr(progress, "TRACKER", progress.BatchProgress())
+
+    return Settings(scratch_dir=str(tmp_path / "scratch"), job_db=str(tmp_path / "jobs.db"))
+
+
+@pytest.fixture
+def free(monkeypatch):
+    """Free space reported for every path, settable by the test."""
+    free = {"bytes": 100 * MiB}
+    monkeypatch.setattr(diskspace.shutil, "disk_usage", lambda path: Usage(0, 0, free["bytes"]))
+    return free
+
+
+def write(path, nbytes):
+    with open(path, "wb") as f:
+        f.write(b"\0" * nbytes)
+
+
+def test_reservations_count_what_is_still_to_be_written(tmp_path, free):
+    pool = DiskSpace(margin=10 * MiB)
+
+    with pool.reservation() as reservation:
+        reservation.acquire(str(tmp_path / "a"), 60 * MiB)
+        assert pool.available(str(tmp_path)) == 30 * MiB
+
+        write(tmp_path / "a" / "video.mp4", 20 * MiB)
+        assert pool.available(str(tmp_path)) == 50 * MiB
+
+    assert pool.available(str(tmp_path)) == 90 * MiB
+
+
+def test_a_lone_job_without_space_fails(tmp_path, free):
+    pool = DiskSpace(margin=10 * MiB)
+
+    with pool.reservation() as reservation:
+        with pytest.raises(InsufficientDiskSpaceError):
+            reservation.acquire(str(tmp_path / "a"), 95 * MiB)
+
+
+def test_files_already_written_are_not_reserved_again(tmp_path, free):
+    pool = DiskSpace(margin=0)
+    workdir = tmp_path / "job"
+    workdir.mkdir()
+    write(workdir / "video.mp4", 3 * MiB)
+    free["bytes"] = 2 * MiB
+
+    with pool.reservation() as reservation:
+        reservation.acquire(str(workdir), 5 * MiB)
+        assert reservation.outstanding() == 2 * MiB
+
+
+def test_resumed_merge_reserves_the_output_size(batch, free, monkeypatch):
+    settings = batch
+    reserved = []
+
+    def merge_streams(output_path, workdir, tracks, settings):
+        (reservation,) = diskspace.DISK_SPACE._reservations
+        reserved.append(reservation.outstanding())
+        shutil.copy(os.path.join(workdir, DEFAULT_DECRYPTED_VIDEO_FILENAME), output_path)
+
+    monkeypatch.setattr(downloader, "merge_streams", merge_streams)
+
+    with JobDB(settings.job_db) as db:
+        job, _ = db.add("https://opto.sic.pt/videos/episode-1")
+        db.advance(job, JobState.EXTRACTED, manifest_url="https://cdn/m.mpd", license_url="l")
+        db.advance(job, JobState.DOWNLOADED)
+
+        workdir = downloader.job_workdir(job, settings)
+        os.makedirs(workdir)
+        write(os.path.join(workdir, DEFAULT_DECRYPTED_VIDEO_FILENAME), 3 * MiB)
+        write(os.path.join(workdir, DEFAULT_DECRYPTED_AUDIO_FILENAME), 1 * MiB)
+
+        job = downloader.process_job(db, job, settings=settings)
+
+    assert job.state == JobState.MUXED
+    assert reserved == [4 * MiB]
+    assert diskspace.DISK_SPACE._reservations == []
+
+
+def test_resumed_merge_fails_without_space(batch, free, monkeypatch):
+    settings = batch
+    free["bytes"] = 1 * MiB
+    monkeypatch.setattr(downloader, "merge_streams", pytest.fail)
+
+    with JobDB(settings.job_db) as db:
+        job, _ = db.add("https://opto.sic.pt/videos/episode-1")
+        db.advance(job, JobState.DOWNLOADED)
+
+        workdir = downloader.job_workdir(job, settings)
+        os.makedirs(workdir)
+        write(os.path.join(workdir, DEFAULT_DECRYPTED_VIDEO_FILENAME), 3 * MiB)
+        write(os.path.join(workdir, DEFAULT_DECRYPTED_AUDIO_FILENAME), 1 * MiB)
+
+        job = downloader.process_job(db, job, settings=settings)
+
+    assert job.state == JobState.FAILED
+    assert job.error.startswith("InsufficientDiskSpaceError")
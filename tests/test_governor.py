@@ -0,0 +1,48 @@
+from governor import INCREASE_WINDOW, Governor
+
+
+def test_successes_raise_the_limit():
+    governor = Governor(initial_connections=4)
+
+    for _ in range(INCREASE_WINDOW):
+        governor.record("cdn", 1000, 1.0, status=200)
+
+    assert governor.connections("cdn") == 5
+
+
+def test_throttling_halves_the_limit():
+    governor = Governor(initial_connections=8)
+
+    governor.record("cdn", status=429)
+
+    assert governor.connections("cdn") == 4
+    assert governor.stats("cdn").throttled == 1
+
+
+def test_server_errors_halve_the_limit():
+    governor = Governor(initial_connections=8)
+
+    governor.record("cdn", status=503)
+
+    assert governor.connections("cdn") == 4
+
+
+def test_rejections_neither_raise_nor_lower_the_limit():
+    governor = Governor(initial_connections=4)
+
+    for _ in range(3 * INCREASE_WINDOW):
+        governor.record("cdn", status=404)
+
+    stats = governor.stats("cdn")
+    assert stats.limit == 4
+    assert stats.errors == 3 * INCREASE_WINDOW
+    assert stats.successes_since_change == 0
+
+
+def test_hosts_are_independent():
+    governor = Governor(initial_connections=8)
+
+    governor.record("a", status=429)
+
+    assert governor.connections("a") == 4
+    assert governor.connections("b") == 8
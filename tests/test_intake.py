@@ -0,0 +1,103 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from intake import PRIORITY_NAMES, iter_lines, iter_requests, iter_urls, parse_deadline
+from intake import parse_options, source_name
+
+
+def test_reads_lines_lazily(tmp_path):
+    path = tmp_path / "urls.txt"
+    path.write_text("https://a.com/1\nhttps://a.com/2\nhttps://a.com/3")
+
+    lines = iter_lines(str(path))
+
+    assert next(lines) == "https://a.com/1\n"
+    assert list(lines) == ["https://a.com/2\n", "https://a.com/3"]
+
+
+def test_follow_waits_for_new_and_complete_lines(tmp_path):
+    path = tmp_path / "urls.txt"
+    path.write_text("https://a.com/1\n")
+
+    lines = iter_lines(str(path), follow=True, poll_interval=0.01)
+    assert next(lines) == "https://a.com/1\n"
+
+    got = []
+    reader = threading.Thread(target=lambda: got.append(next(lines)), daemon=True)
+
+    with open(path, "a") as f:
+        # Half a line: the reader must wait for its end
+        f.write("https://a.com/")
+        f.flush()
+
+        reader.start()
+        reader.join(0.1)
+        assert reader.is_alive()
+
+        f.write("2\n")
+
+    reader.join(1)
+    assert got == ["https://a.com/2\n"]
+
+
+def test_urls_are_normalised_and_deduplicated():
+    lines = [
+        "https://a.com/1 https://A.com/1/\n",
+        "not a url\n",
+        "see https://a.com/2#fragment and https://a.com/1\n",
+    ]
+
+    assert list(iter_urls(lines)) == ["https://a.com/1", "https://a.com/2"]
+
+
+def test_dedup_over_a_large_input():
+    lines = (f"https://a.com/{i % 1000}\n" for i in range(5000))
+
+    assert sum(1 for _ in iter_urls(lines)) == 1000
+
+
+def test_source_name():
+    assert source_name("-") == "stdin"
+    assert source_name("/data/lists/newsroom.txt") == "newsroom.txt"
+
+
+def test_parse_options(caplog):
+    options = parse_options(
+        "https://a.com/1?x=y priority=high deadline=+30m source=newsroom", "list.txt"
+    )
+
+    assert options["priority"] == PRIORITY_NAMES["high"]
+    assert options["source"] == "newsroom"
+    assert options["deadline"] == pytest.approx(parse_deadline("+30m"), abs=5)
+
+    # Invalid options are ignored, and the URL query is never an option
+    options = parse_options("https://a.com/?priority=9 priority=soon deadline=never", "list.txt")
+    assert options == {"priority": 0, "deadline": None, "source": "list.txt"}
+    assert "priority=soon" in caplog.text
+
+
+def test_parse_deadline():
+    assert parse_deadline("+1h30m", now=1000) == 1000 + 5400
+    assert parse_deadline("2030-01-02T03:04") == datetime(2030, 1, 2, 3, 4).timestamp()
+
+    with pytest.raises(ValueError):
+        parse_deadline("tomorrow")
+
+
+def test_requests_carry_the_options_of_their_line():
+    lines = [
+        "https://a.com/1 https://a.com/2 priority=-5 source=archive\n",
+        "https://a.com/3\n",
+        "https://a.com/1 priority=urgent\n",
+    ]
+
+    requests = list(iter_requests(lines, default_source="list.txt"))
+
+    assert [(r.url, r.priority, r.source) for r in requests] == [
+        ("https://a.com/1", -5, "archive"),
+        ("https://a.com/2", -5, "archive"),
+        ("https://a.com/3", 0, "list.txt"),
+    ]
+    assert all(r.deadline is None for r in requests)
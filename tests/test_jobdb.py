@@ -0,0 +1,120 @@
+import pytest
+
+from jobdb import JobDB, JobState, job_key, normalize_url, output_filename_for
+
+URL = "https://opto.sic.pt/videos/episode-1"
+
+
+@pytest.fixture
+def db(tmp_path):
+    with JobDB(str(tmp_path / "jobs.sqlite3")) as db:
+        yield db
+
+
+def test_normalize_url():
+    assert normalize_url(" HTTPS://Opto.SIC.pt/videos/episode-1/#top ") == URL
+    assert normalize_url("https://opto.sic.pt") == "https://opto.sic.pt/"
+
+    # Paths and queries are case sensitive
+    assert normalize_url(URL.upper()) != URL
+    assert normalize_url(URL + "?a=1") != URL
+
+
+def test_output_filename_is_stable():
+    name = output_filename_for(URL)
+
+    assert name == f"episode-1_{job_key(URL)[:8]}.mp4"
+    assert output_filename_for(URL + "/") == name
+    assert output_filename_for("https://OPTO.sic.pt/videos/episode-1#x") == name
+    assert output_filename_for(URL, ".mkv") == name[: -len(".mp4")] + ".mkv"
+
+
+def test_output_filenames_do_not_collide():
+    urls = [
+        "https://opto.sic.pt/a/episode-1",
+        "https://opto.sic.pt/b/episode-1",
+        "https://opto.sic.pt/a/episode-1?season=2",
+        "https://opto.sic.pt/a/episode 1",
+    ]
+
+    names = [output_filename_for(url) for url in urls]
+
+    assert len(set(names)) == len(names)
+    assert all(name.startswith("episode-1_") for name in names)
+
+
+def test_output_filename_without_path():
+    assert output_filename_for("https://opto.sic.pt/").startswith("file_")
+    assert output_filename_for("https://opto.sic.pt/%E2%9C%93/") == (
+        f"E2-9C-93_{job_key('https://opto.sic.pt/%E2%9C%93')[:8]}.mp4"
+    )
+
+
+def test_add_deduplicates(db):
+    job, created = db.add(URL)
+    again, created_again = db.add(URL + "/#fragment")
+
+    assert created and not created_again
+    assert (job.state, job.output_path) == (JobState.PENDING, output_filename_for(URL))
+    assert again.url == job.url
+    assert len(db.jobs()) == 1
+
+
+def test_stage_transitions(db):
+    job, _ = db.add(URL)
+    db.start(job)
+
+    db.advance(job, JobState.EXTRACTED, manifest_url="https://cdn/m.mpd", license_url="https://l")
+    assert job.resume_stage() == JobState.EXTRACTED
+
+    db.advance(job, JobState.DOWNLOADED)
+    assert job.resume_stage() == JobState.DOWNLOADED
+
+    db.advance(job, JobState.MUXED)
+    assert job.done
+
+    stored = db.get(URL)
+    assert stored.state == JobState.MUXED
+    assert stored.manifest_url == "https://cdn/m.mpd"
+    assert stored.started_at <= stored.extracted_at <= stored.downloaded_at <= stored.muxed_at
+    assert [j.url for j in db.jobs(JobState.MUXED)] == [URL]
+
+
+def test_cannot_advance_to_pending_or_failed(db):
+    job, _ = db.add(URL)
+
+    for state in (JobState.PENDING, JobState.FAILED):
+        with pytest.raises(ValueError):
+            db.advance(job, state)
+
+
+def test_resume_after_a_crash(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+
+    with JobDB(path) as db:
+        job, _ = db.add(URL)
+        db.start(job)
+        db.advance(
+            job, JobState.EXTRACTED, manifest_url="https://cdn/m.mpd", license_url="https://l"
+        )
+        db.advance(job, JobState.DOWNLOADED)
+        db.fail(job, "MergeError: ffmpeg failed")
+
+    # A new process resumes after the last completed stage, despite the failure
+    with JobDB(path) as db:
+        job = db.get(URL)
+
+        assert job.state == JobState.FAILED
+        assert job.error == "MergeError: ffmpeg failed"
+        assert job.resume_stage() == JobState.DOWNLOADED
+
+        db.start(job)
+        assert (job.attempts, job.error) == (2, None)
+        assert db.get(URL).attempts == 2
+
+
+def test_extraction_without_license_is_not_resumed(db):
+    job, _ = db.add(URL)
+    db.advance(job, JobState.EXTRACTED, manifest_url="https://cdn/m.mpd")
+
+    assert db.get(URL).resume_stage() == JobState.PENDING
@@ -0,0 +1,182 @@
+import os
+
+import pytest
+import requests
+
+import live
+import mpdparse
+from config import Settings
+from defaults import DEFAULT_ENCRYPTED_AUDIO_FILENAME, DEFAULT_ENCRYPTED_VIDEO_FILENAME
+from errors import ManifestError
+
+MANIFEST = "https://live.example.com/channel/manifest.mpd"
+
+
+def manifest(timeline: str, dynamic: bool = True, streams=("video", "audio")) -> mpdparse.Catalog:
+    """A live manifest whose streams share `timeline`, in seconds."""
+    attributes = 'type="dynamic" minimumUpdatePeriod="PT2S"' if dynamic else 'type="static"'
+    template = (
+        '<SegmentTemplate timescale="1" initialization="$RepresentationID$/init.mp4" '
+        f'media="$RepresentationID$/$Time$.m4s"><SegmentTimeline>{timeline}</SegmentTimeline>'
+        "</SegmentTemplate>"
+    )
+    adaptations = "".join(
+        f'<AdaptationSet contentType="{s}" mimeType="{s}/mp4">{template}'
+        f'<Representation id="{s}" bandwidth="100000"/></AdaptationSet>'
+        for s in streams
+    )
+
+    return mpdparse.parse_catalog(
+        '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" '
+        f'{attributes}><Period id="1">{adaptations}</Period></MPD>'
+    )
+
+
+class Refreshes:
+    """Serves the manifest refreshes in order; an exception is raised instead."""
+
+    def __init__(self, catalogs):
+        self.catalogs = list(catalogs)
+        self.count = 0
+
+    def __call__(self, manifest, settings):
+        self.count += 1
+        catalog = self.catalogs.pop(0)
+
+        if isinstance(catalog, Exception):
+            raise catalog
+
+        return catalog
+
+
+@pytest.fixture
+def recorder(tmp_path, monkeypatch):
+    """Records into `tmp_path`, each segment holding its file name, without waiting."""
+    fetched = []
+
+    def fetch_segment(url, workdir, settings):
+        fetched.append(url)
+        path = os.path.join(workdir, f"{len(fetched)}.segment")
+
+        with open(path, "w") as f:
+            f.write(url.rsplit("/", 1)[-1] + "\n")
+
+        return path
+
+    monkeypatch.setattr(live, "fetch_segment", fetch_segment)
+    monkeypatch.setattr(live.time, "sleep", lambda seconds: None)
+
+    def record(first, refreshes=(), **settings):
+        monkeypatch.setattr(live, "fetch_catalog", Refreshes(refreshes))
+        result = live.record(MANIFEST, first, first.streams, str(tmp_path), Settings(**settings))
+
+        with open(tmp_path / DEFAULT_ENCRYPTED_VIDEO_FILENAME) as f:
+            video = f.read().split()
+
+        with open(tmp_path / DEFAULT_ENCRYPTED_AUDIO_FILENAME) as f:
+            assert f.read().split() == video
+
+        assert not list(tmp_path.glob("*.segment"))
+        return result, video
+
+    return record
+
+
+def test_new_segments_are_appended_once_as_the_window_slides(recorder):
+    # A 5 segment window moving 2 segments per refresh
+    first = manifest('<S t="0" d="2" r="4"/>')
+    refreshes = [
+        manifest('<S t="4" d="2" r="4"/>'),
+        manifest('<S t="8" d="2" r="4"/>'),
+        manifest('<S t="8" d="2" r="4"/>', dynamic=False),
+    ]
+
+    result, segments = recorder(first, refreshes, live_from_start=True)
+
+    assert segments == ["init.mp4"] + [f"{t}.m4s" for t in range(0, 18, 2)]
+    assert result == live.Recording(18, False)
+
+
+def test_open_ended_repeats(recorder):
+    first = manifest('<S t="0" d="2" r="-1"/><S t="6" d="3"/>')
+    refreshes = [
+        manifest('<S t="2" d="2" r="-1"/><S t="6" d="3" r="-1"/><S t="15" d="3"/>', dynamic=False)
+    ]
+
+    result, segments = recorder(first, refreshes, live_from_start=True)
+
+    assert segments == ["init.mp4"] + [f"{t}.m4s" for t in (0, 2, 4, 6, 9, 12, 15)]
+    assert result == live.Recording(18, False)
+
+
+def test_segments_that_left_the_window_are_skipped(recorder, caplog):
+    first = manifest('<S t="0" d="2" r="2"/>')
+    refreshes = [manifest('<S t="10" d="2" r="2"/>', dynamic=False)]
+
+    result, segments = recorder(first, refreshes, live_from_start=True)
+
+    assert segments == ["init.mp4"] + [f"{t}.m4s" for t in (0, 2, 4, 10, 12, 14)]
+    assert "lost 4.0 s that left the live window" in caplog.text
+
+
+def test_recording_starts_at_the_live_edge(recorder):
+    first = manifest('<S t="100" d="2" r="9"/>')
+    refreshes = [manifest('<S t="100" d="2" r="11"/>', dynamic=False)]
+
+    result, segments = recorder(first, refreshes)
+
+    assert segments == ["init.mp4"] + [f"{t}.m4s" for t in range(114, 124, 2)]
+    assert result.seconds == 10
+
+
+def test_recording_stops_after_the_requested_duration(recorder):
+    first = manifest('<S t="0" d="2" r="2"/>')
+    refreshes = [manifest('<S t="0" d="2" r="5"/>')]
+
+    result, segments = recorder(first, refreshes, live_from_start=True, live_duration=9)
+
+    assert segments == ["init.mp4"] + [f"{t}.m4s" for t in range(0, 10, 2)]
+    assert result == live.Recording(10, False)
+    assert live.fetch_catalog.count == 1
+
+
+def test_recording_stops_when_the_event_ends(recorder):
+    first = manifest('<S t="0" d="2" r="2"/>', dynamic=False)
+
+    result, segments = recorder(first, live_from_start=True)
+
+    assert len(segments) == 4
+    assert result == live.Recording(6, False)
+    assert live.fetch_catalog.count == 0
+
+
+def test_recording_stops_when_a_stream_leaves_the_manifest(recorder):
+    first = manifest('<S t="0" d="2" r="2"/>')
+    refreshes = [manifest('<S t="0" d="2" r="4"/>', streams=("video",))]
+
+    result, segments = recorder(first, refreshes, live_from_start=True)
+
+    assert segments == ["init.mp4", "0.m4s", "2.m4s", "4.m4s"]
+    assert result == live.Recording(6, True)
+
+
+@pytest.mark.parametrize(
+    "error", [requests.exceptions.ConnectionError("unreachable"), ManifestError("Not an MPD")]
+)
+def test_failed_refresh_keeps_what_was_recorded(recorder, error):
+    first = manifest('<S t="0" d="2" r="2"/>')
+    refreshes = [manifest('<S t="0" d="2" r="4"/>'), error]
+
+    result, segments = recorder(first, refreshes, live_from_start=True)
+
+    assert segments == ["init.mp4"] + [f"{t}.m4s" for t in range(0, 10, 2)]
+    assert result == live.Recording(10, True)
+
+
+def test_live_edge():
+    catalog = manifest('<S t="100" d="2" r="9"/>')
+
+    assert live.live_edge(catalog.streams[0]) == 114
+
+    with pytest.raises(ManifestError):
+        live.live_edge(manifest("").streams[0])
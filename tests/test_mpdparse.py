@@ -0,0 +1,142 @@
+import pytest
+
+import mpdparse
+from errors import ManifestError
+from scripts.bench_mpd import describe, synthetic_manifest
+
+pytest.importorskip("lxml")
+pytest.importorskip("mpegdash")
+
+PSSH = "AAAAW3Bzc2gAAAAA7e+LqXnWSs6jyCfc1R0h7QAAADsIARIQ"
+
+PROTECTION = (
+    '<ContentProtection schemeIdUri="urn:mpeg:dash:mp4protection:2011" value="cenc" '
+    'cenc:default_KID="00000000-0000-0000-0000-000000000001"/>'
+    '<ContentProtection schemeIdUri="urn:uuid:edef8ba9-79d6-4ace-a3c8-27dcd51d21ed">'
+    f"<cenc:pssh>{PSSH}</cenc:pssh></ContentProtection>"
+)
+
+
+def mpd(body: str, attributes: str = 'type="static" mediaPresentationDuration="PT1M0.5S"') -> str:
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" xmlns:cenc="urn:mpeg:cenc:2013" '
+        f"{attributes}>{body}</MPD>"
+    )
+
+
+# Templates on each Representation, with a padded $Number$ and BaseURLs at
+# every level, each relative to the one above
+REPRESENTATION_TEMPLATES = mpd(
+    "<BaseURL>https://cdn.example.com/event/</BaseURL>"
+    '<Period id="1"><BaseURL>period/</BaseURL>'
+    '<AdaptationSet contentType="video" mimeType="video/mp4" codecs="avc1.64001f">'
+    "<BaseURL>video/</BaseURL>"
+    '<Representation id="v1" bandwidth="800000" width="640" height="360" frameRate="25">'
+    f"<BaseURL>low/</BaseURL>{PROTECTION}"
+    '<SegmentTemplate timescale="1000" duration="4000" startNumber="0" '
+    'initialization="init.mp4" media="seg-$Number%05d$.m4s"/></Representation>'
+    '<Representation id="v2" bandwidth="2500000" width="1280" height="720" frameRate="25">'
+    f"<BaseURL>/absolute/high/</BaseURL>{PROTECTION}"
+    '<SegmentTemplate timescale="1000" duration="2000" '
+    'initialization="$RepresentationID$-init.mp4" media="$RepresentationID$-$Number$.m4s"/>'
+    "</Representation></AdaptationSet>"
+    '<AdaptationSet contentType="audio" mimeType="audio/mp4" lang="por">'
+    '<SegmentTemplate timescale="48000" duration="192000" media="a-$Number%03d$.m4s"/>'
+    '<Representation id="a1" bandwidth="96000" codecs="mp4a.40.2">'
+    '<SegmentTemplate initialization="a-init.mp4"/></Representation>'
+    "</AdaptationSet></Period>"
+)
+
+# A live timeline, shared by the representations of the set, whose last
+# entry repeats until the end of the presentation
+OPEN_ENDED_TIMELINE = mpd(
+    '<Period id="p0" start="PT0S"><BaseURL>https://live.example.com/channel/</BaseURL>'
+    '<AdaptationSet contentType="video" mimeType="video/mp4">'
+    '<SegmentTemplate timescale="90000" initialization="$RepresentationID$/init.mp4" '
+    'media="$RepresentationID$/$Time$.m4s" startNumber="100"><SegmentTimeline>'
+    '<S t="900000" d="180000" r="2"/><S d="179999"/><S d="180000" r="-1"/>'
+    "</SegmentTimeline></SegmentTemplate>"
+    '<Representation id="video=1" bandwidth="1000000" width="960" height="540"/>'
+    '<Representation id="video=2" bandwidth="3000000" width="1920" height="1080"/>'
+    "</AdaptationSet>"
+    '<AdaptationSet contentType="audio" mimeType="audio/mp4" lang="eng">'
+    '<SegmentTemplate timescale="48000" media="audio/$Number$.m4s" '
+    'initialization="audio/init.mp4" startNumber="100"><SegmentTimeline>'
+    '<S t="480000" d="96000" r="-1"/></SegmentTimeline></SegmentTemplate>'
+    '<Representation id="audio" bandwidth="128000"/></AdaptationSet></Period>',
+    'type="dynamic" minimumUpdatePeriod="PT2S" mediaPresentationDuration="PT40S"',
+)
+
+SUBTITLES = mpd(
+    '<Period id="1" duration="PT30S"><BaseURL>https://cdn.example.com/vod/</BaseURL>'
+    '<AdaptationSet contentType="video" mimeType="video/mp4">'
+    '<SegmentTemplate timescale="1" duration="6" media="v-$Number$.m4s" initialization="v.mp4"/>'
+    '<Representation id="v" bandwidth="1500000" width="1280" height="720"/></AdaptationSet>'
+    '<AdaptationSet contentType="text" mimeType="text/vtt" lang="por">'
+    '<Representation id="sub-por" bandwidth="256">'
+    "<BaseURL>subtitles/por.vtt</BaseURL></Representation></AdaptationSet>"
+    '<AdaptationSet mimeType="application/ttml+xml" lang="eng">'
+    '<Representation id="sub-eng" bandwidth="256">'
+    "<BaseURL>https://subs.example.com/eng.ttml</BaseURL></Representation></AdaptationSet>"
+    '<AdaptationSet contentType="image" mimeType="image/jpeg">'
+    '<Representation id="thumbnails" bandwidth="10000"/></AdaptationSet>'
+    "</Period>",
+    'type="static"',
+)
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        REPRESENTATION_TEMPLATES,
+        OPEN_ENDED_TIMELINE,
+        SUBTITLES,
+        synthetic_manifest(0.05),
+    ],
+    ids=["representation-templates", "open-ended-timeline", "subtitles", "synthetic"],
+)
+def test_both_parsers_build_the_same_catalog(source):
+    expected = mpdparse.parse_catalog_mpegdash(source)
+    catalog = mpdparse.parse_catalog(source)
+
+    assert describe(catalog) == describe(expected)
+
+
+def test_catalog_of_representation_templates():
+    catalog = mpdparse.parse_catalog(REPRESENTATION_TEMPLATES)
+    low, high, audio = catalog.streams
+
+    assert low.segments.base_url == "https://cdn.example.com/event/period/video/low/"
+    assert low.segments.media == "seg-$Number%05d$.m4s"
+    assert high.segments.base_url == "https://cdn.example.com/absolute/high/"
+    assert (audio.segments.media, audio.segments.initialization) == (
+        "a-$Number%03d$.m4s",
+        "a-init.mp4",
+    )
+    assert [p.pssh[0].pssh for p in low.content_protections if p.pssh] == [PSSH]
+
+
+def test_catalog_of_a_live_manifest():
+    catalog = mpdparse.parse_catalog(OPEN_ENDED_TIMELINE)
+    first, second, audio = catalog.streams
+
+    assert (catalog.dynamic, catalog.update_period, catalog.duration) == (True, 2, 40)
+    assert first.segments.timeline is second.segments.timeline
+    assert audio.segments.timeline == [(480000, 96000, -1)]
+
+
+def test_catalog_of_subtitles():
+    catalog = mpdparse.parse_catalog(SUBTITLES)
+
+    assert catalog.duration == 30
+    assert [(s.id, s.language, s.subtitle_urls) for s in catalog.streams[1:]] == [
+        ("sub-por", "por", ["subtitles/por.vtt"]),
+        ("sub-eng", "eng", ["https://subs.example.com/eng.ttml"]),
+    ]
+
+
+@pytest.mark.parametrize("source", ["<MPD", "<html></html>", mpd("<Period/><Period/>")])
+def test_invalid_manifests(source):
+    with pytest.raises(ManifestError):
+        mpdparse.parse_catalog(source)
@@ -0,0 +1,98 @@
+import pytest
+
+import progress
+from progress import DONE, DOWNLOADING, FAILED, QUEUED, RESOLVING, BatchProgress
+
+MiB = 1024 * 1024
+
+
+def finish(tracker, key, stage, nbytes=0):
+    tracker.add(key, f"https://opto.sic.pt/videos/{key}")
+    tracker.stage(RESOLVING, key)
+    tracker.jobs[key].bytes = nbytes
+    tracker.stage(stage, key)
+
+
+def test_finished_jobs_are_only_counted():
+    tracker = BatchProgress()
+
+    for i in range(1000):
+        finish(tracker, f"job{i}", DONE if i % 4 else FAILED, MiB)
+
+    tracker.add("running", "https://opto.sic.pt/videos/running")
+    tracker.stage(RESOLVING, "running")
+    tracker.add("queued", "https://opto.sic.pt/videos/queued")
+
+    assert set(tracker.jobs) == {"running", "queued"}
+    assert tracker.counts() == {DONE: 750, FAILED: 250, RESOLVING: 1, QUEUED: 1}
+    assert tracker.total == 1002
+
+    summary = tracker.summary()
+    assert (summary["done"], summary["failed"], summary["active"]) == (750, 250, 1)
+    assert summary["bottleneck"] == "browser"
+
+
+def test_stage_of_an_unknown_or_finished_job_is_ignored():
+    tracker = BatchProgress()
+    finish(tracker, "a", DONE)
+
+    tracker.stage(FAILED, "a")
+    tracker.stage(DOWNLOADING, "nope")
+
+    assert tracker.counts() == {DONE: 1}
+
+
+def test_eta_uses_the_average_size_of_finished_downloads():
+    tracker = BatchProgress()
+
+    finish(tracker, "a", DONE, 100 * MiB)
+    finish(tracker, "b", DONE, 300 * MiB)
+    finish(tracker, "c", FAILED)
+
+    tracker.add("d", "https://opto.sic.pt/videos/d")
+    tracker.stage(DOWNLOADING, "d")
+    tracker.expect(150 * MiB, "d")
+    tracker.jobs["d"].bytes = 50 * MiB
+
+    for _ in range(2):
+        tracker.skip()
+
+    tracker.rate = 10 * MiB
+    assert tracker.eta() is None
+
+    # 100 MiB left for d, and 5 URLs still queued at 200 MiB each
+    tracker.total += 5
+    tracker.close_input()
+    assert tracker.eta() == pytest.approx((100 + 5 * 200) / 10)
+
+
+def test_eta_before_any_download_finished():
+    tracker = BatchProgress()
+
+    tracker.add("a", "https://opto.sic.pt/videos/a")
+    tracker.stage(DOWNLOADING, "a")
+    tracker.expect(80 * MiB, "a")
+    tracker.add("b", "https://opto.sic.pt/videos/b")
+    tracker.close_input()
+    tracker.rate = 8 * MiB
+
+    assert tracker.eta() == pytest.approx((80 + 80) / 8)
+
+
+def test_finished_bytes_keep_counting_in_the_rate(tmp_path, monkeypatch):
+    clock = iter(range(0, 1000, 10))
+    monkeypatch.setattr(progress.time, "monotonic", lambda: next(clock))
+    workdir = tmp_path / "a"
+    workdir.mkdir()
+
+    tracker = BatchProgress()
+    tracker.add("a", "https://opto.sic.pt/videos/a", str(workdir))
+    tracker.stage(DOWNLOADING, "a")
+    tracker.sample()
+
+    (workdir / "video.mp4").write_bytes(bytes(1000))
+    tracker.stage(DONE, "a")
+    tracker.sample()
+
+    assert tracker.bytes == 1000
+    assert tracker.rate == pytest.approx(1000 / 10)
@@ -0,0 +1,166 @@
+import email.utils
+import subprocess
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+import retry
+from retry import RetryPolicy, TransientError, classify, in_job, retry_after
+
+
+def http_error(status, retry_after=None):
+    response = requests.Response()
+    response.status_code = status
+
+    if retry_after is not None:
+        response.headers["Retry-After"] = retry_after
+
+    return requests.exceptions.HTTPError(f"{status} error", response=response)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(retry.time, "sleep", sleeps.append)
+    return sleeps
+
+
+@pytest.mark.parametrize(
+    "error, error_class",
+    [
+        (TransientError("no manifest yet"), "transient"),
+        (requests.exceptions.ReadTimeout(), "timeout"),
+        (subprocess.TimeoutExpired("ffmpeg", 10), "timeout"),
+        (requests.exceptions.ConnectionError(), "connection"),
+        (ConnectionResetError(), "connection"),
+        (http_error(429), "throttled"),
+        (http_error(408), "timeout"),
+        (http_error(503), "server"),
+        (http_error(404), "client"),
+        (subprocess.CalledProcessError(1, "yt-dlp", stderr="ERROR: HTTP Error 502"), "server"),
+        (subprocess.CalledProcessError(1, "yt-dlp", stderr="ERROR: HTTP Error 403"), "client"),
+        (subprocess.CalledProcessError(1, "ffmpeg", stderr="Invalid data"), "process"),
+        (requests.exceptions.TooManyRedirects(), "connection"),
+        (ValueError("bug"), "other"),
+    ],
+)
+def test_classify(error, error_class):
+    assert classify(error) == error_class
+
+
+def test_retry_after():
+    assert retry_after(http_error(429, "7")) == 7
+    assert retry_after(http_error(429, "-3")) == 0
+    assert retry_after(http_error(429)) is None
+    assert retry_after(http_error(429, "soon")) is None
+    assert retry_after(ValueError()) is None
+
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert retry_after(http_error(503, date)) == pytest.approx(30, abs=2)
+
+
+def test_delay_grows_and_honours_retry_after():
+    policy = RetryPolicy(base_delay=1, max_delay=60, multiplier=2, jitter=0)
+
+    assert [policy.delay(http_error(503), n) for n in (1, 2, 3)] == [1, 2, 4]
+    assert policy.delay(http_error(503, "20"), 1) == 20
+
+    # Only throttling and server errors may ask for a delay
+    assert policy.delay(requests.exceptions.ConnectionError(), 1) == 1
+
+    # Longer than the policy allows: give up rather than hold the job slot
+    assert policy.delay(http_error(429, "600"), 1) is None
+
+
+def test_call_retries_by_error_class(sleeps):
+    policy = RetryPolicy(max_attempts=3, jitter=0)
+    failures = [requests.exceptions.ConnectionError(), http_error(502)]
+
+    def flaky():
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    assert policy.call(flaky) == "ok"
+    assert len(sleeps) == 2
+
+    calls = []
+
+    def not_found():
+        calls.append(1)
+        raise http_error(404)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        policy.call(not_found)
+    assert len(calls) == 1
+
+
+def test_call_gives_up_after_max_attempts(sleeps):
+    policy = RetryPolicy(rules={"connection": {"max_attempts": 2}})
+    calls = []
+
+    def down():
+        calls.append(1)
+        raise requests.exceptions.ConnectionError()
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        policy.call(down)
+
+    assert len(calls) == 2
+
+
+def test_unknown_rules_are_rejected():
+    with pytest.raises(ValueError):
+        RetryPolicy(rules={"flaky": {"max_attempts": 2}})
+
+
+def test_job_budget_is_shared_by_worker_threads(sleeps):
+    policy = RetryPolicy(max_attempts=10, budget=3)
+    calls = []
+
+    def down(_):
+        calls.append(1)
+        raise requests.exceptions.ConnectionError()
+
+    def fetch(i):
+        try:
+            policy.call(down, i)
+        except requests.exceptions.ConnectionError:
+            pass
+
+    with policy.job() as budget:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(in_job(fetch), range(4)))
+
+    # 3 retries in all, plus the first attempt of each fetch
+    assert budget.spent == 3
+    assert len(calls) == 4 + 3
+
+
+def test_threads_outside_the_job_have_no_budget(sleeps):
+    policy = RetryPolicy(max_attempts=3, budget=1)
+    failures = [requests.exceptions.ConnectionError()] * 2
+
+    def flaky():
+        if failures:
+            raise failures.pop()
+        return "ok"
+
+    with policy.job():
+        # Not wrapped in in_job: the worker thread does not see the budget
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            assert executor.submit(policy.call, flaky).result() == "ok"
+
+
+def test_nested_jobs_share_the_outer_budget():
+    policy = RetryPolicy(budget=5)
+
+    with policy.job() as outer:
+        with policy.job() as inner:
+            assert inner is outer
+
+    with policy.job() as other:
+        assert other is not outer
@@ -0,0 +1,210 @@
+import threading
+import time
+
+import pytest
+
+from intake import Request
+from jobdb import Job, JobState
+from scheduler import URGENT_WINDOW, Scheduler
+
+
+def put(scheduler, url, priority=0, deadline=None, source="default", manifest_url=None):
+    state = JobState.PENDING if manifest_url is None else JobState.EXTRACTED
+    job = Job(url, state, "out.mp4", manifest_url)
+    scheduler.put(job, Request(url, priority, deadline, source))
+
+
+def blocked(target, *args) -> threading.Thread:
+    """Runs `target` in a thread, checking that it blocks."""
+    thread = threading.Thread(target=target, args=args)
+    thread.start()
+    thread.join(0.1)
+    assert thread.is_alive()
+    return thread
+
+
+def drain(scheduler):
+    """URLs in the order the scheduler hands them out, each finishing before the next."""
+    scheduler.close()
+    order = []
+
+    while (entry := scheduler.get()) is not None:
+        order.append(entry.job.url)
+        scheduler.done(entry)
+
+    return order
+
+
+def test_input_order_by_default():
+    scheduler = Scheduler()
+    urls = [f"https://a.com/{i}" for i in range(5)]
+
+    for url in urls:
+        put(scheduler, url)
+
+    assert drain(scheduler) == urls
+
+
+def test_priority_then_deadline():
+    scheduler = Scheduler()
+    later = time.time() + 10 * URGENT_WINDOW
+
+    put(scheduler, "https://a.com/low", priority=-10)
+    put(scheduler, "https://a.com/normal")
+    put(scheduler, "https://a.com/high-late", priority=10, deadline=later + 60)
+    put(scheduler, "https://a.com/high-early", priority=10, deadline=later)
+
+    assert drain(scheduler) == [
+        "https://a.com/high-early",
+        "https://a.com/high-late",
+        "https://a.com/normal",
+        "https://a.com/low",
+    ]
+
+
+def test_urgent_deadlines_go_first_earliest_first():
+    scheduler = Scheduler()
+    now = time.time()
+
+    put(scheduler, "https://a.com/high", priority=20)
+    put(scheduler, "https://a.com/soon", priority=-10, deadline=now + URGENT_WINDOW / 2)
+    put(scheduler, "https://a.com/overdue", priority=-10, deadline=now - 60)
+    put(scheduler, "https://a.com/far", priority=-10, deadline=now + 10 * URGENT_WINDOW)
+
+    assert drain(scheduler) == [
+        "https://a.com/overdue",
+        "https://a.com/soon",
+        "https://a.com/high",
+        "https://a.com/far",
+    ]
+
+
+def test_sources_share_the_workers():
+    scheduler = Scheduler()
+
+    for i in range(3):
+        put(scheduler, f"https://a.com/big/{i}", source="big")
+
+    put(scheduler, "https://a.com/small/0", source="small")
+
+    first = scheduler.get()
+    second = scheduler.get()
+
+    # The small source gets a worker while the big one already has one running
+    assert (first.source, second.source) == ("big", "small")
+
+
+def test_least_recently_served_source_wins_ties():
+    scheduler = Scheduler()
+
+    for i in range(2):
+        put(scheduler, f"https://a.com/x/{i}", source="x")
+        put(scheduler, f"https://a.com/y/{i}", source="y")
+
+    put(scheduler, "https://a.com/x/2", source="x")
+
+    assert [url.split("/")[3] for url in drain(scheduler)] == ["x", "y", "x", "y", "x"]
+
+
+def test_host_limit_holds_resumed_jobs_until_one_ends():
+    scheduler = Scheduler(host_limit=1)
+
+    put(scheduler, "https://opto.sic.pt/videos/1", manifest_url="https://a.com/1/manifest.mpd")
+    put(scheduler, "https://opto.sic.pt/videos/2", manifest_url="https://a.com/2/manifest.mpd")
+    put(scheduler, "https://opto.sic.pt/videos/3", manifest_url="https://b.com/3/manifest.mpd")
+
+    first = scheduler.get()
+    second = scheduler.get()
+    assert (first.host, second.host) == ("a.com", "b.com")
+
+    got = []
+    thread = blocked(lambda: got.append(scheduler.get()))
+
+    scheduler.done(first)
+    thread.join(1)
+    assert got[0].job.url == "https://opto.sic.pt/videos/2"
+
+
+def test_pages_of_one_site_are_capped_on_their_manifest_host():
+    scheduler = Scheduler(host_limit=1)
+    pages = [f"https://opto.sic.pt/videos/episode-{i}" for i in range(3)]
+
+    for page in pages:
+        put(scheduler, page)
+
+    # Every page is on the same site: none of them is held back before resolution
+    first, second, third = (scheduler.get() for _ in pages)
+
+    scheduler.admit(first, "https://cdn-a.example.com/1/manifest.mpd")
+    scheduler.admit(third, "https://cdn-b.example.com/3/manifest.mpd")
+    assert (first.host, third.host) == ("cdn-a.example.com", "cdn-b.example.com")
+
+    thread = blocked(scheduler.admit, second, "https://cdn-a.example.com/2/manifest.mpd")
+
+    scheduler.done(first)
+    thread.join(1)
+    assert second.host == "cdn-a.example.com"
+
+    for entry in (second, third):
+        scheduler.done(entry)
+
+    assert scheduler._running_hosts == {"cdn-a.example.com": 0, "cdn-b.example.com": 0}
+
+
+def test_pending_jobs_of_a_full_host_are_skipped():
+    scheduler = Scheduler(host_limit=1)
+    now = time.time()
+
+    put(scheduler, "https://opto.sic.pt/videos/1", manifest_url="https://a.com/1.mpd")
+    put(scheduler, "https://opto.sic.pt/videos/2", manifest_url="https://a.com/2.mpd", deadline=now)
+    put(scheduler, "https://opto.sic.pt/videos/3", priority=-10)
+
+    running = scheduler.get()
+    assert running.job.url == "https://opto.sic.pt/videos/2"
+    assert scheduler.get().job.url == "https://opto.sic.pt/videos/3"
+
+    scheduler.done(running)
+    assert drain(scheduler) == ["https://opto.sic.pt/videos/1"]
+
+
+def test_large_window_keeps_the_order():
+    scheduler = Scheduler(window=10000)
+    now = time.time()
+
+    for i in range(3000):
+        put(
+            scheduler,
+            f"https://a.com/{i}",
+            priority=i % 3,
+            deadline=now + (i % 7) * URGENT_WINDOW,
+            source=f"s{i % 5}",
+        )
+
+    order = drain(scheduler)
+
+    assert len(order) == len(set(order)) == 3000
+
+    # Urgent jobs first (deadline now), then the rest by priority
+    first = [int(url.rsplit("/", 1)[1]) for url in order]
+    urgent = [i for i in first if i % 7 in (0, 1)]
+    assert first[: len(urgent)] == urgent
+    priorities = [i % 3 for i in first[len(urgent) :]]
+    assert priorities == sorted(priorities, reverse=True)
+
+
+def test_window_blocks_the_feeder():
+    scheduler = Scheduler(window=1)
+    put(scheduler, "https://a.com/1")
+
+    thread = blocked(put, scheduler, "https://a.com/2")
+
+    scheduler.done(scheduler.get())
+    thread.join(1)
+    assert not thread.is_alive()
+    assert drain(scheduler) == ["https://a.com/2"]
+
+
+@pytest.mark.parametrize("arguments", [{"host_limit": 0}, {"window": 0}])
+def test_invalid_limits(arguments):
+    with pytest.raises(ValueError):
+        Scheduler(**arguments)
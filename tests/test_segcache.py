@@ -0,0 +1,109 @@
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import segcache
+
+from segcache import SegmentCache, cache_key, fetch_ahead
+
+
+def test_cache_key_drops_volatile_parameters():
+    assert cache_key("https://CDN.example.com/a.m4s?token=1&b=2&exp=3") == cache_key(
+        "https://cdn.example.com/a.m4s?b=2&token=9"
+    )
+    assert cache_key("https://cdn.example.com/a.m4s?b=2") != cache_key(
+        "https://cdn.example.com/a.m4s?b=3"
+    )
+
+
+def test_cache_key_keeps_generic_parameters_of_unknown_hosts(monkeypatch):
+    assert cache_key("https://cdn.example.com/a.m4s?e=1") != cache_key(
+        "https://cdn.example.com/a.m4s?e=2"
+    )
+
+    monkeypatch.setattr(segcache, "HOST_VOLATILE_PARAMS", {"example.com": {"e", "st"}})
+
+    assert cache_key("https://cdn.example.com/a.m4s?e=1&st=2") == cache_key(
+        "https://cdn.example.com/a.m4s?e=3"
+    )
+    assert cache_key("https://example.org/a.m4s?e=1") != cache_key("https://example.org/a.m4s")
+    assert cache_key("https://badexample.com/a.m4s?e=1") != cache_key(
+        "https://badexample.com/a.m4s"
+    )
+
+
+def fake_download(contents: dict):
+    def download(url, path, settings=None):
+        if url not in contents:
+            return False
+
+        with open(path, "wb") as f:
+            f.write(contents[url])
+
+        return True
+
+    return download
+
+
+def test_fetch_hits_after_a_miss(tmp_path, monkeypatch):
+    monkeypatch.setattr(segcache, "download_file", fake_download({"https://a/1": b"one"}))
+    cache = SegmentCache(str(tmp_path))
+
+    first = cache.fetch("https://a/1")
+    second = cache.fetch("https://a/1?token=x")
+
+    assert first == second
+    assert open(first, "rb").read() == b"one"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_failed_fetch_leaves_no_part_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(segcache, "download_file", fake_download({}))
+    cache = SegmentCache(str(tmp_path))
+
+    assert cache.fetch("https://a/missing") is None
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+
+
+def test_eviction_keeps_the_cache_under_its_limit(tmp_path, monkeypatch):
+    contents = {f"https://a/{i}": bytes(100) for i in range(5)}
+    monkeypatch.setattr(segcache, "download_file", fake_download(contents))
+    cache = SegmentCache(str(tmp_path), max_bytes=250)
+
+    for url in contents:
+        cache.fetch(url)
+
+    assert cache._count() <= 250
+    assert cache.lookup(cache_key("https://a/4")) is not None
+    assert cache.lookup(cache_key("https://a/0")) is None
+
+
+def test_concurrent_fetches_count_every_hit(tmp_path, monkeypatch):
+    monkeypatch.setattr(segcache, "download_file", fake_download({"https://a/1": b"one"}))
+    cache = SegmentCache(str(tmp_path))
+    cache.fetch("https://a/1")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: cache.fetch("https://a/1"), range(400)))
+
+    assert (cache.hits, cache.misses) == (400, 1)
+
+
+def test_fetch_ahead_keeps_order_and_bounds_the_lookahead():
+    started = []
+    lock = threading.Lock()
+
+    def fetch(url):
+        with lock:
+            started.append(url)
+        return url.upper()
+
+    urls = [f"u{i}" for i in range(50)]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for consumed, result in enumerate(fetch_ahead(executor, fetch, urls, 3)):
+            assert result == urls[consumed].upper()
+
+            with lock:
+                assert len(started) <= consumed + 4
@@ -0,0 +1,66 @@
+import pytest
+
+from segments import SegmentInfo, fill_template, initialization_url, media_segments
+from segments import timeline_entries
+
+MANIFEST_URL = "https://cdn.example.com/event/manifest.mpd"
+
+
+def test_fill_template_with_width_and_escaped_dollar():
+    template = "$RepresentationID$/$Number%05d$-$$.m4s"
+
+    assert fill_template(template, "video=1", 100, number=42) == "video=1/00042-$.m4s"
+
+
+def test_fill_template_without_value():
+    with pytest.raises(ValueError):
+        fill_template("$Time$.m4s", "video", 100)
+
+
+def test_number_template():
+    info = SegmentInfo("", "seg-$Number$.m4s", "init.mp4", 1, 5, 4, None, 10.0)
+
+    segments = media_segments(info, "video", 100, MANIFEST_URL)
+
+    assert [s.number for s in segments] == [5, 6, 7]
+    assert [s.time for s in segments] == [0, 4, 8]
+    assert segments[0].url == "https://cdn.example.com/event/seg-5.m4s"
+
+
+def test_number_template_without_duration():
+    info = SegmentInfo("", "seg-$Number$.m4s", None, 1, 1, 4, None, None)
+
+    assert media_segments(info, "video", 100, MANIFEST_URL) == []
+
+
+def test_timeline_repeats_and_explicit_times():
+    info = SegmentInfo("", "$Time$.m4s", None, 10, 1, None, [(100, 20, 2), (None, 30, 0)])
+
+    assert timeline_entries(info) == [(100, 20), (120, 20), (140, 20), (160, 30)]
+
+
+def test_open_ended_repeat_uses_the_next_entry():
+    info = SegmentInfo("", "$Time$.m4s", None, 1, 1, None, [(0, 2, -1), (10, 5, 0)])
+
+    assert timeline_entries(info) == [(0, 2), (2, 2), (4, 2), (6, 2), (8, 2), (10, 5)]
+
+
+def test_open_ended_repeat_uses_the_presentation_duration():
+    info = SegmentInfo("", "$Time$.m4s", None, 1, 1, None, [(0, 4, -1)], 10.0)
+
+    assert timeline_entries(info) == [(0, 4), (4, 4), (8, 4)]
+
+
+def test_timeline_segments_and_base_url():
+    info = SegmentInfo("media/", "$Number$-$Time$.m4s", "init.mp4", 1, 3, None, [(0, 2, 1)])
+
+    segments = media_segments(info, "audio", 100, MANIFEST_URL)
+
+    assert [s.url for s in segments] == [
+        "https://cdn.example.com/event/media/3-0.m4s",
+        "https://cdn.example.com/event/media/4-2.m4s",
+    ]
+    assert (
+        initialization_url(info, "audio", 100, MANIFEST_URL)
+        == "https://cdn.example.com/event/media/init.mp4"
+    )
@@ -0,0 +1,150 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from config import Settings
+from errors import MergeError, MissingDependencyError
+from stream import container_for, merge_streams, subtitle_codec
+from subtitles import SubtitleTrack
+
+# Stands in for ffmpeg: writes its arguments as JSON to the output given last
+# (a file, stdout or an inherited descriptor), or fails when told to
+FAKE_FFMPEG = """#!{python}
+import json, os, sys
+
+with open(os.path.join(os.path.dirname(__file__), "calls"), "a") as f:
+    f.write("x")
+
+if os.environ.get("FAKE_FFMPEG_FAIL"):
+    sys.stderr.write("Stream #0:0: some detail\\nInvalid data found when processing input\\n")
+    sys.exit(1)
+
+output = sys.argv[-1]
+data = json.dumps(sys.argv[1:]).encode()
+
+if output.startswith("pipe:"):
+    os.write(int(output[len("pipe:"):]), data)
+else:
+    with open(output, "wb") as f:
+        f.write(data)
+"""
+
+
+@pytest.fixture
+def ffmpeg(tmp_path):
+    path = tmp_path / "bin" / "ffmpeg"
+    path.parent.mkdir()
+    path.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    path.chmod(0o755)
+    return path
+
+
+def calls(ffmpeg) -> int:
+    path = ffmpeg.parent / "calls"
+    return len(path.read_text()) if path.exists() else 0
+
+
+@pytest.mark.parametrize(
+    "output, container, expected",
+    [
+        ("out.mp4", None, "mp4"),
+        ("OUT.MKV", None, "mkv"),
+        ("out.webm", None, None),
+        ("-", None, "fmp4"),
+        ("pipe:3", None, "fmp4"),
+        ("out.mp4", "faststart", "faststart"),
+        ("-", "mkv", "mkv"),
+    ],
+)
+def test_container_for(output, container, expected):
+    assert container_for(output, container) == expected
+
+
+@pytest.mark.parametrize(
+    "output, container", [("out.mp4", "avi"), ("-", "mp4"), ("-", "faststart")]
+)
+def test_invalid_containers(output, container):
+    with pytest.raises(ValueError):
+        container_for(output, container)
+
+
+def test_subtitle_codec():
+    assert subtitle_codec("out.mkv") == "srt"
+    assert subtitle_codec("-", "mkv") == "srt"
+    assert subtitle_codec("out.webm") == "webvtt"
+    assert subtitle_codec("out.mp4") == "mov_text"
+
+
+def test_merge_to_a_file(tmp_path, ffmpeg):
+    output = str(tmp_path / "out.mkv")
+    tracks = [SubtitleTrack(str(tmp_path / "subtitles.0.por.srt"), "por")]
+
+    assert merge_streams(output, str(tmp_path), tracks, Settings(ffmpeg=str(ffmpeg))) == output
+
+    args = json.loads(open(output).read())
+    assert args[-3:] == ["-f", "matroska", output]
+    assert ["-c:s", "srt"] == args[args.index("-c:s") : args.index("-c:s") + 2]
+    assert "language=por" in args
+    assert args.count("-map") == 3
+
+
+def test_merge_in_the_configured_container(tmp_path, ffmpeg):
+    output = str(tmp_path / "out.mp4")
+
+    merge_streams(output, str(tmp_path), [], Settings(ffmpeg=str(ffmpeg), container="faststart"))
+
+    args = json.loads(open(output).read())
+    assert args[-5:] == ["-f", "mp4", "-movflags", "+faststart", output]
+
+
+def test_merge_to_an_inherited_pipe(tmp_path, ffmpeg):
+    read, write = os.pipe()
+
+    try:
+        merge_streams(f"pipe:{write}", str(tmp_path), [], Settings(ffmpeg=str(ffmpeg)))
+    finally:
+        os.close(write)
+
+    with os.fdopen(read, "rb") as f:
+        args = json.loads(f.read())
+
+    assert args[-1] == f"pipe:{write}"
+    assert "+frag_keyframe+empty_moov+default_base_moof" in args
+
+
+def test_merge_to_stdout(tmp_path, ffmpeg):
+    script = (
+        "import sys; sys.path.insert(0, sys.argv[1]);"
+        "from config import Settings; from stream import merge_streams;"
+        "merge_streams('-', sys.argv[2], [], Settings(ffmpeg=sys.argv[3]))"
+    )
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    result = subprocess.run(
+        [sys.executable, "-c", script, repo, str(tmp_path), str(ffmpeg)],
+        capture_output=True,
+        check=True,
+    )
+
+    assert json.loads(result.stdout)[-1] == "pipe:1"
+
+
+@pytest.mark.parametrize("output", ["out.mp4", "pipe:1"])
+def test_failed_merge_is_not_retried(tmp_path, ffmpeg, monkeypatch, output):
+    monkeypatch.setenv("FAKE_FFMPEG_FAIL", "1")
+
+    if output != "pipe:1":
+        output = str(tmp_path / output)
+
+    with pytest.raises(MergeError, match="Invalid data found when processing input"):
+        merge_streams(output, str(tmp_path), [], Settings(ffmpeg=str(ffmpeg)))
+
+    assert calls(ffmpeg) == 1
+
+
+def test_missing_ffmpeg(tmp_path):
+    with pytest.raises(MissingDependencyError):
+        merge_streams("out.mp4", str(tmp_path), [], Settings(ffmpeg=str(tmp_path / "nope")))
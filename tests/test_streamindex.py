@@ -0,0 +1,85 @@
+import pytest
+
+from stream import Stream, StreamType
+from streamindex import StreamIndex, parse_selector
+
+
+def video(stream_id, width, height, bandwidth, codecs="avc1.64001f"):
+    return Stream(
+        stream_id, StreamType.VIDEO, bandwidth, width, height, 25, [], None, codecs=codecs
+    )
+
+
+def audio(stream_id, bandwidth, language):
+    return Stream(
+        stream_id, StreamType.AUDIO, bandwidth, None, None, None, [], None, language=language
+    )
+
+
+@pytest.fixture
+def index():
+    return StreamIndex(
+        [
+            video("video_1", 640, 360, 800000),
+            video("video_2", 1280, 720, 2500000),
+            video("hd_video_1", 1920, 1080, 5000000, codecs="hvc1.1.6.L120"),
+            audio("audio_por", 96000, "por"),
+            audio("audio_eng", 128000, "en"),
+        ]
+    )
+
+
+def test_glob_matches_whole_ids():
+    selector = parse_selector("video_*")
+
+    assert selector.glob
+    assert selector.matches_id("video_1")
+    assert not selector.matches_id("hd_video_1")
+
+
+def test_regex_is_searched():
+    selector = parse_selector("/video_/")
+
+    assert not selector.glob
+    assert selector.matches_id("hd_video_1")
+    assert not parse_selector("/^video_/").matches_id("hd_video_1")
+
+
+def test_stream_type_prefix_and_conditions():
+    selector = parse_selector("video:height<=720,codecs=avc1*")
+
+    assert selector.stream_type == StreamType.VIDEO
+    assert [c.attribute for c in selector.conditions] == ["height", "codecs"]
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["", "  ", "/(/", "height<=big", "lang<por"],
+    ids=["empty", "blank", "regex", "number", "op"],
+)
+def test_invalid_selectors(text):
+    with pytest.raises(ValueError):
+        parse_selector(text)
+
+
+def test_exact_id_is_always_honoured(index):
+    assert index.select("audio_eng", StreamType.VIDEO).id == "audio_eng"
+
+
+def test_glob_selects_the_best_anchored_match(index):
+    assert index.select("video_*", StreamType.VIDEO).id == "video_2"
+
+
+def test_conditions_select_the_best_match(index):
+    assert index.select("height<=720", StreamType.VIDEO).id == "video_2"
+    assert index.select("codecs=hvc1*", StreamType.VIDEO).id == "hd_video_1"
+    assert index.select("height>2000", StreamType.VIDEO) is None
+
+
+def test_type_of_the_selector_overrides_the_requested_one(index):
+    assert index.select("audio", StreamType.VIDEO).id == "audio_eng"
+
+
+def test_language_matches_tags(index):
+    assert index.select("lang=eng", StreamType.AUDIO).id == "audio_eng"
+    assert index.select("lang!=por", StreamType.AUDIO).id == "audio_eng"
@@ -0,0 +1,84 @@
+import struct
+
+import pytest
+
+from subtitles import Cue, convert, find_tracks, language_tag, parse_ttml_time, track_path
+from subtitles import ttml_to_cues
+
+TTML = """<?xml version="1.0" encoding="utf-8"?>
+<tt xmlns="http://www.w3.org/ns/ttml" xmlns:ttp="http://www.w3.org/ns/ttml#parameter"
+    ttp:tickRate="10000000">
+  <body><div>
+    <p begin="00:00:01.500" end="00:00:03.000">Olá<br/>mundo</p>
+    <p begin="40000000t" dur="10000000t">Segunda <span>linha</span></p>
+  </div></body>
+</tt>"""
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+@pytest.mark.parametrize(
+    "value, seconds",
+    [("00:01:02.5", 62.5), ("00:00:01:15", 1.5), ("1.5s", 1.5), ("250ms", 0.25), ("2m", 120)],
+)
+def test_parse_ttml_time(value, seconds):
+    assert parse_ttml_time(value, frame_rate=30) == pytest.approx(seconds)
+
+
+def test_ttml_cues_with_line_breaks_and_ticks():
+    assert ttml_to_cues(TTML) == [
+        Cue(1.5, 3.0, "Olá\nmundo"),
+        Cue(4.0, 5.0, "Segunda linha"),
+    ]
+
+
+def test_ttml_to_srt(tmp_path):
+    source = tmp_path / "raw"
+    source.write_text(TTML, encoding="utf-8")
+
+    convert(str(source), str(tmp_path / "out.srt"), "srt")
+
+    assert (tmp_path / "out.srt").read_text(encoding="utf-8") == (
+        "1\n00:00:01,500 --> 00:00:03,000\nOlá\nmundo\n\n"
+        "2\n00:00:04,000 --> 00:00:05,000\nSegunda linha\n"
+    )
+
+
+def test_stpp_segments_to_webvtt(tmp_path):
+    # Two fragments, the later one first, each with its TTML document in mdat
+    later = TTML.replace("00:00:01.500", "00:00:11.500").replace("00:00:03.000", "00:00:13.000")
+    data = b"".join(
+        box(b"moof", b"") + box(b"mdat", document.encode("utf-8")) for document in (later, TTML)
+    )
+    source = tmp_path / "raw"
+    source.write_bytes(box(b"ftyp", b"isom") + data)
+
+    convert(str(source), str(tmp_path / "out.vtt"), "vtt")
+
+    lines = (tmp_path / "out.vtt").read_text(encoding="utf-8").splitlines()
+    assert lines[0] == "WEBVTT"
+    assert [line for line in lines if "-->" in line][:2] == [
+        "00:00:01.500 --> 00:00:03.000",
+        "00:00:04.000 --> 00:00:05.000",
+    ]
+
+
+def test_unsupported_format(tmp_path):
+    with pytest.raises(ValueError):
+        convert(str(tmp_path / "raw"), str(tmp_path / "out.ass"), "ass")
+
+
+def test_language_tags_and_track_paths(tmp_path):
+    assert language_tag("pt-PT") == "por"
+    assert language_tag("ja") == "ja"
+    assert language_tag(None) is None
+
+    for index, language in ((1, None), (0, "por")):
+        (tmp_path / track_path("", index, language, "vtt")).write_text("WEBVTT\n")
+
+    assert [(t.path.rsplit("/", 1)[-1], t.language) for t in find_tracks(str(tmp_path))] == [
+        ("OK_subtitle.0.por.vtt", "por"),
+        ("OK_subtitle.1.und.vtt", None),
+    ]
@@ -0,0 +1,238 @@
+import threading
+import time
+
+import pytest
+
+import downloader
+import workqueue
+from config import Settings
+from jobdb import JobState
+from workqueue import DONE, FAILED, LEASED, QUEUED, Heartbeat, RedisQueue, SQLiteQueue
+
+URLS = ["https://www.example.com/videos/1", "https://www.example.com/videos/2"]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(workqueue.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def make_queue(request, tmp_path):
+    """Opens queues of either backend; Redis runs on fakeredis, with its Lua support."""
+    queues = []
+
+    if request.param == "redis":
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        server = fakeredis.FakeServer()
+
+    def make_queue(lease_time=60, max_attempts=2):
+        if request.param == "redis":
+            client = fakeredis.FakeStrictRedis(server=server)
+            queue = RedisQueue(client, lease_time=lease_time, max_attempts=max_attempts)
+        else:
+            path = str(tmp_path / "queue.db")
+            queue = SQLiteQueue(path, lease_time=lease_time, max_attempts=max_attempts)
+
+        queues.append(queue)
+        return queue
+
+    yield make_queue
+
+    for queue in queues:
+        queue.close()
+
+
+@pytest.fixture
+def queue(make_queue):
+    return make_queue()
+
+
+def test_put_skips_queued_urls(queue):
+    assert queue.put(URLS) == 2
+    assert queue.put(URLS[:1]) == 0
+    assert queue.counts() == {QUEUED: 2, LEASED: 0, DONE: 0, FAILED: 0}
+
+
+def test_claim_in_order_and_complete(queue):
+    queue.put(URLS)
+
+    first = queue.claim("a")
+    second = queue.claim("b")
+
+    assert (first.url, first.attempts) == (URLS[0], 1)
+    assert second.url == URLS[1]
+    assert queue.claim("c") is None
+
+    assert queue.complete(first)
+    assert not queue.complete(first)
+    assert queue.counts() == {QUEUED: 0, LEASED: 1, DONE: 1, FAILED: 0}
+
+
+def test_expired_lease_is_requeued_and_loses_ownership(queue, clock):
+    queue.put(URLS[:1])
+    lease = queue.claim("a")
+
+    clock.now += 30
+    assert queue.heartbeat(lease)
+    assert queue.requeue_expired() == 0
+
+    clock.now += 61
+    assert queue.requeue_expired() == 1
+
+    retry = queue.claim("b")
+    assert (retry.url, retry.attempts) == (URLS[0], 2)
+
+    # The first worker comes back: its lease is gone
+    assert not queue.heartbeat(lease)
+    assert not queue.complete(lease)
+    assert queue.complete(retry)
+
+
+def test_expired_lease_fails_after_max_attempts(queue, clock):
+    queue.put(URLS[:1])
+
+    for _ in range(2):
+        assert queue.claim("a") is not None
+        clock.now += 61
+        queue.requeue_expired()
+
+    assert queue.claim("a") is None
+    assert queue.counts()[FAILED] == 1
+
+    # Queuing a failed URL again retries it
+    assert queue.put(URLS[:1]) == 1
+    assert queue.claim("a").attempts == 1
+    assert queue.counts() == {QUEUED: 0, LEASED: 1, DONE: 0, FAILED: 0}
+
+
+def test_fail_requeues_until_max_attempts(queue):
+    queue.put(URLS[:1])
+
+    assert queue.fail(queue.claim("a"), "boom")
+    assert queue.counts()[QUEUED] == 1
+
+    assert queue.fail(queue.claim("a"), "boom")
+    assert queue.counts()[FAILED] == 1
+
+    # A finished URL is not queued again
+    queue.put(URLS[1:])
+    assert queue.complete(queue.claim("a"))
+    assert queue.put(URLS) == 1
+    assert queue.counts() == {QUEUED: 1, LEASED: 0, DONE: 1, FAILED: 0}
+
+
+def test_queues_are_shared_between_nodes(make_queue):
+    first, second = make_queue(), make_queue()
+    first.put(URLS)
+
+    assert second.put(URLS) == 0
+    assert {first.claim("a").url, second.claim("b").url} == set(URLS)
+    assert first.claim("a") is None
+    assert second.counts()[LEASED] == 2
+
+
+def test_redis_counters_of_an_older_queue_are_rebuilt(make_queue):
+    queue = make_queue()
+
+    if not isinstance(queue, RedisQueue):
+        pytest.skip("Redis only")
+
+    queue.put(URLS)
+    queue.complete(queue.claim("a"))
+    queue.client.delete(queue._key("counts"))
+
+    assert make_queue().counts() == {QUEUED: 1, LEASED: 0, DONE: 1, FAILED: 0}
+
+
+def test_heartbeat_reports_a_lost_lease(make_queue):
+    queue = make_queue(lease_time=0.03)
+    queue.put(URLS[:1])
+    lease = queue.claim("a")
+
+    with Heartbeat(queue, lease) as heartbeat:
+        time.sleep(0.02)
+        assert not heartbeat.lost.is_set()
+
+        queue.fail(lease, "taken over")
+        assert heartbeat.lost.wait(1)
+
+
+class FlakyQueue:
+    """Fails the first `failures` requeue_expired calls, as an unreachable queue would."""
+
+    def __init__(self, queue, failures):
+        self.queue = queue
+        self.failures = failures
+
+    def __getattr__(self, name):
+        return getattr(self.queue, name)
+
+    def requeue_expired(self):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("queue unreachable")
+
+        return self.queue.requeue_expired()
+
+
+def test_worker_survives_queue_errors(tmp_path, queue, monkeypatch):
+    monkeypatch.setattr(workqueue, "POLL_INTERVAL", 0)
+
+    def process_job(db, job, to_download_subtitles, settings, cancelled=None):
+        db.start(job)
+        db.advance(job, JobState.MUXED)
+        return job
+
+    monkeypatch.setattr(downloader, "process_job", process_job)
+
+    settings = Settings(
+        jobs=1,
+        job_db=str(tmp_path / "jobs.db"),
+        scratch_dir=str(tmp_path / "scratch"),
+    )
+    queue.put(URLS)
+
+    processed = workqueue.run_worker(FlakyQueue(queue, 2), drain=True, settings=settings)
+
+    assert sorted(job.url for job in processed) == URLS
+    assert queue.counts()[DONE] == 2
+
+
+def test_worker_leaves_a_lost_lease_to_its_new_owner(tmp_path, queue, monkeypatch):
+    queue.put(URLS[:1])
+    stop = threading.Event()
+    released = []
+
+    monkeypatch.setattr(queue, "complete", lambda lease: released.append(lease))
+    monkeypatch.setattr(queue, "fail", lambda lease, error: released.append(lease))
+
+    def process_job(db, job, to_download_subtitles, settings, cancelled=None):
+        # Another worker took the URL over while this one was downloading
+        cancelled.set()
+        stop.set()
+        db.start(job)
+        db.advance(job, JobState.MUXED)
+        return job
+
+    monkeypatch.setattr(downloader, "process_job", process_job)
+
+    settings = Settings(
+        jobs=1, job_db=str(tmp_path / "jobs.db"), scratch_dir=str(tmp_path / "scratch")
+    )
+
+    processed = workqueue.run_worker(queue, settings=settings, stop=stop)
+
+    assert [job.url for job in processed] == URLS[:1]
+    assert released == []
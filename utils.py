@@ -1,37 +1,47 @@
+import glob
 import os
 import re
 import logging
 import time
 
+from typing import Optional
+
 import requests
 import requests.exceptions
 
+import governor
+import retry
+
+from config import Settings
 from defaults import (
     DEFAULT_ENCRYPTED_VIDEO_FILENAME,
     DEFAULT_DECRYPTED_VIDEO_FILENAME,
     DEFAULT_DECRYPTED_AUDIO_FILENAME,
     DEFAULT_ENCRYPTED_AUDIO_FILENAME,
-    DEFAULT_TIMEOUT,
-)
-
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] [%(module)s.%(funcName)s:%(lineno)d] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
+    DEFAULT_SUBTITLE_FILENAME_PREFIX,
 )
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE: int = 64 * 1024
 
-def cleanup():
+
+def cleanup(workdir: str = "."):
     files_to_delete = [
-        DEFAULT_ENCRYPTED_AUDIO_FILENAME,
-        DEFAULT_DECRYPTED_AUDIO_FILENAME,
-        DEFAULT_ENCRYPTED_VIDEO_FILENAME,
-        DEFAULT_DECRYPTED_VIDEO_FILENAME,
+        os.path.join(workdir, filename)
+        for filename in (
+            DEFAULT_ENCRYPTED_AUDIO_FILENAME,
+            DEFAULT_DECRYPTED_AUDIO_FILENAME,
+            DEFAULT_ENCRYPTED_VIDEO_FILENAME,
+            DEFAULT_DECRYPTED_VIDEO_FILENAME,
+        )
     ]
 
+    # Subtitle tracks only exist when they were requested
+    files_to_delete += glob.glob(
+        os.path.join(glob.escape(workdir), f"{DEFAULT_SUBTITLE_FILENAME_PREFIX}.*")
+    )
+
     for file in files_to_delete:
         if os.path.exists(file):
             try:
@@ -43,12 +53,16 @@ def cleanup():
             logger.warning("File not found: {}".format(file))
 
 
+def directory_size(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
 def get_urls(text: str) -> list[str]:
     if text is None:
         raise ValueError("Input text cannot be None")
 
     if not isinstance(text, str):
-        logger.fatal("Invalid type for text: Expected str, got {}".format(type(text).__name__))
+        raise TypeError("Invalid type for text: Expected str, got {}".format(type(text).__name__))
 
     url_pattern = re.compile(r"(https?://[^\s]+)", re.IGNORECASE)
 
@@ -58,39 +72,66 @@ def get_urls(text: str) -> list[str]:
 def download_file(
     url: str,
     output_path: str,
-    max_retries: int = 3,
-    initial_delay: float = 1.0,
-    backoff_factor: float = 2.0,
-    timeout: int = DEFAULT_TIMEOUT,
+    settings: Optional[Settings] = None,
+    policy: Optional[retry.RetryPolicy] = None,
 ) -> bool:
     if not url:
-        raise ValueError("")
+        raise ValueError("url cannot be empty or None")
 
     if not isinstance(url, str):
-        logger.fatal("")
+        raise TypeError(f"Invalid type for url: Expected str, got {type(url).__name__}")
 
-    for attempt in range(max_retries + 1):
-        try:
-            logger.info(f"Downloading {url} (attempt {attempt + 1}/{max_retries + 1})")
+    if settings is None:
+        settings = Settings()
 
-            response = requests.get(url, timeout=timeout, stream=True)
-            response.raise_for_status()
+    if policy is None:
+        policy = retry.POLICY
 
-            with open(output_path, "wb") as f:
-                f.write(response.content)
+    host = governor.host_of(url)
+
+    # The connection slot is only held while transferring, not while backing off
+    def attempt():
+        with governor.GOVERNOR.connection(host):
+            _fetch(url, output_path, host, settings.timeout)
+
+    logger.info(f"Downloading {url}")
 
-            logger.info(f"Successfully downloaded {url}")
-            return True
+    try:
+        policy.call(attempt, description=f"Download of {url}")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Failed to download {url}: {e}")
+        return False
 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Attempt {attempt + 1} failed: {e}")
+    logger.info(f"Successfully downloaded {url}")
+    return True
 
-            if attempt < max_retries:
-                delay = initial_delay * (backoff_factor**attempt)
-                logger.info(f"Retrying in {delay:.1f} seconds...")
-                time.sleep(delay)
-            else:
-                logger.error(f"Failed to download {url} after {max_retries + 1} attempts")
-                return False
 
-    return False
+def _fetch(url: str, output_path: str, host: str, timeout: int) -> int:
+    """Stream `url` to `output_path`, reporting the transfer to the governor."""
+    start = time.monotonic()
+    nbytes = 0
+
+    try:
+        # Closing the response returns its connection to the pool on every path
+        with requests.get(url, timeout=timeout, stream=True) as response:
+            latency = time.monotonic() - start
+            response.raise_for_status()
+            status = response.status_code
+
+            with open(output_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    governor.GOVERNOR.throttle(len(chunk))
+                    f.write(chunk)
+                    nbytes += len(chunk)
+
+    except requests.exceptions.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        governor.GOVERNOR.record(host, latency=time.monotonic() - start, status=status)
+        raise
+    except requests.exceptions.RequestException:
+        governor.GOVERNOR.record(host, error=True)
+        raise
+
+    governor.GOVERNOR.record(host, nbytes, time.monotonic() - start, latency, status)
+
+    return nbytes
@@ -0,0 +1,608 @@
+"""
+Shared job queue for spreading batch downloads over several nodes.
+
+URLs are enqueued once (`--queue Q -f FILE`) and any number of workers
+(`--queue Q --worker`), on any number of nodes, claim them one at a time. A
+claim is a lease: the worker renews it with heartbeats while the job runs,
+and a lease that is not renewed in time (the node died or hung) expires and
+the URL is queued again for another worker. A URL whose job fails, or whose
+lease expires, too many times is marked failed. Each node runs
+`settings.jobs` jobs at a time through the usual per-URL pipeline
+(`downloader.process_job`), with its own job database and scratch directory.
+
+Two backends share the same interface: `SQLiteQueue`, a database file on
+shared storage (which must support POSIX locks, e.g. NFSv4; SQLite's WAL
+mode is not used for this reason), and `RedisQueue`, for any client with the
+redis-py command methods and Lua scripting (Redis, Valkey, KeyDB, or a local
+stand-in).
+"""
+
+import itertools
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+
+import downloader
+import progress
+from config import Settings
+from jobdb import Job, JobDB, JobState, normalize_url, output_filename_for
+from stream import container_extension
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+STATES = (QUEUED, LEASED, DONE, FAILED)
+
+# How often an idle worker looks for new URLs, in seconds
+POLL_INTERVAL: float = 5.0
+
+# URLs added to a SQLite queue per transaction
+PUT_BATCH_SIZE: int = 500
+
+# Heartbeats per lease period, so that one late heartbeat does not lose the lease
+HEARTBEATS_PER_LEASE: int = 3
+
+Lease = namedtuple("Lease", ["url", "token", "attempts"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    url TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    worker TEXT,
+    token TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    enqueued_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SQLiteQueue:
+    def __init__(self, path: str, lease_time: float, max_attempts: int):
+        if path is None:
+            raise ValueError("path cannot be None")
+
+        self.path: str = path
+        self.lease_time: float = lease_time
+        self.max_attempts: int = max_attempts
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        # Other nodes hold the database lock for short transactions only
+        self._conn = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _transaction(self, statements):
+        """Run `statements(conn)` in a write transaction and return its result."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+
+            try:
+                result = statements(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+            self._conn.execute("COMMIT")
+            return result
+
+    def put(self, urls: Iterable[str]) -> int:
+        """Queue `urls`, skipping the ones already queued or done; failed ones are retried."""
+        urls = iter(urls)
+        added = 0
+
+        # URLs may come from a followed file: do not hold the lock while waiting
+        while batch := list(itertools.islice(urls, PUT_BATCH_SIZE)):
+            now = time.time()
+
+            def put(conn):
+                return sum(
+                    conn.execute(
+                        "INSERT INTO queue (url, state, enqueued_at, updated_at) "
+                        "VALUES (?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET "
+                        "state = excluded.state, attempts = 0, error = NULL, "
+                        "enqueued_at = excluded.enqueued_at, updated_at = excluded.updated_at "
+                        "WHERE queue.state = ?",
+                        (normalize_url(url), QUEUED, now, now, FAILED),
+                    ).rowcount
+                    for url in batch
+                )
+
+            added += self._transaction(put)
+
+        return added
+
+    def claim(self, worker: str) -> Optional[Lease]:
+        now = time.time()
+        token = uuid.uuid4().hex
+
+        def claim(conn):
+            row = conn.execute(
+                "SELECT url, attempts FROM queue WHERE state = ? ORDER BY enqueued_at LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            conn.execute(
+                "UPDATE queue SET state = ?, worker = ?, token = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE url = ?",
+                (LEASED, worker, token, now + self.lease_time, now, row["url"]),
+            )
+
+            return Lease(row["url"], token, row["attempts"] + 1)
+
+        return self._transaction(claim)
+
+    def heartbeat(self, lease: Lease) -> bool:
+        """Extend `lease`; False if it expired and was given to another worker."""
+        now = time.time()
+
+        return self._update_leased(
+            lease, "lease_expires = ?, updated_at = ?", (now + self.lease_time, now)
+        )
+
+    def complete(self, lease: Lease) -> bool:
+        now = time.time()
+
+        return self._update_leased(
+            lease, "state = ?, token = NULL, lease_expires = NULL, updated_at = ?", (DONE, now)
+        )
+
+    def fail(self, lease: Lease, error: str) -> bool:
+        """Queue the URL again, or mark it failed once it used up its attempts."""
+        now = time.time()
+        state = FAILED if lease.attempts >= self.max_attempts else QUEUED
+
+        return self._update_leased(
+            lease,
+            "state = ?, token = NULL, lease_expires = NULL, error = ?, updated_at = ?",
+            (state, error, now),
+        )
+
+    def _update_leased(self, lease: Lease, columns: str, values: tuple) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE queue SET {columns} WHERE url = ? AND state = ? AND token = ?",
+                (*values, lease.url, LEASED, lease.token),
+            )
+
+        return cursor.rowcount == 1
+
+    def requeue_expired(self) -> int:
+        """Queue again the URLs whose lease was not renewed in time."""
+        now = time.time()
+
+        def requeue(conn):
+            conn.execute(
+                "UPDATE queue SET state = ?, token = NULL, lease_expires = NULL, "
+                "error = 'Lease expired', updated_at = ? "
+                "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, now, LEASED, now, self.max_attempts),
+            )
+
+            return conn.execute(
+                "UPDATE queue SET state = ?, token = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE state = ? AND lease_expires < ?",
+                (QUEUED, now, LEASED, now),
+            ).rowcount
+
+        return self._transaction(requeue)
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) AS n FROM queue GROUP BY state"
+            ).fetchall()
+
+        return {state: 0 for state in STATES} | {row["state"]: row["n"] for row in rows}
+
+
+def _str(value) -> Optional[str]:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+# Every RedisQueue script gets the same keys, and runs atomically: a lease
+# check and the writes that depend on it cannot interleave with another worker
+REDIS_KEYS = (
+    "pending",
+    "processing",
+    "leases",
+    "state",
+    "owners",
+    "attempts",
+    "errors",
+    "counts",
+)
+
+REDIS_PRELUDE = f"""
+local pending, processing, leases, state = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local owners, attempts, errors, counts = KEYS[5], KEYS[6], KEYS[7], KEYS[8]
+local QUEUED, LEASED, DONE, FAILED = '{QUEUED}', '{LEASED}', '{DONE}', '{FAILED}'
+
+-- Every state change goes through here, to keep the per-state counters exact
+local function set_state(url, new)
+    local old = redis.call('HGET', state, url)
+
+    if old then
+        redis.call('HINCRBY', counts, old, -1)
+    end
+
+    redis.call('HSET', state, url, new)
+    redis.call('HINCRBY', counts, new, 1)
+end
+
+local function release(url)
+    redis.call('ZREM', leases, url)
+    redis.call('HDEL', owners, url)
+    redis.call('LREM', processing, 0, url)
+end
+
+-- Retried URLs go to the front of the queue
+local function retry_or_fail(url, max_attempts)
+    if tonumber(redis.call('HGET', attempts, url) or 0) >= max_attempts then
+        set_state(url, FAILED)
+        return false
+    end
+
+    set_state(url, QUEUED)
+    redis.call('RPUSH', pending, url)
+    return true
+end
+"""
+
+# Counters of a queue created before they were kept: a one-off scan
+REDIS_RECOUNT = """
+if redis.call('EXISTS', counts) == 1 then
+    return 0
+end
+
+for _, value in ipairs(redis.call('HVALS', state)) do
+    redis.call('HINCRBY', counts, value, 1)
+end
+
+return 1
+"""
+
+# ARGV: url
+REDIS_PUT = """
+local url = ARGV[1]
+local current = redis.call('HGET', state, url)
+
+if current == FAILED then
+    redis.call('HDEL', attempts, url)
+    redis.call('HDEL', errors, url)
+elseif current then
+    return 0
+end
+
+set_state(url, QUEUED)
+redis.call('LPUSH', pending, url)
+return 1
+"""
+
+# ARGV: token, lease expiry; returns {url, attempts} or nil
+REDIS_CLAIM = """
+local url = redis.call('RPOPLPUSH', pending, processing)
+if not url then
+    return nil
+end
+
+redis.call('HSET', owners, url, ARGV[1])
+redis.call('ZADD', leases, ARGV[2], url)
+set_state(url, LEASED)
+return {url, redis.call('HINCRBY', attempts, url, 1)}
+"""
+
+# ARGV: url, token, lease expiry
+REDIS_HEARTBEAT = """
+if redis.call('HGET', owners, ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+
+redis.call('ZADD', leases, ARGV[3], ARGV[1])
+return 1
+"""
+
+# ARGV: url, token
+REDIS_COMPLETE = """
+if redis.call('HGET', owners, ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+
+release(ARGV[1])
+set_state(ARGV[1], DONE)
+return 1
+"""
+
+# ARGV: url, token, error, max attempts
+REDIS_FAIL = """
+if redis.call('HGET', owners, ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+
+release(ARGV[1])
+redis.call('HSET', errors, ARGV[1], ARGV[3])
+retry_or_fail(ARGV[1], tonumber(ARGV[4]))
+return 1
+"""
+
+# ARGV: now, max attempts; returns the number of expired leases
+REDIS_REQUEUE_EXPIRED = """
+local max_attempts = tonumber(ARGV[2])
+local expired = redis.call('ZRANGEBYSCORE', leases, '-inf', ARGV[1])
+
+for _, url in ipairs(expired) do
+    release(url)
+
+    if not retry_or_fail(url, max_attempts) then
+        redis.call('HSET', errors, url, 'Lease expired')
+    end
+end
+
+return #expired
+"""
+
+
+class RedisQueue:
+    """
+    Keys (under `prefix`): a `pending` list claimed from the right, a
+    `processing` list, a `leases` sorted set scored by expiry, and `state`,
+    `owners`, `attempts`, `errors` and `counts` (URLs per state) hashes. Every
+    operation is a Lua script, so the client must support `register_script`.
+    """
+
+    def __init__(self, client, lease_time: float, max_attempts: int, prefix: str = "opto-dl"):
+        if client is None:
+            raise ValueError("client cannot be None")
+
+        self.client = client
+        self.lease_time: float = lease_time
+        self.max_attempts: int = max_attempts
+        self.prefix: str = prefix
+        self._keys: list[str] = [self._key(name) for name in REDIS_KEYS]
+
+        self._put = self._script(REDIS_PUT)
+        self._claim = self._script(REDIS_CLAIM)
+        self._heartbeat = self._script(REDIS_HEARTBEAT)
+        self._complete = self._script(REDIS_COMPLETE)
+        self._fail = self._script(REDIS_FAIL)
+        self._requeue_expired = self._script(REDIS_REQUEUE_EXPIRED)
+
+        self._script(REDIS_RECOUNT)()
+
+    @staticmethod
+    def from_url(url: str, lease_time: float, max_attempts: int) -> "RedisQueue":
+        if redis is None:
+            raise ValueError("Redis queues need the redis module: pip install redis")
+
+        return RedisQueue(redis.Redis.from_url(url), lease_time, max_attempts)
+
+    def close(self):
+        self.client.close()
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}:{name}"
+
+    def _script(self, body: str):
+        script = self.client.register_script(REDIS_PRELUDE + body)
+        return lambda *args: script(keys=self._keys, args=list(args))
+
+    def put(self, urls: Iterable[str]) -> int:
+        return sum(int(self._put(normalize_url(url))) for url in urls)
+
+    def claim(self, worker: str) -> Optional[Lease]:
+        token = f"{worker}/{uuid.uuid4().hex}"
+        claimed = self._claim(token, time.time() + self.lease_time)
+
+        if claimed is None:
+            return None
+
+        url, attempts = claimed
+        return Lease(_str(url), token, int(attempts))
+
+    def heartbeat(self, lease: Lease) -> bool:
+        return bool(self._heartbeat(lease.url, lease.token, time.time() + self.lease_time))
+
+    def complete(self, lease: Lease) -> bool:
+        return bool(self._complete(lease.url, lease.token))
+
+    def fail(self, lease: Lease, error: str) -> bool:
+        return bool(self._fail(lease.url, lease.token, error, self.max_attempts))
+
+    def requeue_expired(self) -> int:
+        return int(self._requeue_expired(time.time(), self.max_attempts))
+
+    def counts(self) -> dict[str, int]:
+        counts = {state: 0 for state in STATES}
+
+        for state, n in self.client.hgetall(self._key("counts")).items():
+            counts[_str(state)] = int(n)
+
+        return counts
+
+
+def open_queue(spec: str, settings: Optional[Settings] = None):
+    """
+    The queue described by `spec`: redis://host:port/db (or rediss://), or
+    the path of a SQLite database, optionally as sqlite:///path.
+    """
+    if spec is None:
+        raise ValueError("spec cannot be None")
+
+    if settings is None:
+        settings = Settings()
+
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisQueue.from_url(spec, settings.lease_time, settings.queue_attempts)
+
+    if spec.startswith("sqlite://"):
+        spec = spec[len("sqlite://") :]
+
+    return SQLiteQueue(spec, settings.lease_time, settings.queue_attempts)
+
+
+class Heartbeat:
+    """Renews a lease in the background while its job runs."""
+
+    def __init__(self, queue, lease: Lease):
+        self.queue = queue
+        self.lease: Lease = lease
+
+        # Set once another worker owns the URL: the job must not write its output
+        self.lost = threading.Event()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="heartbeat", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.queue.lease_time / HEARTBEATS_PER_LEASE):
+            try:
+                if not self.queue.heartbeat(self.lease):
+                    logger.warning(f"Lost the lease of {self.lease.url} to another worker")
+                    self.lost.set()
+                    return
+            except Exception as e:
+                # The lease survives a few missed heartbeats
+                logger.warning(f"Heartbeat for {self.lease.url} failed: {e}")
+
+
+def run_worker(
+    queue,
+    to_download_subtitles: bool = False,
+    drain: bool = False,
+    settings: Optional[Settings] = None,
+    stop: Optional[threading.Event] = None,
+) -> list[Job]:
+    """
+    Process URLs from `queue`, `settings.jobs` at a time, until `stop` is set
+    or, with `drain`, until no URL is queued or leased by any worker.
+    """
+    if queue is None:
+        raise ValueError("queue cannot be None")
+
+    if settings is None:
+        settings = Settings()
+
+    if stop is None:
+        stop = threading.Event()
+
+    worker = worker_name()
+    extension = container_extension(settings.container)
+    progress.configure()
+
+    logger.info(f"Worker {worker} processing up to {settings.jobs} job(s) at a time")
+
+    processed: list[Job] = []
+
+    def step() -> bool:
+        """Run one claimed URL, or wait for one; False once drained."""
+        queue.requeue_expired()
+        lease = queue.claim(worker)
+
+        if lease is None:
+            counts = queue.counts()
+            if drain and counts[QUEUED] == 0 and counts[LEASED] == 0:
+                return False
+
+            stop.wait(POLL_INTERVAL)
+            return True
+
+        job, _ = db.add(lease.url, output_filename_for(lease.url, extension))
+
+        if job.done:
+            logger.info(f"Already downloaded {lease.url} -> {job.output_path}")
+            queue.complete(lease)
+            return True
+
+        logger.info(f"Claimed {lease.url} (attempt {lease.attempts})")
+        progress.TRACKER.add(job.key, job.url, downloader.job_workdir(job, settings))
+
+        with Heartbeat(queue, lease) as heartbeat:
+            job = downloader.process_job(
+                db, job, to_download_subtitles, settings, cancelled=heartbeat.lost
+            )
+
+        processed.append(job)
+
+        # The worker that took the URL over reports it
+        if heartbeat.lost.is_set():
+            logger.warning(f"Leaving {lease.url} to the worker that took over its lease")
+            return True
+
+        if job.state == JobState.MUXED:
+            released = queue.complete(lease)
+        else:
+            released = queue.fail(lease, job.error or "Unknown error")
+
+        if not released:
+            logger.warning(f"Lease of {lease.url} expired before the job ended")
+
+        return True
+
+    def work():
+        while not stop.is_set():
+            # A queue that is briefly unreachable must not stop the worker; an
+            # unreported lease expires and the URL is queued again
+            try:
+                if not step():
+                    return
+            except Exception as e:
+                logger.error(f"Worker {worker} failed: {e}, retrying in {POLL_INTERVAL:.0f}s")
+                stop.wait(POLL_INTERVAL)
+
+    with JobDB(settings.job_db) as db:
+        with ThreadPoolExecutor(max_workers=settings.jobs) as executor:
+            futures = [executor.submit(work) for _ in range(settings.jobs)]
+
+            try:
+                for future in futures:
+                    future.result()
+            except KeyboardInterrupt:
+                # Stop claiming and let the running jobs finish; if the process
+                # is killed instead, their leases expire and other workers take them
+                stop.set()
+                raise
+
+    return processed